@@ -0,0 +1,166 @@
+"""分析服务：在进程池中运行引擎搜索，避免CPU密集的计算阻塞asyncio事件循环
+
+- 局面以ChessBoard.to_state()的紧凑形式传给子进程
+- 同时进行的搜索数量不超过 CPU核数 × 每核搜索数，多余的请求排队等待
+- 局面在开局库或残局库中时直接返回库中的走法，不占用进程池
+- 每个搜索有一个用途（电脑走棋、某个玩家的提示），同一对局同一用途发起新的搜索时，
+  之前的搜索会被取消；有玩家走棋时对局的所有搜索都被取消，不同用途的搜索互不影响：
+  还在排队的直接取消，已经在子进程中运行的通过共享的取消标志提前结束
+"""
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from chess_ai import ChessAI
+from chess_board import ChessBoard
+from opening_book import open_book
+from tablebase import open_tablebase
+from transposition_table import TranspositionTable
+
+# 子进程中的全局状态：取消标志数组和置换表（在同一进程的多次搜索之间复用）
+_cancel_flags = None
+_worker_table = None
+
+
+def _init_worker(cancel_flags, table_mb):
+    """子进程初始化"""
+    global _cancel_flags, _worker_table
+    _cancel_flags = cancel_flags
+    _worker_table = TranspositionTable(max_mb=table_mb)
+
+
+def _search_worker(state, color, time_limit, slot):
+    """
+    在子进程中搜索
+    返回: (起始位置, 目标位置)，没有可走的棋或被取消时返回None
+    """
+    board = ChessBoard.from_state(state, _worker_table)
+    ai = ChessAI(color, time_limit=time_limit)
+    move = ai.choose_move(board, should_stop=lambda: _cancel_flags[slot] != 0)
+    if _cancel_flags[slot] != 0:
+        return None
+    return move
+
+
+class AnalysisService:
+    """基于ProcessPoolExecutor的分析服务"""
+    def __init__(self, max_workers=None, searches_per_core=1, table_mb=32, book_path=None,
+                 tablebase_dir=None):
+        """
+        max_workers: 子进程数量，默认等于CPU核数
+        searches_per_core: 每个核同时进行的搜索数
+        table_mb: 每个子进程置换表的内存上限（MB）
+        book_path: 开局库文件，文件不存在时不使用开局库
+        tablebase_dir: 残局库目录，目录不存在时不使用残局库
+        """
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_concurrent = self.max_workers * searches_per_core
+        self.table_mb = table_mb
+        self.book_path = book_path
+        self.book = None
+        self.tablebase_dir = tablebase_dir
+        self.tablebase = None
+        self._executor = None
+        self._semaphore = None
+        self._cancel_flags = None
+        self._free_slots = []
+        # 每个对局当前的搜索：game_id -> {用途: asyncio任务}
+        self._searches = {}
+
+    def start(self):
+        """创建进程池（需要在事件循环中调用）"""
+        self.book = open_book(self.book_path)
+        self.tablebase = open_tablebase(self.tablebase_dir)
+        self._cancel_flags = multiprocessing.Array('b', self.max_concurrent)
+        self._free_slots = list(range(self.max_concurrent))
+        self._semaphore = asyncio.Semaphore(self.max_concurrent)
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.max_workers, initializer=_init_worker,
+            initargs=(self._cancel_flags, self.table_mb))
+
+    async def shutdown(self):
+        """取消所有搜索并关闭进程池"""
+        for game_id in list(self._searches):
+            self.cancel(game_id)
+        if self._executor is not None:
+            await asyncio.to_thread(self._executor.shutdown, wait=True, cancel_futures=True)
+            self._executor = None
+        if self.book is not None:
+            self.book.close()
+            self.book = None
+        if self.tablebase is not None:
+            self.tablebase.close()
+            self.tablebase = None
+
+    async def search(self, game_id, board, color, time_limit=1.0, purpose='move'):
+        """
+        为对局的当前局面搜索最佳走法，同一对局同一用途之前的搜索会被取消
+        purpose: 搜索的用途，例如电脑走棋用'move'，提示用'hint:<玩家>'，
+                 玩家的提示不会取消电脑走棋的搜索
+        返回: (起始位置, 目标位置)，被取消或没有可走的棋时返回None
+        """
+        self.cancel(game_id, purpose)
+        # 开局库和残局库的查询只需要几微秒，直接在事件循环中完成
+        if self.book is not None:
+            move = self.book.choose(board)
+            if move:
+                return move
+        if self.tablebase is not None:
+            move = self.tablebase.best_move(board)
+            if move:
+                return move
+        task = asyncio.ensure_future(self._run(board.to_state(), color, time_limit))
+        self._searches.setdefault(game_id, {})[purpose] = task
+        try:
+            return await task
+        except asyncio.CancelledError:
+            # 只有搜索本身被取消时返回None，调用方被取消时继续抛出
+            if task.cancelled() and not asyncio.current_task().cancelling():
+                return None
+            raise
+        finally:
+            searches = self._searches.get(game_id)
+            if searches is not None and searches.get(purpose) is task:
+                del searches[purpose]
+                if not searches:
+                    del self._searches[game_id]
+
+    async def _run(self, state, color, time_limit):
+        """等待空闲名额后把搜索提交到进程池"""
+        async with self._semaphore:
+            slot = self._free_slots.pop()
+            self._cancel_flags[slot] = 0
+            future = self._executor.submit(_search_worker, state, color, time_limit, slot)
+            try:
+                return await asyncio.wrap_future(future)
+            except asyncio.CancelledError:
+                # 通知子进程停止，并等它真正结束后再释放名额，保证并发数不超过上限
+                self._cancel_flags[slot] = 1
+                if not future.cancel():
+                    try:
+                        await asyncio.wrap_future(future)
+                    except Exception:
+                        pass
+                raise
+            finally:
+                self._free_slots.append(slot)
+
+    def cancel(self, game_id, purpose=None):
+        """
+        取消对局正在进行或排队的搜索
+        purpose: 只取消该用途的搜索；为None时取消对局的所有搜索（例如玩家已经走棋，局面已经改变）
+        """
+        searches = self._searches.get(game_id)
+        if not searches:
+            return
+        if purpose is None:
+            tasks = list(searches.values())
+            searches.clear()
+        else:
+            task = searches.pop(purpose, None)
+            tasks = [task] if task is not None else []
+        if not searches:
+            del self._searches[game_id]
+        for task in tasks:
+            task.cancel()
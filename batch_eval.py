@@ -0,0 +1,345 @@
+"""批量局面评估：把大量局面打包成NumPy数组，用向量运算一次算出子力、位置分和机动性
+
+- 每个局面按 (颜色, 棋子类型) 展开为12个64格的平面，N个局面组成 (N, 12, 64) 的int8数组，
+  直接由位棋盘展开，不需要逐格访问 ChessBoard.board
+- 子力和位置分是平面与权重的一次矩阵乘法
+- 机动性在 (N,) 的uint64位棋盘数组上整体计算：马按8种跳法平移，车、相、后按方向做遮挡填充，
+  再统计位数，每种棋子只需几十次数组运算，与局面中的棋子个数无关
+- 子力和位置分与 chess_ai.evaluate 完全一致，机动性项与 mobility_score() 的逐个计算结果一致
+- NumPy 是可选依赖，没有安装时 evaluate_boards 逐个局面计算（结果相同，只是较慢）
+
+用法：
+    python batch_eval.py games.pgn                   # 评估棋谱中所有对局的每个局面
+    python batch_eval.py games.pgn --compare         # 同时逐个评估，比较结果和速度
+"""
+import argparse
+import json
+import sys
+import time
+
+from chess_ai import PIECE_SQUARE_TABLES, PIECE_VALUES, evaluate
+from chess_bitboard import (BISHOP_DIRECTIONS, COLORS, FILE_A, FULL_BOARD, KNIGHT_ATTACKS, PIECE_TYPES,
+                            QUEEN_DIRECTIONS, ROOK_DIRECTIONS, iter_squares, sliding_attacks)
+from chess_board import ChessBoard
+
+try:
+    import numpy as np
+except ImportError:  # 没有NumPy时只能逐个局面评估
+    np = None
+
+# 平面顺序：白方六种棋子，然后是黑方
+PLANES = tuple((color, piece_type) for color in COLORS for piece_type in PIECE_TYPES)
+# 每个可以到达的格子（不含己方棋子占据的格子）的机动性得分
+MOBILITY_WEIGHTS = {'knight': 4, 'bishop': 4, 'rook': 2, 'queen': 1}
+# 马的8种跳法 (行差, 列差)
+KNIGHT_OFFSETS = ((2, 1), (2, -1), (-2, 1), (-2, -1), (1, 2), (1, -2), (-1, 2), (-1, -2))
+# 每次向量运算处理的局面数，限制中间数组占用的内存（每个局面约3KB）
+CHUNK_SIZE = 4096
+
+
+def _shift_masks():
+    """每个方向（以及马的每个跳法）的格子编号偏移和平移后需要保留的格子，防止越过a、h列"""
+    def mask(col_diff):
+        kept = FULL_BOARD
+        for col in range(8):
+            if not 0 <= col - col_diff < 8:
+                kept &= ~(FILE_A << col)
+        return kept
+    return {offset: (offset[0] * 8 + offset[1], mask(offset[1]))
+            for offset in QUEEN_DIRECTIONS + KNIGHT_OFFSETS}
+
+
+def _weights():
+    """子力加位置分的权重向量，与展开的 (12, 64) 平面一一对应，黑方为负"""
+    weights = np.zeros((len(PLANES), 64), dtype=np.int32)
+    for plane, (color, piece_type) in enumerate(PLANES):
+        sign = 1 if color == 'white' else -1
+        weights[plane] = sign * (PIECE_VALUES[piece_type] +
+                                 np.array(PIECE_SQUARE_TABLES[color][piece_type], dtype=np.int32))
+    return weights.reshape(-1)
+
+
+if np is not None:
+    _WEIGHTS = _weights()
+    _SHIFTS = {offset: (shift, np.uint64(kept)) for offset, (shift, kept) in _shift_masks().items()}
+
+
+def _require_numpy():
+    if np is None:
+        raise RuntimeError('NumPy is required for batched evaluation (pip install .[analysis])')
+
+
+def _snapshot(board):
+    """局面的12个位棋盘和行棋方"""
+    pieces = board.bitboards.pieces
+    return [pieces[color][piece_type] for color, piece_type in PLANES], board.current_player == 'white'
+
+
+def _pack_snapshots(snapshots):
+    """把 _snapshot 的结果打包为 (平面数组, 行棋方数组)"""
+    count = len(snapshots)
+    bitboards = np.fromiter((bits for planes, _ in snapshots for bits in planes),
+                            dtype=np.uint64, count=count * len(PLANES))
+    planes = np.unpackbits(bitboards.astype('<u8').view(np.uint8), bitorder='little')
+    white_to_move = np.fromiter((white for _, white in snapshots), dtype=bool, count=count)
+    return planes.view(np.int8).reshape(count, len(PLANES), 64), white_to_move
+
+
+def pack_boards(boards):
+    """
+    打包一组棋盘
+    boards: ChessBoard 的可迭代对象
+    返回: (planes, white_to_move)，planes 为 (N, 12, 64) 的int8数组（平面顺序见PLANES），
+          white_to_move 为 (N,) 的布尔数组
+    """
+    _require_numpy()
+    return _pack_snapshots([_snapshot(board) for board in boards])
+
+
+def pack_fens(fens):
+    """
+    打包一组FEN局面
+    返回: 同 pack_boards
+    """
+    return pack_boards(ChessBoard.from_fen(fen) for fen in fens)
+
+
+def square_codes(planes):
+    """
+    把平面数组压缩为每格一个编码的 (N, 64) int8数组，适合保存大量局面
+    编码：0为空格，1到6为白方的 PIECE_TYPES 中的棋子，-1到-6为黑方
+    """
+    codes = np.array([(1 if color == 'white' else -1) * (PIECE_TYPES.index(piece_type) + 1)
+                      for color, piece_type in PLANES], dtype=np.int8)
+    return np.einsum('npq,p->nq', planes, codes).astype(np.int8)
+
+
+def _shift(bitboards, offset):
+    """把一组位棋盘的所有棋子沿一个方向平移一步，移出棋盘的丢弃"""
+    shift, kept = _SHIFTS[offset]
+    if shift > 0:
+        return (bitboards << np.uint64(shift)) & kept
+    return (bitboards >> np.uint64(-shift)) & kept
+
+
+def _slide(pieces, empty, direction):
+    """
+    一组滑动棋子沿一个方向的攻击范围（包含第一个阻挡的棋子）
+    同一方向上各棋子的射线互不重叠（后面的棋子挡住前面的射线），所以格子数等于各棋子的格子数之和
+    """
+    flood = pieces
+    for _ in range(6):
+        pieces = _shift(pieces, direction) & empty
+        flood = flood | pieces
+    return _shift(flood, direction)
+
+
+def _popcount(bitboards):
+    """每个64位整数中1的个数"""
+    pairs = np.uint64(0x3333333333333333)
+    bitboards = bitboards - ((bitboards >> np.uint64(1)) & np.uint64(0x5555555555555555))
+    bitboards = (bitboards & pairs) + ((bitboards >> np.uint64(2)) & pairs)
+    bitboards = (bitboards + (bitboards >> np.uint64(4))) & np.uint64(0x0F0F0F0F0F0F0F0F)
+    return ((bitboards * np.uint64(0x0101010101010101)) >> np.uint64(56)).astype(np.int32)
+
+
+def _mobility(bitboards):
+    """
+    一批局面的机动性得分（白方减黑方）
+    bitboards: (N, 12) 的uint64数组，顺序见PLANES
+    """
+    pieces = bitboards.reshape(len(bitboards), len(COLORS), len(PIECE_TYPES))
+    occupied = np.bitwise_or.reduce(pieces, axis=2)
+    empty = ~(occupied[:, 0] | occupied[:, 1])
+    score = np.zeros(len(bitboards), dtype=np.int32)
+    for index, sign in ((0, 1), (1, -1)):
+        own = pieces[:, index]
+        free = ~occupied[:, index]
+        # 每种跳法把每个马移到不同的格子，各跳法的格子数之和就是所有马的格子数之和
+        knights = own[:, PIECE_TYPES.index('knight')]
+        value = MOBILITY_WEIGHTS['knight'] * sum(_popcount(_shift(knights, offset) & free)
+                                                 for offset in KNIGHT_OFFSETS)
+        for piece_type, directions in (('bishop', BISHOP_DIRECTIONS), ('rook', ROOK_DIRECTIONS),
+                                       ('queen', QUEEN_DIRECTIONS)):
+            sliders = own[:, PIECE_TYPES.index(piece_type)]
+            value += MOBILITY_WEIGHTS[piece_type] * sum(_popcount(_slide(sliders, empty, direction) & free)
+                                                        for direction in directions)
+        score += sign * value
+    return score
+
+
+def evaluate_planes(planes, white_to_move, mobility=True):
+    """
+    评估打包好的局面
+    planes, white_to_move: pack_boards 的结果
+    mobility: 是否加上机动性项
+    返回: (N,) 的int32数组，从各局面行棋方角度的得分
+    """
+    _require_numpy()
+    scores = np.empty(len(planes), dtype=np.int32)
+    for start in range(0, len(planes), CHUNK_SIZE):
+        chunk = planes[start:start + CHUNK_SIZE]
+        score = chunk.reshape(len(chunk), -1).astype(np.int32) @ _WEIGHTS
+        if mobility:
+            bitboards = np.packbits(chunk, axis=-1, bitorder='little').view('<u8')[..., 0]
+            score += _mobility(bitboards.astype(np.uint64).reshape(len(chunk), -1))
+        scores[start:start + CHUNK_SIZE] = score
+    return np.where(white_to_move, scores, -scores)
+
+
+def mobility_score(board):
+    """
+    单个局面的机动性得分：马、相、车、后可以到达的格子数（不含己方棋子占据的格子）乘以权重
+    返回: 白方减黑方的得分
+    """
+    occupied = board.bitboards.all_occupied
+    score = 0
+    for color, sign in (('white', 1), ('black', -1)):
+        pieces = board.bitboards.pieces[color]
+        free = ~board.bitboards.occupied[color]
+        value = 0
+        for square in iter_squares(pieces['knight']):
+            value += MOBILITY_WEIGHTS['knight'] * (KNIGHT_ATTACKS[square] & free).bit_count()
+        for square in iter_squares(pieces['bishop']):
+            value += MOBILITY_WEIGHTS['bishop'] * (
+                sliding_attacks(square, occupied, BISHOP_DIRECTIONS) & free).bit_count()
+        for square in iter_squares(pieces['rook']):
+            value += MOBILITY_WEIGHTS['rook'] * (
+                sliding_attacks(square, occupied, ROOK_DIRECTIONS) & free).bit_count()
+        for square in iter_squares(pieces['queen']):
+            value += MOBILITY_WEIGHTS['queen'] * (
+                sliding_attacks(square, occupied, QUEEN_DIRECTIONS) & free).bit_count()
+        score += sign * value
+    return score
+
+
+def evaluate_board(board, mobility=True):
+    """
+    逐个计算的评估（evaluate_planes 的参照实现）
+    返回: 从行棋方角度的得分
+    """
+    score = evaluate(board)
+    if mobility:
+        extra = mobility_score(board)
+        score += extra if board.current_player == 'white' else -extra
+    return score
+
+
+def evaluate_boards(boards, mobility=True):
+    """
+    评估一组棋盘，有NumPy时批量计算
+    返回: 每个局面从行棋方角度的得分（NumPy数组；没有NumPy时为列表）
+    """
+    if np is None:
+        return [evaluate_board(board, mobility) for board in boards]
+    return evaluate_planes(*pack_boards(boards), mobility=mobility)
+
+
+def score_moves(board, mobility=True):
+    """
+    用一次批量评估给当前行棋方的所有合法走法打分（例如提示功能或搜索的最后一层）
+    返回: [(得分, 起始位置, 目标位置), ...]，得分从走棋方角度计算，按得分从高到低排列
+    """
+    moves = board.get_all_valid_moves()
+    if not moves:
+        return []
+    if np is None:
+        scores = []
+        for from_pos, to_pos in moves:
+            board.make_move(from_pos, to_pos)
+            scores.append(-evaluate_board(board, mobility))
+            board.unmake_move()
+    else:
+        snapshots = []
+        for from_pos, to_pos in moves:
+            board.make_move(from_pos, to_pos)
+            snapshots.append(_snapshot(board))
+            board.unmake_move()
+        scores = (-evaluate_planes(*_pack_snapshots(snapshots), mobility=mobility)).tolist()
+    return sorted(((score, from_pos, to_pos) for score, (from_pos, to_pos) in zip(scores, moves)),
+                  key=lambda item: -item[0])
+
+
+def _game_positions(path, keep_boards=False):
+    """
+    逐局回放棋谱
+    keep_boards: 为True时同时返回每个局面的棋盘副本（用于逐个评估比较）
+    返回: 生成器，每局产生 (快照列表, 棋盘列表)，都从初始局面开始
+    """
+    from pgn import parse_san, read_games
+
+    with open(path, encoding='utf-8') as f:
+        for game in read_games(f):
+            board = game.start_board()
+            snapshots = [_snapshot(board)]
+            boards = [board.copy()] if keep_boards else []
+            for san in game.moves:
+                try:
+                    from_pos, to_pos = parse_san(board, san)
+                except ValueError:
+                    break
+                if not board.move_piece(from_pos, to_pos):
+                    break
+                snapshots.append(_snapshot(board))
+                if keep_boards:
+                    boards.append(board.copy())
+            yield snapshots, boards
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='批量评估棋谱中的所有局面')
+    parser.add_argument('path', help='PGN文件')
+    parser.add_argument('--no-mobility', action='store_true', help='只计算子力和位置分')
+    parser.add_argument('--compare', action='store_true', help='同时逐个局面评估，比较结果和耗时')
+    args = parser.parse_args(argv)
+    if np is None:
+        print('需要安装NumPy：pip install .[analysis]', file=sys.stderr)
+        return 1
+    use_mobility = not args.no_mobility
+
+    games = positions = mismatches = 0
+    batch_seconds = single_seconds = 0.0
+    pending = []
+    pending_boards = []
+
+    def flush():
+        nonlocal batch_seconds, single_seconds, mismatches
+        start = time.perf_counter()
+        scores = evaluate_planes(*_pack_snapshots(pending), mobility=use_mobility)
+        batch_seconds += time.perf_counter() - start
+        if args.compare:
+            start = time.perf_counter()
+            expected = [evaluate_board(board, use_mobility) for board in pending_boards]
+            single_seconds += time.perf_counter() - start
+            mismatches += int((scores != np.array(expected, dtype=np.int32)).sum())
+            pending_boards.clear()
+        pending.clear()
+
+    for snapshots, boards in _game_positions(args.path, args.compare):
+        games += 1
+        positions += len(snapshots)
+        pending.extend(snapshots)
+        pending_boards.extend(boards)
+        if len(pending) >= CHUNK_SIZE:
+            flush()
+    if pending:
+        flush()
+
+    result = {
+        'games': games,
+        'positions': positions,
+        'mobility': use_mobility,
+        'seconds': round(batch_seconds, 6),
+        'positions_per_second': round(positions / batch_seconds) if batch_seconds > 0 else None,
+    }
+    if args.compare:
+        result['single_seconds'] = round(single_seconds, 6)
+        result['single_positions_per_second'] = (round(positions / single_seconds)
+                                                 if single_seconds > 0 else None)
+        result['mismatches'] = mismatches
+    print(json.dumps(result, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
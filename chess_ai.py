@@ -0,0 +1,305 @@
+"""电脑对手：迭代加深的Alpha-Beta搜索
+
+- 走法排序：置换表最佳走法、吃子（MVV-LVA）、杀手走法、其余走法
+- 静态搜索：叶子节点继续搜索吃子，避免在交换吃子中途停下评估
+- 时间控制：每步有墙钟时间预算，超时后返回上一轮完整搜索的结果
+本项目的规则以吃掉对方的王结束对局，所以搜索直接把吃王作为胜利处理。
+"""
+import time
+
+from chess_bitboard import iter_squares, position_of
+from transposition_table import EXACT, LOWER_BOUND, UPPER_BOUND, TranspositionTable
+
+PIECE_VALUES = {'king': 20000, 'queen': 900, 'rook': 500, 'bishop': 330, 'knight': 320, 'pawn': 100}
+# 吃掉对方的王的得分，减去层数后更快的胜利得分更高
+MATE_SCORE = 100000
+INFINITY = MATE_SCORE + 1
+# 每搜索这么多个节点检查一次时间
+TIME_CHECK_INTERVAL = 256
+MAX_PLY = 64
+# 静态搜索的Delta剪枝余量：吃掉这个棋子加上余量仍不能超过alpha时跳过
+DELTA_MARGIN = 200
+
+
+def _center_table(weight):
+    """生成按离中心距离递减的位置分表"""
+    table = []
+    for square in range(64):
+        row, col = position_of(square)
+        distance = max(abs(2 * row - 7), abs(2 * col - 7)) // 2  # 0（中心）到3（边缘）
+        table.append((3 - distance) * weight)
+    return table
+
+
+def _pawn_table(color):
+    """兵越往前分越高，中间列略高"""
+    table = []
+    for square in range(64):
+        row, col = position_of(square)
+        advance = row - 1 if color == 'white' else 6 - row
+        table.append(max(advance, 0) * 8 + (5 if col in (3, 4) and advance > 0 else 0))
+    return table
+
+
+# 位置分表（按格子编号）
+PIECE_SQUARE_TABLES = {
+    'white': {'pawn': _pawn_table('white'), 'knight': _center_table(10), 'bishop': _center_table(5),
+              'rook': _center_table(0), 'queen': _center_table(3), 'king': _center_table(-5)},
+    'black': {'pawn': _pawn_table('black'), 'knight': _center_table(10), 'bishop': _center_table(5),
+              'rook': _center_table(0), 'queen': _center_table(3), 'king': _center_table(-5)},
+}
+
+
+def evaluate(board):
+    """
+    静态评估：子力 + 位置分
+    返回: 从行棋方角度的得分（正数表示行棋方占优）
+    """
+    score = 0
+    for color, sign in (('white', 1), ('black', -1)):
+        for piece_type, pieces in board.bitboards.pieces[color].items():
+            if not pieces:
+                continue
+            value = PIECE_VALUES[piece_type] * pieces.bit_count()
+            table = PIECE_SQUARE_TABLES[color][piece_type]
+            for square in iter_squares(pieces):
+                value += table[square]
+            score += sign * value
+    return score if board.current_player == 'white' else -score
+
+
+def _score_to_table(score, ply):
+    """
+    把吃王得分从“距根节点的步数”换算为“距当前节点的步数”再存入置换表，
+    置换表在不同层数和不同搜索之间共享，其他得分不变
+    """
+    if score >= MATE_SCORE - MAX_PLY:
+        return score + ply
+    if score <= -MATE_SCORE + MAX_PLY:
+        return score - ply
+    return score
+
+
+def _score_from_table(score, ply):
+    """_score_to_table 的逆换算：从置换表取出的吃王得分换回距根节点的步数"""
+    if score >= MATE_SCORE - MAX_PLY:
+        return score - ply
+    if score <= -MATE_SCORE + MAX_PLY:
+        return score + ply
+    return score
+
+
+class SearchTimeout(Exception):
+    """搜索超出时间预算"""
+
+
+class ChessAI:
+    """电脑玩家"""
+    def __init__(self, color, time_limit=1.0, max_depth=MAX_PLY, transposition_table=None, book=None,
+                 tablebase=None):
+        """
+        color: 电脑执子颜色
+        time_limit: 每步的时间预算（秒）
+        max_depth: 最大搜索深度
+        transposition_table: 置换表，默认使用棋盘上的表或新建一个
+        book: 可选的OpeningBook，局面在开局库中时直接走开局库的棋，不再搜索
+        tablebase: 可选的Tablebase，局面在残局库中时直接走残局库的最佳走法，不再搜索
+        """
+        self.color = color
+        self.time_limit = time_limit
+        self.max_depth = max_depth
+        self.transposition_table = transposition_table
+        self.book = book
+        self.tablebase = tablebase
+        self.nodes = 0
+        self.depth_reached = 0
+        self._deadline = 0
+        self._killers = []
+        self._table = None
+        self._should_stop = None
+
+    def choose_move(self, board, should_stop=None):
+        """
+        为当前行棋方选择一步棋，保证在时间预算内返回
+        board: ChessBoard对象，搜索结束后局面保持不变
+        should_stop: 可选的无参函数，返回True时提前结束搜索（用于取消过期的搜索）
+        返回: (起始位置, 目标位置)，没有可走的棋时返回None
+        """
+        self.nodes = 0
+        self.depth_reached = 0
+        if self.book is not None:
+            move = self.book.choose(board)
+            if move:
+                return move
+        if self.tablebase is not None:
+            move = self.tablebase.best_move(board)
+            if move:
+                return move
+
+        root_moves = board.get_all_valid_moves()
+        if not root_moves:
+            return None
+
+        self._table = (self.transposition_table or board.transposition_table or
+                       TranspositionTable(max_mb=8))
+        self._killers = [[None, None] for _ in range(MAX_PLY + 1)]
+        self._deadline = time.perf_counter() + self.time_limit
+        self._should_stop = should_stop
+
+        best_move = root_moves[0]
+        for depth in range(1, self.max_depth + 1):
+            undo_depth = len(board.undo_stack)
+            try:
+                score, move = self._search_root(board, root_moves, depth, best_move)
+            except SearchTimeout:
+                # 恢复被中断的搜索留下的局面
+                while len(board.undo_stack) > undo_depth:
+                    board.unmake_move()
+                break
+            best_move = move
+            self.depth_reached = depth
+            # 已经找到必胜或必败的走法，不必再加深
+            if abs(score) >= MATE_SCORE - MAX_PLY:
+                break
+        return best_move
+
+    def _check_time(self):
+        self.nodes += 1
+        if self.nodes % TIME_CHECK_INTERVAL == 0 and (
+                time.perf_counter() > self._deadline or
+                (self._should_stop is not None and self._should_stop())):
+            raise SearchTimeout()
+
+    def _search_root(self, board, moves, depth, previous_best):
+        """根节点搜索：上一轮的最佳走法排在最前面"""
+        ordered = self._order_moves(board, moves, 0, previous_best)
+        alpha, beta = -INFINITY, INFINITY
+        best_move = ordered[0]
+        for from_pos, to_pos in ordered:
+            board.make_move(from_pos, to_pos)
+            score = -self._alpha_beta(board, depth - 1, -beta, -alpha, 1)
+            board.unmake_move()
+            if score > alpha:
+                alpha = score
+                best_move = (from_pos, to_pos)
+        self._table.store(board.zobrist_key, depth, _score_to_table(alpha, 0), EXACT, best_move)
+        return alpha, best_move
+
+    def _alpha_beta(self, board, depth, alpha, beta, ply):
+        """负极大值形式的Alpha-Beta搜索"""
+        self._check_time()
+        # 行棋方的王已经被吃掉，对局结束
+        if board.is_king_captured(board.current_player):
+            return -MATE_SCORE + ply
+        if depth <= 0 or ply >= MAX_PLY:
+            return self._quiescence(board, alpha, beta, ply)
+
+        key = board.zobrist_key
+        entry = self._table.probe(key)
+        tt_move = None
+        if entry is not None:
+            tt_move = entry.best_move
+            if entry.depth >= depth and entry.score is not None:
+                score = _score_from_table(entry.score, ply)
+                if entry.flag == EXACT:
+                    return score
+                if entry.flag == LOWER_BOUND and score >= beta:
+                    return score
+                if entry.flag == UPPER_BOUND and score <= alpha:
+                    return score
+
+        original_alpha = alpha
+        best_move = None
+        best_score = -INFINITY
+        for from_pos, to_pos in self._order_moves(board, board.get_all_valid_moves(), ply, tt_move):
+            capture = board.board[to_pos[0]][to_pos[1]] is not None
+            board.make_move(from_pos, to_pos)
+            score = -self._alpha_beta(board, depth - 1, -beta, -alpha, ply + 1)
+            board.unmake_move()
+            if score > best_score:
+                best_score = score
+                best_move = (from_pos, to_pos)
+            if score > alpha:
+                alpha = score
+            if alpha >= beta:
+                # 不吃子的截断走法记为杀手走法
+                if not capture:
+                    killers = self._killers[ply]
+                    if killers[0] != best_move:
+                        killers[1] = killers[0]
+                        killers[0] = best_move
+                break
+
+        if best_move is None:
+            return evaluate(board)
+        if best_score <= original_alpha:
+            flag = UPPER_BOUND
+        elif best_score >= beta:
+            flag = LOWER_BOUND
+        else:
+            flag = EXACT
+        self._table.store(key, depth, _score_to_table(best_score, ply), flag, best_move)
+        return best_score
+
+    def _quiescence(self, board, alpha, beta, ply):
+        """静态搜索：只搜索吃子走法"""
+        self._check_time()
+        if board.is_king_captured(board.current_player):
+            return -MATE_SCORE + ply
+        stand_pat = evaluate(board)
+        if stand_pat >= beta or ply >= MAX_PLY:
+            return stand_pat
+        if stand_pat > alpha:
+            alpha = stand_pat
+
+        for from_pos, to_pos in self._captures(board):
+            victim = board.board[to_pos[0]][to_pos[1]]
+            if stand_pat + PIECE_VALUES[victim.type] + DELTA_MARGIN < alpha:
+                continue
+            board.make_move(from_pos, to_pos)
+            score = -self._quiescence(board, -beta, -alpha, ply + 1)
+            board.unmake_move()
+            if score >= beta:
+                return score
+            if score > alpha:
+                alpha = score
+        return alpha
+
+    def _captures(self, board):
+        """生成行棋方的吃子走法，按MVV-LVA排序"""
+        color = board.current_player
+        bitboards = board.bitboards
+        opponent = bitboards.occupied['black' if color == 'white' else 'white']
+        captures = []
+        for from_square in iter_squares(bitboards.occupied[color]):
+            from_pos = position_of(from_square)
+            piece = board.board[from_pos[0]][from_pos[1]]
+            targets = bitboards.move_targets(from_square, color, piece.type, piece.has_moved) & opponent
+            for to_square in iter_squares(targets):
+                to_pos = position_of(to_square)
+                victim = board.board[to_pos[0]][to_pos[1]]
+                captures.append((PIECE_VALUES[victim.type] * 10 - PIECE_VALUES[piece.type] // 100,
+                                 from_pos, to_pos))
+        captures.sort(key=lambda item: item[0], reverse=True)
+        return [(from_pos, to_pos) for _, from_pos, to_pos in captures]
+
+    def _order_moves(self, board, moves, ply, best_move):
+        """走法排序：最佳走法 > 吃子（MVV-LVA） > 杀手走法 > 其他"""
+        killers = self._killers[ply] if ply < len(self._killers) else (None, None)
+        grid = board.board
+
+        def priority(move):
+            if move == best_move:
+                return 1000000
+            from_pos, to_pos = move
+            victim = grid[to_pos[0]][to_pos[1]]
+            if victim is not None:
+                attacker = grid[from_pos[0]][from_pos[1]]
+                return 100000 + PIECE_VALUES[victim.type] * 10 - PIECE_VALUES[attacker.type] // 100
+            if move == killers[0]:
+                return 90000
+            if move == killers[1]:
+                return 80000
+            return 0
+
+        return sorted(moves, key=priority, reverse=True)
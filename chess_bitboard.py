@@ -0,0 +1,227 @@
+"""位棋盘后端：用64位整数表示棋子分布，并预先计算各类棋子的攻击表
+
+格子编号 square = row * 8 + col，与 ChessBoard.board[row][col] 一一对应。
+白方在第0、1行，向行号增大的方向前进；黑方相反。
+"""
+
+COLORS = ('white', 'black')
+PIECE_TYPES = ('king', 'queen', 'rook', 'bishop', 'knight', 'pawn')
+
+FULL_BOARD = (1 << 64) - 1
+# 第0列（a列）和第7列（h列）的掩码，整体平移位棋盘时用于去掉跨行的位
+FILE_A = 0x0101010101010101
+FILE_H = FILE_A << 7
+FILE_AB = FILE_A | (FILE_A << 1)
+FILE_GH = FILE_H | (FILE_H >> 1)
+
+# 方向：(行增量, 列增量)
+ROOK_DIRECTIONS = ((1, 0), (-1, 0), (0, 1), (0, -1))
+BISHOP_DIRECTIONS = ((1, 1), (1, -1), (-1, 1), (-1, -1))
+QUEEN_DIRECTIONS = ROOK_DIRECTIONS + BISHOP_DIRECTIONS
+
+
+def square_of(row, col):
+    """(行, 列) 转换为格子编号"""
+    return row * 8 + col
+
+
+def position_of(square):
+    """格子编号转换为 (行, 列)"""
+    return divmod(square, 8)
+
+
+def iter_squares(bitboard):
+    """按格子编号从小到大遍历位棋盘中所有置位的格子"""
+    while bitboard:
+        low_bit = bitboard & -bitboard
+        yield low_bit.bit_length() - 1
+        bitboard ^= low_bit
+
+
+def _step_attacks(offsets):
+    """根据一组固定偏移生成64个格子的攻击表（用于马、王、兵）"""
+    table = []
+    for square in range(64):
+        row, col = position_of(square)
+        attacks = 0
+        for row_diff, col_diff in offsets:
+            to_row, to_col = row + row_diff, col + col_diff
+            if 0 <= to_row < 8 and 0 <= to_col < 8:
+                attacks |= 1 << square_of(to_row, to_col)
+        table.append(attacks)
+    return table
+
+
+def _ray_table(direction):
+    """生成某个方向上从每个格子出发、直到棋盘边缘的射线"""
+    row_diff, col_diff = direction
+    table = []
+    for square in range(64):
+        row, col = position_of(square)
+        ray = 0
+        to_row, to_col = row + row_diff, col + col_diff
+        while 0 <= to_row < 8 and 0 <= to_col < 8:
+            ray |= 1 << square_of(to_row, to_col)
+            to_row += row_diff
+            to_col += col_diff
+        table.append(ray)
+    return table
+
+
+KNIGHT_ATTACKS = _step_attacks(
+    [(2, 1), (2, -1), (-2, 1), (-2, -1), (1, 2), (1, -2), (-1, 2), (-1, -2)])
+KING_ATTACKS = _step_attacks(
+    [(1, 0), (-1, 0), (0, 1), (0, -1), (1, 1), (1, -1), (-1, 1), (-1, -1)])
+PAWN_ATTACKS = {
+    'white': _step_attacks([(1, 1), (1, -1)]),
+    'black': _step_attacks([(-1, 1), (-1, -1)]),
+}
+# 兵的直走表：按颜色和是否移动过区分，首步可以走一格或两格
+PAWN_PUSHES = {
+    'white': {True: _step_attacks([(1, 0)]), False: _step_attacks([(1, 0), (2, 0)])},
+    'black': {True: _step_attacks([(-1, 0)]), False: _step_attacks([(-1, 0), (-2, 0)])},
+}
+
+# 每个方向的射线表；正方向（格子编号增大）的第一个阻挡子取最低位，
+# 负方向取最高位
+RAYS = {direction: _ray_table(direction) for direction in QUEEN_DIRECTIONS}
+_POSITIVE = {direction: direction[0] * 8 + direction[1] > 0
+             for direction in QUEEN_DIRECTIONS}
+
+
+def sliding_attacks(square, occupied, directions):
+    """
+    计算滑动棋子（车、相、后）的攻击范围
+    square: 棋子所在格子编号
+    occupied: 全部棋子的位棋盘
+    directions: 可以移动的方向
+    返回: 攻击到的格子位棋盘（包含每个方向上第一个阻挡的棋子）
+    """
+    attacks = 0
+    for direction in directions:
+        ray = RAYS[direction][square]
+        blockers = ray & occupied
+        if blockers:
+            if _POSITIVE[direction]:
+                first = (blockers & -blockers).bit_length() - 1
+            else:
+                first = blockers.bit_length() - 1
+            ray ^= RAYS[direction][first]
+        attacks |= ray
+    return attacks
+
+
+def piece_attacks(piece_type, color, square, occupied):
+    """
+    获取棋子能够攻击（吃子）的格子
+    返回: 攻击范围位棋盘，不区分格子上是哪一方的棋子
+    """
+    if piece_type == 'knight':
+        return KNIGHT_ATTACKS[square]
+    if piece_type == 'king':
+        return KING_ATTACKS[square]
+    if piece_type == 'pawn':
+        return PAWN_ATTACKS[color][square]
+    if piece_type == 'rook':
+        return sliding_attacks(square, occupied, ROOK_DIRECTIONS)
+    if piece_type == 'bishop':
+        return sliding_attacks(square, occupied, BISHOP_DIRECTIONS)
+    return sliding_attacks(square, occupied, QUEEN_DIRECTIONS)
+
+
+def pawn_attack_map(pawns, color):
+    """整体计算一组兵的攻击范围"""
+    if color == 'white':
+        return ((pawns << 9) & ~FILE_A | (pawns << 7) & ~FILE_H) & FULL_BOARD
+    return (pawns >> 7) & ~FILE_A | (pawns >> 9) & ~FILE_H
+
+
+def knight_attack_map(knights):
+    """整体计算一组马的攻击范围"""
+    attacks = ((knights << 17) & ~FILE_A | (knights << 15) & ~FILE_H |
+               (knights << 10) & ~FILE_AB | (knights << 6) & ~FILE_GH |
+               (knights >> 15) & ~FILE_A | (knights >> 17) & ~FILE_H |
+               (knights >> 6) & ~FILE_AB | (knights >> 10) & ~FILE_GH)
+    return attacks & FULL_BOARD
+
+
+def king_attack_map(kings):
+    """整体计算王的攻击范围"""
+    sideways = ((kings << 1) & ~FILE_A | (kings >> 1) & ~FILE_H) & FULL_BOARD
+    row = kings | sideways
+    return (sideways | (row << 8) | (row >> 8)) & FULL_BOARD
+
+
+class BitboardPosition:
+    """位棋盘局面：按颜色和棋子类型分别保存一个64位整数"""
+    __slots__ = ('pieces', 'occupied', 'all_occupied')
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        """清空所有棋子"""
+        self.pieces = {color: {piece_type: 0 for piece_type in PIECE_TYPES}
+                       for color in COLORS}
+        self.occupied = {color: 0 for color in COLORS}
+        self.all_occupied = 0
+
+    def add_piece(self, square, color, piece_type):
+        """在指定格子放置棋子"""
+        bit = 1 << square
+        self.pieces[color][piece_type] |= bit
+        self.occupied[color] |= bit
+        self.all_occupied |= bit
+
+    def remove_piece(self, square, color, piece_type):
+        """移除指定格子上的棋子"""
+        mask = ~(1 << square)
+        self.pieces[color][piece_type] &= mask
+        self.occupied[color] &= mask
+        self.all_occupied &= mask
+
+    def move_piece(self, from_square, to_square, color, piece_type, captured=None):
+        """
+        移动棋子
+        captured: 被吃掉棋子的 (颜色, 类型)，没有吃子时为None
+        """
+        if captured:
+            self.remove_piece(to_square, *captured)
+        move_bits = (1 << from_square) | (1 << to_square)
+        self.pieces[color][piece_type] ^= move_bits
+        self.occupied[color] ^= move_bits
+        self.all_occupied = self.occupied['white'] | self.occupied['black']
+
+    def attack_map(self, color):
+        """
+        计算一方所有棋子攻击到的格子
+        兵、马、王使用整体平移一次算出，只有滑动棋子需要逐个计算
+        返回: 攻击范围位棋盘
+        """
+        pieces = self.pieces[color]
+        attacks = (pawn_attack_map(pieces['pawn'], color) |
+                   knight_attack_map(pieces['knight']) |
+                   king_attack_map(pieces['king']))
+        occupied = self.all_occupied
+        for square in iter_squares(pieces['rook'] | pieces['queen']):
+            attacks |= sliding_attacks(square, occupied, ROOK_DIRECTIONS)
+        for square in iter_squares(pieces['bishop'] | pieces['queen']):
+            attacks |= sliding_attacks(square, occupied, BISHOP_DIRECTIONS)
+        return attacks
+
+    def move_targets(self, square, color, piece_type, has_moved):
+        """
+        计算棋子按本项目规则可以到达的所有格子
+        square: 棋子所在格子编号
+        has_moved: 棋子是否移动过（兵的首步可以走两格）
+        返回: 目标格子的位棋盘
+        """
+        own = self.occupied[color]
+        if piece_type != 'pawn':
+            return piece_attacks(piece_type, color, square, self.all_occupied) & ~own
+
+        # 兵：斜向只能吃子，直走只能走到空格
+        opponent = self.occupied['black' if color == 'white' else 'white']
+        captures = PAWN_ATTACKS[color][square] & opponent
+        pushes = PAWN_PUSHES[color][has_moved][square] & ~self.all_occupied
+        return captures | pushes
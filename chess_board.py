@@ -1,15 +1,65 @@
+from chess_bitboard import BitboardPosition, iter_squares, position_of, square_of
+from chess_zobrist import BLACK_TO_MOVE_KEY, compute_key, piece_key
+
+PIECE_LETTERS = {'king': 'k', 'queen': 'q', 'rook': 'r', 'bishop': 'b', 'knight': 'n', 'pawn': 'p'}
+LETTER_PIECES = {letter: piece_type for piece_type, letter in PIECE_LETTERS.items()}
+
+
 class Piece:
-    """棋子类：表示棋盘上的每个棋子"""
-    def __init__(self, color, piece_type):
+    """
+    棋子类：表示棋盘上的每个棋子
+    ChessBoard内部使用shared_piece返回的共享实例，同一种棋子在所有棋盘中只有一个对象，
+    移动时换成另一个实例而不修改属性，所以棋盘上的棋子不能被修改
+    """
+    __slots__ = ('color', 'type', 'has_moved')
+
+    def __init__(self, color, piece_type, has_moved=False):
         self.color = color  # 'white' 或 'black'
         self.type = piece_type  # 'king', 'queen', 'rook', 'bishop', 'knight', 'pawn'
-        self.has_moved = False
+        self.has_moved = has_moved
+
+
+# 共享的棋子实例：(颜色, 棋子类型, 是否移动过) -> Piece
+_SHARED_PIECES = {(color, piece_type, has_moved): Piece(color, piece_type, has_moved)
+                  for color in ('white', 'black') for piece_type in PIECE_LETTERS
+                  for has_moved in (False, True)}
+
+
+def shared_piece(color, piece_type, has_moved=False):
+    """获取共享的棋子实例（不能修改）"""
+    return _SHARED_PIECES[(color, piece_type, has_moved)]
+
 
 class ChessBoard:
     """棋盘类：管理整个棋盘的状态和规则"""
-    def __init__(self):
+    __slots__ = ('transposition_table', 'zobrist_key', 'board', 'bitboards', 'king_squares',
+                 'attack_maps', 'attack_maps_valid', 'undo_stack', 'ply', '_move_map',
+                 'current_player', 'is_white_turn')
+
+    def __init__(self, transposition_table=None):
+        """
+        transposition_table: 可选的TranspositionTable，用于缓存走法列表和评估结果，
+                             可以在多个棋盘之间共享
+        """
+        self.transposition_table = transposition_table
+        # 当前局面的Zobrist哈希值
+        self.zobrist_key = 0
         # 创建8x8的空棋盘
         self.board = [[None for _ in range(8)] for _ in range(8)]
+        # 位棋盘后端，与self.board保持同步，用于走法校验和生成
+        self.bitboards = BitboardPosition()
+        # 双方王所在的格子编号（王被吃掉后为None）
+        self.king_squares = {'white': None, 'black': None}
+        # 双方攻击到的格子（位棋盘），move_piece后立即更新；
+        # 搜索中的make_move只把它标记为过期，等到查询时再计算
+        self.attack_maps = {'white': 0, 'black': 0}
+        self.attack_maps_valid = False
+        # 撤销栈，每步移动一条记录，供unmake_move使用
+        self.undo_stack = []
+        # 本局已经走过的步数（半回合数）
+        self.ply = 0
+        # 缓存的合法走法表：(局面哈希值, {起点格子: 目标格子位掩码})
+        self._move_map = None
         # 设置当前玩家（白方先行）
         self.current_player = 'white'
         # 初始化棋盘布局
@@ -21,13 +71,41 @@ class ChessBoard:
         # 设置白方棋子
         piece_order = ['rook', 'knight', 'bishop', 'queen', 'king', 'bishop', 'knight', 'rook']
         for i in range(8):
-            self.board[1][i] = Piece('white', 'pawn')
-            self.board[0][i] = Piece('white', piece_order[i])
+            self.board[1][i] = shared_piece('white', 'pawn')
+            self.board[0][i] = shared_piece('white', piece_order[i])
 
         # 设置黑方棋子
         for i in range(8):
-            self.board[6][i] = Piece('black', 'pawn')
-            self.board[7][i] = Piece('black', piece_order[i])
+            self.board[6][i] = shared_piece('black', 'pawn')
+            self.board[7][i] = shared_piece('black', piece_order[i])
+
+        self._sync_bitboards()
+
+    def _sync_bitboards(self):
+        """根据self.board重新生成位棋盘"""
+        self.bitboards.clear()
+        for row in range(8):
+            for col in range(8):
+                piece = self.board[row][col]
+                if piece:
+                    self.bitboards.add_piece(square_of(row, col), piece.color, piece.type)
+        for color in self.king_squares:
+            kings = self.bitboards.pieces[color]['king']
+            self.king_squares[color] = kings.bit_length() - 1 if kings else None
+        self._update_attack_maps()
+        self.zobrist_key = compute_key(self)
+
+    def _update_attack_maps(self):
+        """重新计算双方的攻击范围"""
+        self.attack_maps['white'] = self.bitboards.attack_map('white')
+        self.attack_maps['black'] = self.bitboards.attack_map('black')
+        self.attack_maps_valid = True
+
+    def get_attack_map(self, color):
+        """获取一方的攻击范围位棋盘，过期时先重新计算"""
+        if not self.attack_maps_valid:
+            self._update_attack_maps()
+        return self.attack_maps[color]
 
     def is_valid_move(self, from_pos, to_pos):
         """
@@ -45,81 +123,15 @@ class ChessBoard:
             return False
 
         piece = self.board[from_row][from_col]
-        target = self.board[to_row][to_col]
 
         # 检查起始位置是否有棋子
         if not piece or piece.color != self.current_player:
             return False
 
-        # 检查目标位置是否为己方棋子
-        if target and target.color == piece.color:
-            return False
-
-        # 计算移动的距离
-        row_diff = to_row - from_row
-        col_diff = to_col - from_col
-
-        # 根据不同棋子类型检查移动规则
-        valid = False
-        if piece.type == 'pawn':
-            # 兵的移动规则
-            direction = 1 if piece.color == 'white' else -1
-            if not piece.has_moved:
-                valid = (col_diff == 0 and row_diff == direction * 2) or \
-                       (col_diff == 0 and row_diff == direction)
-            else:
-                valid = col_diff == 0 and row_diff == direction
-
-            # 兵吃子规则
-            if target:
-                valid = abs(col_diff) == 1 and row_diff == direction
-
-        elif piece.type == 'rook':
-            # 车的移动规则
-            valid = (row_diff == 0 or col_diff == 0) and \
-                   self._is_path_clear(from_pos, to_pos)
-
-        elif piece.type == 'knight':
-            # 马的移动规则
-            valid = (abs(row_diff), abs(col_diff)) in [(2, 1), (1, 2)]
-
-        elif piece.type == 'bishop':
-            # 相的移动规则
-            valid = abs(row_diff) == abs(col_diff) and \
-                   self._is_path_clear(from_pos, to_pos)
-
-        elif piece.type == 'queen':
-            # 后的移动规则
-            valid = (row_diff == 0 or col_diff == 0 or
-                    abs(row_diff) == abs(col_diff)) and \
-                   self._is_path_clear(from_pos, to_pos)
-
-        elif piece.type == 'king':
-            # 王的移动规则
-            valid = abs(row_diff) <= 1 and abs(col_diff) <= 1
-
-        return valid
-
-    def _is_path_clear(self, from_pos, to_pos):
-        """
-        检查两点之间的路径是否有其他棋子阻挡
-        from_pos: 起始位置
-        to_pos: 目标位置
-        返回: 布尔值，表示路径是否通畅
-        """
-        from_row, from_col = from_pos
-        to_row, to_col = to_pos
-
-        row_dir = 0 if to_row == from_row else (to_row - from_row) // abs(to_row - from_row)
-        col_dir = 0 if to_col == from_col else (to_col - from_col) // abs(to_col - from_col)
-
-        current_row, current_col = from_row + row_dir, from_col + col_dir
-        while (current_row, current_col) != (to_row, to_col):
-            if self.board[current_row][current_col]:
-                return False
-            current_row += row_dir
-            current_col += col_dir
-        return True
+        # 查询位棋盘中该棋子的目标格子
+        targets = self.bitboards.move_targets(
+            square_of(from_row, from_col), piece.color, piece.type, piece.has_moved)
+        return bool(targets >> square_of(to_row, to_col) & 1)
 
     def is_king_in_check(self, color):
         """
@@ -127,47 +139,182 @@ class ChessBoard:
         color: 要检查的王的颜色
         返回: 布尔值，表示是否被将军
         """
-        # 找到王的位置
-        king_pos = None
-        for row in range(8):
-            for col in range(8):
-                piece = self.board[row][col]
-                if piece and piece.color == color and piece.type == 'king':
-                    king_pos = (row, col)
-                    break
-            if king_pos:
-                break
-
+        king_square = self.king_squares[color]
         # 如果找不到王，说明王已经被吃掉，返回False
-        if not king_pos:
+        if king_square is None:
             return False
 
-        # 检查对方所有棋子是否可以吃到王
+        # 检查王所在格子是否在对方的攻击范围内
         opponent_color = 'black' if color == 'white' else 'white'
-        for row in range(8):
-            for col in range(8):
-                piece = self.board[row][col]
-                if piece and piece.color == opponent_color:
-                    if self.is_valid_move((row, col), king_pos):
-                        return True
-        return False
+        return bool(self.get_attack_map(opponent_color) >> king_square & 1)
 
     def is_king_captured(self, color):
         """检查指定颜色的国王是否还在棋盘上"""
-        for row in range(8):
-            for col in range(8):
-                piece = self.board[row][col]
-                if piece and piece.color == color and piece.type == 'king':
-                    return False
-        return True
+        return self.king_squares[color] is None
+
+    def is_game_over(self):
+        """检查对局是否已经结束（任意一方的王被吃掉）"""
+        return self.king_squares['white'] is None or self.king_squares['black'] is None
+
+    def is_square_attacked(self, pos, by_color):
+        """
+        检查某个格子是否被指定一方攻击
+        pos: (行, 列)元组
+        by_color: 进攻方颜色
+        返回: 布尔值
+        """
+        return bool(self.get_attack_map(by_color) >> square_of(*pos) & 1)
 
     def reset_board(self):
         """重置棋盘到初始状态"""
         self.board = [[None for _ in range(8)] for _ in range(8)]
         self.current_player = 'white'
+        self.undo_stack = []
+        self.ply = 0
         self.initialize_board()
         self.is_white_turn = True  # 重置游戏时重置为白方回合
 
+    def load_position(self, board, current_player, ply=0):
+        """
+        载入任意局面
+        board: 8x8的Piece二维列表（None表示空格），棋子会被换成共享实例
+        current_player: 行棋方 'white' 或 'black'
+        ply: 该局面之前已经走过的步数
+        """
+        for row in board:
+            for col, piece in enumerate(row):
+                if piece is not None:
+                    row[col] = shared_piece(piece.color, piece.type, piece.has_moved)
+        self.board = board
+        self.current_player = current_player
+        self.is_white_turn = current_player == 'white'
+        self.undo_stack = []
+        self.ply = ply
+        self._sync_bitboards()
+
+    def copy(self):
+        """
+        复制当前局面（不包括撤销栈），置换表与原棋盘共享
+        返回: 新的ChessBoard对象
+        """
+        # 棋子是共享的只读实例，只需要复制每一行的列表
+        grid = [row[:] for row in self.board]
+        board = ChessBoard(self.transposition_table)
+        board.load_position(grid, self.current_player, self.ply)
+        return board
+
+    def to_state(self):
+        """
+        导出紧凑的局面状态，可以pickle或转为JSON，用于进程间传递和保存
+        返回: (64个字符的棋子布局, 移动过的棋子的格子位掩码, 行棋方)
+              布局按格子编号排列，大写为白方，'.'为空格
+        """
+        placement = []
+        moved_mask = 0
+        for square in range(64):
+            piece = self.board[square >> 3][square & 7]
+            if piece is None:
+                placement.append('.')
+                continue
+            letter = PIECE_LETTERS[piece.type]
+            placement.append(letter.upper() if piece.color == 'white' else letter)
+            if piece.has_moved:
+                moved_mask |= 1 << square
+        return ''.join(placement), moved_mask, self.current_player
+
+    @classmethod
+    def from_state(cls, state, transposition_table=None, ply=0):
+        """
+        根据to_state的结果创建棋盘
+        ply: 该局面之前已经走过的步数
+        返回: 新的ChessBoard对象
+        """
+        placement, moved_mask, current_player = state
+        grid = [[None for _ in range(8)] for _ in range(8)]
+        for square, letter in enumerate(placement):
+            if letter == '.':
+                continue
+            grid[square >> 3][square & 7] = shared_piece(
+                'white' if letter.isupper() else 'black', LETTER_PIECES[letter.lower()],
+                bool(moved_mask >> square & 1))
+        board = cls(transposition_table)
+        board.load_position(grid, current_player, ply)
+        return board
+
+    def to_fen(self):
+        """
+        导出FEN字符串
+        本项目没有王车易位和吃过路兵，这两个字段总是'-'；不记录五十步规则，半回合计数总是0
+        返回: 例如 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w - - 0 1'
+        """
+        ranks = []
+        for row in range(7, -1, -1):
+            rank = ''
+            empty = 0
+            for col in range(8):
+                piece = self.board[row][col]
+                if piece is None:
+                    empty += 1
+                    continue
+                if empty:
+                    rank += str(empty)
+                    empty = 0
+                letter = PIECE_LETTERS[piece.type]
+                rank += letter.upper() if piece.color == 'white' else letter
+            if empty:
+                rank += str(empty)
+            ranks.append(rank)
+        return f"{'/'.join(ranks)} {self.current_player[0]} - - 0 {self.ply // 2 + 1}"
+
+    def load_fen(self, fen):
+        """
+        载入FEN字符串描述的局面，王车易位和吃过路兵字段被忽略
+        不在初始行的兵视为已经移动过
+        """
+        fields = fen.split()
+        if not 1 <= len(fields) <= 6:
+            raise ValueError(f'Invalid FEN: {fen}')
+        ranks = fields[0].split('/')
+        if len(ranks) != 8:
+            raise ValueError(f'Invalid FEN: {fen}')
+        grid = [[None for _ in range(8)] for _ in range(8)]
+        for index, rank in enumerate(ranks):
+            row = 7 - index
+            col = 0
+            for char in rank:
+                if char.isdigit():
+                    col += int(char)
+                    continue
+                piece_type = LETTER_PIECES.get(char.lower())
+                if piece_type is None or col > 7:
+                    raise ValueError(f'Invalid FEN: {fen}')
+                color = 'white' if char.isupper() else 'black'
+                has_moved = piece_type == 'pawn' and row != (1 if color == 'white' else 6)
+                grid[row][col] = shared_piece(color, piece_type, has_moved)
+                col += 1
+            if col != 8:
+                raise ValueError(f'Invalid FEN: {fen}')
+        side = fields[1] if len(fields) > 1 else 'w'
+        if side not in ('w', 'b'):
+            raise ValueError(f'Invalid FEN: {fen}')
+        try:
+            fullmove = int(fields[5]) if len(fields) > 5 else 1
+        except ValueError:
+            raise ValueError(f'Invalid FEN: {fen}') from None
+        current_player = 'white' if side == 'w' else 'black'
+        ply = max(fullmove - 1, 0) * 2 + (current_player == 'black')
+        self.load_position(grid, current_player, ply)
+
+    @classmethod
+    def from_fen(cls, fen, transposition_table=None):
+        """
+        根据FEN字符串创建棋盘
+        返回: 新的ChessBoard对象
+        """
+        board = cls(transposition_table)
+        board.load_fen(fen)
+        return board
+
     def move_piece(self, from_pos, to_pos):
         """
         执行棋子移动
@@ -176,15 +323,94 @@ class ChessBoard:
         返回: 布尔值，表示移动是否成功
         """
         if self.is_valid_move(from_pos, to_pos):
-            piece = self.board[from_pos[0]][from_pos[1]]
-            self.board[to_pos[0]][to_pos[1]] = piece
-            self.board[from_pos[0]][from_pos[1]] = None
-            piece.has_moved = True
-            self.current_player = 'black' if self.current_player == 'white' else 'white'
-            self.is_white_turn = not self.is_white_turn  # 移动成功后切换回合
+            self.make_move(from_pos, to_pos)
+            self._update_attack_maps()
             return True
         return False
 
+    def make_move(self, from_pos, to_pos):
+        """
+        执行移动并把撤销记录压入栈中（不检查合法性，供搜索等已知合法的走法使用）
+        from_pos: 起始位置
+        to_pos: 目标位置
+        """
+        piece = self.board[from_pos[0]][from_pos[1]]
+        target = self.board[to_pos[0]][to_pos[1]]
+        from_square, to_square = square_of(*from_pos), square_of(*to_pos)
+        # 撤销记录：起点、终点、被吃的棋子、移动前的棋子、行棋方、
+        # 双方攻击范围（已过期时为None）、哈希值
+        attacks = ((self.attack_maps['white'], self.attack_maps['black'])
+                   if self.attack_maps_valid else None)
+        self.undo_stack.append((from_pos, to_pos, target, piece, self.current_player,
+                                attacks, self.zobrist_key))
+
+        # 增量更新哈希值：移出起点的棋子和被吃的棋子，再放入终点的棋子
+        key = self.zobrist_key ^ piece_key(from_square, piece) ^ BLACK_TO_MOVE_KEY
+        if target:
+            key ^= piece_key(to_square, target)
+
+        self.bitboards.move_piece(
+            from_square, to_square, piece.color, piece.type,
+            (target.color, target.type) if target else None)
+        if not piece.has_moved:
+            piece = shared_piece(piece.color, piece.type, True)
+        self.board[to_pos[0]][to_pos[1]] = piece
+        self.board[from_pos[0]][from_pos[1]] = None
+        self.zobrist_key = key ^ piece_key(to_square, piece)
+        if piece.type == 'king':
+            self.king_squares[piece.color] = to_square
+        if target and target.type == 'king':
+            self.king_squares[target.color] = None
+        self.attack_maps_valid = False
+        self.current_player = 'black' if self.current_player == 'white' else 'white'
+        self.is_white_turn = not self.is_white_turn  # 移动成功后切换回合
+        self.ply += 1
+
+    def unmake_move(self):
+        """
+        撤销最近一次移动（悔棋或搜索回溯）
+        返回: 被撤销的 (起始位置, 目标位置)，没有可撤销的移动时返回None
+        """
+        if not self.undo_stack:
+            return None
+        from_pos, to_pos, target, piece, player, attacks, key = self.undo_stack.pop()
+
+        self.bitboards.move_piece(square_of(*to_pos), square_of(*from_pos), piece.color, piece.type)
+        if target:
+            self.bitboards.add_piece(square_of(*to_pos), target.color, target.type)
+        self.board[from_pos[0]][from_pos[1]] = piece
+        self.board[to_pos[0]][to_pos[1]] = target
+        if piece.type == 'king':
+            self.king_squares[piece.color] = square_of(*from_pos)
+        if target and target.type == 'king':
+            self.king_squares[target.color] = square_of(*to_pos)
+        if attacks is None:
+            self.attack_maps_valid = False
+        else:
+            self.attack_maps['white'], self.attack_maps['black'] = attacks
+            self.attack_maps_valid = True
+        self.zobrist_key = key
+        self.current_player = player
+        self.is_white_turn = player == 'white'
+        self.ply -= 1
+        return from_pos, to_pos
+
+    def trim_history(self, keep):
+        """
+        只保留最近keep步的撤销记录，更早的走法不能再撤销
+        用于长期保存的棋盘（例如服务器上的对局），使内存不随对局长度增长
+        """
+        if len(self.undo_stack) > keep:
+            del self.undo_stack[:len(self.undo_stack) - keep]
+
+    def repetition_count(self):
+        """
+        统计当前局面在本局中出现过的次数（包括当前这一次）
+        返回: 整数
+        """
+        key = self.zobrist_key
+        return 1 + sum(1 for record in self.undo_stack if record[-1] == key)
+
     def get_piece(self, row, col):
         """
         获取指定位置的棋子
@@ -203,9 +429,66 @@ class ChessBoard:
         col: 列号
         返回: 所有可能的移动位置列表 [(row, col), ...]
         """
-        valid_moves = []
-        for to_row in range(8):
-            for to_col in range(8):
-                if self.is_valid_move((row, col), (to_row, to_col)):
-                    valid_moves.append((to_row, to_col))
-        return valid_moves
+        piece = self.get_piece(row, col)
+        if not piece or piece.color != self.current_player:
+            return []
+        targets = self.bitboards.move_targets(
+            square_of(row, col), piece.color, piece.type, piece.has_moved)
+        return [position_of(square) for square in iter_squares(targets)]
+
+    def legal_move_map(self):
+        """
+        当前行棋方的合法走法表，同一局面只计算一次
+        返回: {起点格子编号: 目标格子的位掩码}，只包含有走法的棋子；对局结束后为空
+        """
+        if self.is_game_over():
+            return {}
+        if self._move_map is not None and self._move_map[0] == self.zobrist_key:
+            return self._move_map[1]
+        move_map = {}
+        color = self.current_player
+        for from_square in iter_squares(self.bitboards.occupied[color]):
+            piece = self.board[from_square >> 3][from_square & 7]
+            targets = self.bitboards.move_targets(from_square, color, piece.type, piece.has_moved)
+            if targets:
+                move_map[from_square] = targets
+        self._move_map = (self.zobrist_key, move_map)
+        return move_map
+
+    def is_legal_move(self, from_pos, to_pos):
+        """
+        用缓存的合法走法表检查移动是否合法（对局结束前与is_valid_move结果相同）
+        from_pos: 起始位置的(行,列)元组
+        to_pos: 目标位置的(行,列)元组
+        返回: 布尔值，表示移动是否合法
+        """
+        if not (0 <= from_pos[0] <= 7 and 0 <= from_pos[1] <= 7 and
+                0 <= to_pos[0] <= 7 and 0 <= to_pos[1] <= 7):
+            return False
+        targets = self.legal_move_map().get(square_of(*from_pos), 0)
+        return bool(targets >> square_of(*to_pos) & 1)
+
+    def get_all_valid_moves(self):
+        """
+        获取当前行棋方所有棋子的合法移动
+        设置了置换表时，已经见过的局面直接从表中取出走法列表
+        返回: [((起始行, 起始列), (目标行, 目标列)), ...]
+        """
+        table = self.transposition_table
+        if table is not None:
+            moves = table.probe_moves(self.zobrist_key)
+            if moves is not None:
+                return moves
+
+        moves = []
+        color = self.current_player
+        for from_square in iter_squares(self.bitboards.occupied[color]):
+            from_pos = position_of(from_square)
+            piece = self.board[from_pos[0]][from_pos[1]]
+            targets = self.bitboards.move_targets(from_square, color, piece.type, piece.has_moved)
+            for to_square in iter_squares(targets):
+                moves.append((from_pos, position_of(to_square)))
+
+        if table is not None:
+            table.store_moves(self.zobrist_key, moves)
+        return moves
@@ -29,6 +29,8 @@ class ChessUI:
         self.font = pygame.font.SysFont('SimHei', 28)  # 从50改为28
         self.game_over = False
         self.winner = None
+        # 由电脑执子的颜色，轮到电脑时忽略鼠标点击
+        self.ai_color = None
         self.font_large = pygame.font.SysFont('SimHei', 30)  # 从36改为30
         self.timer_font = pygame.font.Font(None, 24)  # 从48改为24
 
@@ -43,6 +45,17 @@ class ChessUI:
         self.VALID_MOVE_COLOR = (0, 255, 0, 76)   # 绿色，半透明
         self.selected_piece = None
 
+        # 预先渲染的棋子文字和高亮遮罩
+        self._build_surfaces()
+        # 选中棋子的可移动位置缓存：((选中位置, 局面哈希值), 可移动位置)
+        self._selection_cache = None
+        # 上次绘制的内容，用于只重绘发生变化的部分
+        self.timer_rect = pygame.Rect(0, 0, 8 * self.square_size, self.board_start_y)
+        self.drawn_squares = [[None] * 8 for _ in range(8)]
+        self.drawn_timer = None
+        self.drawn_game_over = False
+        self.full_redraw = True
+
     def load_images(self):
         """加载棋子图片（预留功能）"""
         self.pieces_images = {}
@@ -69,101 +82,149 @@ class ChessUI:
             return row, col
         return None
 
+    def _build_surfaces(self):
+        """预先渲染棋子文字（阴影和正文）和半透明的高亮遮罩，绘制时直接复用"""
+        self.glyphs = {}
+        shadow_color = (128, 128, 128)  # 灰色阴影
+        for color, names in self.piece_names.items():
+            text_color = (255, 255, 255) if color == 'white' else (0, 0, 0)
+            for piece_type, text in names.items():
+                self.glyphs[(color, piece_type)] = (self.font.render(text, True, shadow_color),
+                                                    self.font.render(text, True, text_color))
+        self.selected_overlay = pygame.Surface((self.square_size, self.square_size))
+        self.selected_overlay.set_alpha(128)
+        self.selected_overlay.fill(self.SELECTED_COLOR)
+        self.move_overlay = pygame.Surface((self.square_size, self.square_size))
+        self.move_overlay.set_alpha(76)
+        self.move_overlay.fill(self.VALID_MOVE_COLOR)
+
+    def invalidate(self):
+        """下次draw时重绘整个窗口（例如窗口被遮挡后恢复）"""
+        self.full_redraw = True
+
+    def get_selection_moves(self):
+        """选中棋子的可移动位置，同一选择和同一局面只计算一次"""
+        if self.selected_piece is None:
+            return ()
+        key = (self.selected_piece, self.board.zobrist_key)
+        if self._selection_cache is None or self._selection_cache[0] != key:
+            moves = frozenset(self.board.get_valid_moves(*self.selected_piece))
+            self._selection_cache = (key, moves)
+        return self._selection_cache[1]
+
     def draw(self):
-        # 填充背景色
-        self.screen.fill((128, 128, 128))  # 使用灰色背景
+        """
+        只重绘发生变化的格子和计时条
+        返回: 需要更新到屏幕的矩形列表，传给pygame.display.update
+        """
+        full = self.full_redraw or self.game_over != self.drawn_game_over
+        dirty = self._draw_changes(full)
+        if self.game_over and dirty and not full:
+            # 遮罩下面有变化时重绘整个窗口，保证遮罩和文字在最上层
+            full = True
+            self._draw_changes(full)
+        if self.game_over and full:
+            self._draw_game_over()
+        self.full_redraw = False
+        self.drawn_game_over = self.game_over
+        return [self.screen.get_rect()] if full else dirty
+
+    def _draw_changes(self, full):
+        """重绘与上次绘制不同的部分，full为True时全部重绘"""
+        dirty = []
+        if full:
+            # 填充背景色
+            self.screen.fill((128, 128, 128))  # 使用灰色背景
+
+        timer_texts = (self.format_time(self.white_time), self.format_time(self.black_time))
+        if full or timer_texts != self.drawn_timer:
+            self._draw_timer_strip(timer_texts)
+            self.drawn_timer = timer_texts
+            dirty.append(self.timer_rect)
+
+        # 绘制棋盘和棋子
+        moves = self.get_selection_moves()
+        for row in range(8):
+            for col in range(8):
+                piece = self.board.board[row][col]
+                # 格子的绘制状态：底色、棋子、高亮遮罩，与上次相同时不重绘
+                state = (
+                    (row, col) == self.selected_square,
+                    (row, col) in self.valid_moves,
+                    (piece.color, piece.type) if piece else None,
+                    (row, col) == self.selected_piece,
+                    (row, col) in moves,
+                )
+                if full or state != self.drawn_squares[row][col]:
+                    dirty.append(self._draw_square(row, col, state))
+                    self.drawn_squares[row][col] = state
+        return dirty
+
+    def _draw_timer_strip(self, timer_texts):
+        """绘制棋盘上方的计时条，使用英文"""
+        self.screen.fill((128, 128, 128), self.timer_rect)
 
-        # 绘制时间信息，使用英文
         # 白方时间（左侧）
-        white_text = f"WHITE: {self.format_time(self.white_time)}"
-        white_surface = self.timer_font.render(white_text, True, (255, 255, 255))
+        white_surface = self.timer_font.render(f"WHITE: {timer_texts[0]}", True, (255, 255, 255))
         white_rect = white_surface.get_rect()
         white_rect.left = 10  # 调整左边距
         white_rect.top = 10   # 调整上边距
         self.screen.blit(white_surface, white_rect)
 
         # 黑方时间（右侧）
-        black_text = f"BLACK: {self.format_time(self.black_time)}"
-        black_surface = self.timer_font.render(black_text, True, (0, 0, 0))
+        black_surface = self.timer_font.render(f"BLACK: {timer_texts[1]}", True, (0, 0, 0))
         black_rect = black_surface.get_rect()
         black_rect.right = 390  # 调整到窗口宽度(400)减去边距(10)
         black_rect.top = 10     # 与白方计时器对齐
         self.screen.blit(black_surface, black_rect)
 
-        # 绘制棋盘和棋子
-        for row in range(8):
-            for col in range(8):
-                rect = self.get_square_rect(row, col)
-                # 绘制基本棋盘格
-                color = (255, 206, 158) if (row + col) % 2 == 0 else (209, 139, 71)
+    def _draw_square(self, row, col, state):
+        """绘制一个格子，返回它的矩形"""
+        is_selected_square, is_valid_move, piece_key, is_selected_piece, is_selection_move = state
+        rect = self.get_square_rect(row, col)
+        # 绘制基本棋盘格
+        color = (255, 206, 158) if (row + col) % 2 == 0 else (209, 139, 71)
 
-                # 高亮选中的格子
-                if (row, col) == self.selected_square:
-                    color = (186, 202, 68)  # 选中的格子显示为浅绿色
-                elif (row, col) in self.valid_moves:
-                    color = (186, 186, 68)  # 可移动位置显示为浅黄色
+        # 高亮选中的格子
+        if is_selected_square:
+            color = (186, 202, 68)  # 选中的格子显示为浅绿色
+        elif is_valid_move:
+            color = (186, 186, 68)  # 可移动位置显示为浅黄色
 
-                pygame.draw.rect(self.screen, color, rect)
+        pygame.draw.rect(self.screen, color, rect)
 
-                # 绘制棋子
-                piece = self.board.board[row][col]
-                if piece:
-                    text_color = (255, 255, 255) if piece.color == 'white' else (0, 0, 0)
-                    shadow_color = (128, 128, 128)  # 灰色阴影
-                    text = self.piece_names[piece.color][piece.type]
-
-                    # 绘制阴影文字
-                    shadow_surface = self.font.render(text, True, shadow_color)
-                    shadow_rect = shadow_surface.get_rect(center=(
-                        rect.x + self.square_size // 2 + 2,  # 阴影偏移2像素
-                        rect.y + self.square_size // 2 + 2
-                    ))
-                    self.screen.blit(shadow_surface, shadow_rect)
-
-                    # 绘制主要文字
-                    text_surface = self.font.render(text, True, text_color)
-                    text_rect = text_surface.get_rect(center=(
-                        rect.x + self.square_size // 2,
-                        rect.y + self.square_size // 2
-                    ))
-                    self.screen.blit(text_surface, text_rect)
-
-        # 在绘制棋子之前，添加选中和移动提示的绘制
-        if self.selected_piece:
-            row, col = self.selected_piece
-            # 绘制选中效果
-            s = pygame.Surface((self.square_size, self.square_size))
-            s.set_alpha(128)
-            s.fill(self.SELECTED_COLOR)
-            self.screen.blit(s, (col * self.square_size, row * self.square_size + self.board_start_y))
-
-            # 绘制可移动位置
-            valid_moves = self.board.get_valid_moves(row, col)
-            for move in valid_moves:
-                s = pygame.Surface((self.square_size, self.square_size))
-                s.set_alpha(76)
-                s.fill(self.VALID_MOVE_COLOR)
-                self.screen.blit(s, (move[1] * self.square_size, move[0] * self.square_size + self.board_start_y))
-
-        # 如果游戏结束，显示胜利信息
-        if self.game_over:
-            # 创建半透明的遮罩，覆盖整个窗口
-            overlay = pygame.Surface((400, 450))  # 修改遮罩大小为当前窗口大小
-            overlay.fill((0, 0, 0))
-            overlay.set_alpha(128)
-            self.screen.blit(overlay, (0, 0))
-
-            # 显示胜利信息的位置调整
-            winner_text = f"{'白方' if self.winner == 'white' else '黑方'}胜利!"
-            text_surface = self.font_large.render(winner_text, True, (255, 215, 0))
-            text_rect = text_surface.get_rect(center=(200, 200))  # 调整到窗口中心
-            self.screen.blit(text_surface, text_rect)
-
-            # 显示重新开始提示的位置调整
-            restart_text = "点击任意位置开始新局"
-            restart_surface = self.font.render(restart_text, True, (255, 255, 255))
-            restart_rect = restart_surface.get_rect(center=(200, 250))  # 调整位置
-            self.screen.blit(restart_surface, restart_rect)
+        # 绘制棋子：先画偏移2像素的阴影，再画主要文字
+        if piece_key:
+            shadow_surface, text_surface = self.glyphs[piece_key]
+            self.screen.blit(shadow_surface, shadow_surface.get_rect(center=(rect.centerx + 2, rect.centery + 2)))
+            self.screen.blit(text_surface, text_surface.get_rect(center=rect.center))
+
+        # 绘制选中效果和可移动位置
+        if is_selected_piece:
+            self.screen.blit(self.selected_overlay, rect)
+        elif is_selection_move:
+            self.screen.blit(self.move_overlay, rect)
+        return rect
+
+    def _draw_game_over(self):
+        """显示胜利信息"""
+        # 创建半透明的遮罩，覆盖整个窗口
+        overlay = pygame.Surface((400, 450))  # 修改遮罩大小为当前窗口大小
+        overlay.fill((0, 0, 0))
+        overlay.set_alpha(128)
+        self.screen.blit(overlay, (0, 0))
+
+        # 显示胜利信息的位置调整
+        winner_text = f"{'白方' if self.winner == 'white' else '黑方'}胜利!"
+        text_surface = self.font_large.render(winner_text, True, (255, 215, 0))
+        text_rect = text_surface.get_rect(center=(200, 200))  # 调整到窗口中心
+        self.screen.blit(text_surface, text_rect)
+
+        # 显示重新开始提示的位置调整
+        restart_text = "点击任意位置开始新局"
+        restart_surface = self.font.render(restart_text, True, (255, 255, 255))
+        restart_rect = restart_surface.get_rect(center=(200, 250))  # 调整位置
+        self.screen.blit(restart_surface, restart_rect)
 
     def handle_event(self, event):
         """处理用户事件（鼠标点击）"""
@@ -180,6 +241,8 @@ class ChessUI:
             return
 
         if event.type == pygame.MOUSEBUTTONDOWN:
+            if self.board.current_player == self.ai_color:
+                return
             board_pos = self.get_board_position(event.pos)
             if board_pos is None:
                 return
@@ -193,12 +256,7 @@ class ChessUI:
             else:
                 # 移动棋子
                 from_row, from_col = self.selected_piece
-                if self.board.move_piece((from_row, from_col), (row, col)):
-                    # 检查是否吃掉国王
-                    if self.board.is_king_captured(self.board.current_player):
-                        self.game_over = True
-                        self.winner = 'white' if self.board.current_player == 'black' else 'black'
-                        self.game_active = False
+                if self.apply_move((from_row, from_col), (row, col)):
                     self.selected_piece = None
                 else:
                     # 如果移动失败，检查是否选择新棋子
@@ -208,6 +266,35 @@ class ChessUI:
                     else:
                         self.selected_piece = None
 
+    def apply_move(self, from_pos, to_pos):
+        """
+        执行一步棋（玩家点击或电脑走棋），并检查是否吃掉了国王
+        返回: 布尔值，表示移动是否成功
+        """
+        if not self.board.move_piece(from_pos, to_pos):
+            return False
+        if self.board.is_king_captured(self.board.current_player):
+            self.game_over = True
+            self.winner = 'white' if self.board.current_player == 'black' else 'black'
+            self.game_active = False
+        return True
+
+    def undo_move(self):
+        """悔棋：撤销上一步移动，如果游戏因此回到进行中则恢复计时"""
+        if self.board.unmake_move() is None:
+            return
+        # 和电脑对弈时连同电脑的那一步一起撤销，回到玩家的回合
+        if self.board.current_player == self.ai_color:
+            self.board.unmake_move()
+        self.selected_piece = None
+        self.selected_square = None
+        self.valid_moves = []
+        if self.game_over:
+            self.game_over = False
+            self.winner = None
+            self.game_active = True
+            self.last_time = time.time()
+
     def calculate_valid_moves(self, row, col):
         """
         计算指定位置棋子的所有合法移动位置
@@ -215,12 +302,7 @@ class ChessUI:
         col: 列号
         返回: 所有可能的移动位置列表
         """
-        valid_moves = []
-        for to_row in range(8):
-            for to_col in range(8):
-                if self.board.is_valid_move((row, col), (to_row, to_col)):
-                    valid_moves.append((to_row, to_col))
-        return valid_moves
+        return self.board.get_valid_moves(row, col)
 
     def update_timer(self):
         if not self.game_active:
@@ -237,6 +319,17 @@ class ChessUI:
 
         self.last_time = current_time
 
+    def seconds_until_timer_tick(self):
+        """
+        距离当前行棋方的计时显示下一次跳秒的时间（秒）
+        返回: 秒数，计时已停止时返回None
+        """
+        if not self.game_active:
+            return None
+        elapsed = self.white_time if self.board.is_white_turn else self.black_time
+        elapsed += time.time() - self.last_time
+        return 1 - elapsed % 1
+
     def reset_timers(self):
         """重置计时器"""
         self.white_time = 0
@@ -0,0 +1,38 @@
+"""Zobrist哈希：为每个(颜色, 棋子类型, 格子)分配一个随机64位整数
+
+局面的哈希值是所有棋子对应随机数的异或，移动时只需异或变化的部分即可增量更新。
+随机数由固定种子生成，不同进程、不同次运行得到的哈希值一致，可以写入文件。
+"""
+import random
+
+from chess_bitboard import COLORS, PIECE_TYPES, iter_squares
+
+_rng = random.Random(0x5EED_C0DE)
+
+PIECE_KEYS = {color: {piece_type: [_rng.getrandbits(64) for _ in range(64)]
+                      for piece_type in PIECE_TYPES}
+              for color in COLORS}
+# 尚未移动过的兵可以走两格，走法不同，需要单独区分
+UNMOVED_PAWN_KEYS = [_rng.getrandbits(64) for _ in range(64)]
+# 轮到黑方行棋时异或此值
+BLACK_TO_MOVE_KEY = _rng.getrandbits(64)
+
+
+def piece_key(square, piece):
+    """获取格子上某个棋子对哈希值的贡献"""
+    key = PIECE_KEYS[piece.color][piece.type][square]
+    if piece.type == 'pawn' and not piece.has_moved:
+        key ^= UNMOVED_PAWN_KEYS[square]
+    return key
+
+
+def compute_key(board):
+    """
+    从头计算ChessBoard局面的哈希值
+    board: ChessBoard对象
+    返回: 64位整数
+    """
+    key = BLACK_TO_MOVE_KEY if board.current_player == 'black' else 0
+    for square in iter_squares(board.bitboards.all_occupied):
+        key ^= piece_key(square, board.board[square >> 3][square & 7])
+    return key
@@ -0,0 +1,136 @@
+"""客户端连接：每个WebSocket连接拥有一个有界的发送队列和独立的写任务
+
+广播时只把消息放入各连接的队列，不等待网络发送，一个慢客户端不会拖慢其他客户端，
+也不会阻塞发送方的消息接收循环。队列满或单条消息发送超时的客户端会被断开。
+"""
+import asyncio
+import logging
+import time
+
+from metrics import Counter, Histogram
+
+logger = logging.getLogger(__name__)
+
+# WebSocket关闭码：1008 违反策略（这里表示客户端处理太慢），1001 服务器移出了对局
+CLOSE_POLICY_VIOLATION = 1008
+CLOSE_GOING_AWAY = 1001
+
+SEND_LATENCY = Histogram('chess_send_latency_seconds', '消息从放入发送队列到发送完成的时间（秒）')
+# 发送队列中的关闭标记：之前的消息发送完后关闭连接
+_CLOSE = object()
+
+EVICTIONS = Counter('chess_evicted_clients_total', '因处理太慢被断开的客户端数')
+
+
+class ClientConnection:
+    """带发送队列的WebSocket连接"""
+    def __init__(self, websocket, max_queue=64, send_timeout=5.0, on_evict=None, binary=False):
+        """
+        websocket: 已经accept的WebSocket
+        max_queue: 发送队列的最大长度
+        send_timeout: 单条消息的发送超时（秒）
+        on_evict: 连接被服务器断开时调用的函数，参数为断开原因
+        binary: 客户端是否使用二进制消息格式（见wire_protocol）
+        """
+        self.websocket = websocket
+        self.binary = binary
+        self.send_timeout = send_timeout
+        self.on_evict = on_evict
+        self.queue = asyncio.Queue(maxsize=max_queue)
+        self.closed = False
+        self.evicted = False
+        self.evict_reason = None
+        self._writer = None
+        self._closer = None
+
+    def start(self):
+        """启动写任务"""
+        self._writer = asyncio.create_task(self._write_loop())
+
+    def send(self, data):
+        """
+        把消息放入发送队列，不等待发送完成
+        data: 字典按JSON发送，str按已经编码好的JSON文本发送，bytes按二进制帧发送
+        返回: 布尔值，False表示连接已关闭或因队列已满被断开
+        """
+        if self.closed:
+            return False
+        try:
+            self.queue.put_nowait((data, time.perf_counter()))
+        except asyncio.QueueFull:
+            self.evict("send queue full")
+            return False
+        return True
+
+    async def _write_loop(self):
+        """依次发送队列中的消息"""
+        while True:
+            data, enqueued_at = await self.queue.get()
+            if data is _CLOSE:
+                await self._close_socket(enqueued_at)
+                if self.on_evict is not None:
+                    self.on_evict(self.evict_reason)
+                return
+            try:
+                if isinstance(data, bytes):
+                    send = self.websocket.send_bytes(data)
+                elif isinstance(data, str):
+                    send = self.websocket.send_text(data)
+                else:
+                    send = self.websocket.send_json(data)
+                await asyncio.wait_for(send, self.send_timeout)
+                SEND_LATENCY.observe(time.perf_counter() - enqueued_at)
+            except asyncio.TimeoutError:
+                self.evict("send timeout")
+                return
+            except Exception as e:
+                # 连接已经断开，由接收循环负责清理
+                logger.debug(f"Send failed: {e}")
+                self.closed = True
+                return
+
+    def evict(self, reason):
+        """断开处理太慢的客户端"""
+        if self.closed:
+            return
+        EVICTIONS.inc()
+        logger.warning(f"Evicting slow client: {reason}")
+        self.disconnect(reason, CLOSE_POLICY_VIOLATION)
+
+    def disconnect(self, reason, code=CLOSE_GOING_AWAY, drain=False):
+        """
+        由服务器主动断开连接（例如对局因空闲被移出内存），在后台关闭WebSocket
+        drain: 为True时先发送完队列中的消息再关闭
+        """
+        if self.closed:
+            return
+        self.closed = True
+        self.evicted = True
+        self.evict_reason = reason
+        if drain and self._writer is not None:
+            try:
+                self.queue.put_nowait((_CLOSE, code))
+                return
+            except asyncio.QueueFull:
+                pass
+        if self._writer is not None and self._writer is not asyncio.current_task():
+            self._writer.cancel()
+        self._closer = asyncio.create_task(self._close_socket(code))
+        if self.on_evict is not None:
+            self.on_evict(reason)
+
+    async def _close_socket(self, code):
+        try:
+            await asyncio.wait_for(self.websocket.close(code=code), self.send_timeout)
+        except Exception:
+            pass
+
+    async def close(self):
+        """正常关闭：停止写任务，丢弃未发送的消息"""
+        self.closed = True
+        if self._writer is not None:
+            self._writer.cancel()
+            try:
+                await self._writer
+            except (asyncio.CancelledError, Exception):
+                pass
@@ -0,0 +1,387 @@
+"""对局消息总线：让多个uvicorn工作进程共享同一个对局
+
+每个对局有一个“主进程”（第一个认领该对局的进程），只有主进程持有权威的棋盘、
+校验并执行走法、安排电脑走棋和写对局日志；其他持有该对局连接的进程保存棋盘副本，
+把玩家的走法转发给主进程，并通过订阅接收局面更新和要发给客户端的消息。
+
+- LocalBus: 单进程内的实现，本进程总是主进程（默认）
+- UnixSocketBus: 通过本机Unix套接字上的代理进程在多个工作进程之间转发消息
+  启动代理: python game_bus.py /tmp/chess_bus.sock
+
+消息都是可以JSON序列化的字典，代理协议为每行一个JSON对象。
+"""
+import abc
+import argparse
+import asyncio
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+
+class GameBus(abc.ABC):
+    """
+    消息总线接口
+    使用前设置三个回调：
+    on_message(game_id, message): 收到订阅对局的广播消息（包括本进程自己发布的）
+    on_home_message(game_id, message): 本进程是主进程时，收到其他进程转发来的请求
+    on_orphan(game_id): 订阅的对局失去了主进程（主进程退出或释放了对局）
+    """
+    def __init__(self):
+        self.on_message = None
+        self.on_home_message = None
+        self.on_orphan = None
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+    @abc.abstractmethod
+    def subscribe(self, game_id):
+        """订阅对局的广播消息"""
+
+    @abc.abstractmethod
+    def unsubscribe(self, game_id):
+        """取消订阅"""
+
+    @abc.abstractmethod
+    def publish(self, game_id, message):
+        """把消息发给所有订阅该对局的进程"""
+
+    @abc.abstractmethod
+    async def claim(self, game_id):
+        """
+        尝试成为对局的主进程
+        返回: 布尔值，False表示已经有其他进程是主进程
+        与其他进程的连接已经断开时抛出ConnectionError
+        """
+
+    @abc.abstractmethod
+    def release(self, game_id):
+        """放弃对局的主进程身份"""
+
+    @abc.abstractmethod
+    def send_home(self, game_id, message):
+        """把请求发给对局的主进程"""
+
+
+class LocalBus(GameBus):
+    """单进程消息总线"""
+    def __init__(self):
+        super().__init__()
+        self._subscribed = set()
+        self._owned = set()
+
+    def subscribe(self, game_id):
+        self._subscribed.add(game_id)
+
+    def unsubscribe(self, game_id):
+        self._subscribed.discard(game_id)
+
+    def publish(self, game_id, message):
+        if game_id in self._subscribed:
+            self.on_message(game_id, message)
+
+    async def claim(self, game_id):
+        if game_id in self._owned:
+            return False
+        self._owned.add(game_id)
+        return True
+
+    def release(self, game_id):
+        self._owned.discard(game_id)
+
+    def send_home(self, game_id, message):
+        if game_id in self._owned:
+            self.on_home_message(game_id, message)
+        elif game_id in self._subscribed:
+            self.on_orphan(game_id)
+
+
+class UnixSocketBus(GameBus):
+    """连接到本机代理进程的消息总线"""
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+        self._reader = None
+        self._writer = None
+        self._read_task = None
+        self._subscribed = set()
+        self._owned = set()
+        self._claims = {}   # game_id -> 等待认领结果的Future
+        # 与代理的连接断开后的异常，之后的发送和认领都抛出它
+        self._lost = None
+
+    async def start(self):
+        self._reader, self._writer = await asyncio.open_unix_connection(self.path)
+        self._read_task = asyncio.create_task(self._read_loop())
+
+    async def close(self):
+        if self._read_task is not None:
+            self._read_task.cancel()
+            self._read_task = None
+        if self._writer is not None:
+            self._writer.close()
+            try:
+                await self._writer.wait_closed()
+            except Exception:
+                pass
+            self._writer = None
+
+    def _send(self, data):
+        if self._lost is not None:
+            raise self._lost
+        self._writer.write(json.dumps(data, separators=(',', ':')).encode() + b'\n')
+
+    def _connection_lost(self, reason):
+        """连接断开：等待中的认领全部以ConnectionError结束，之后的发送和认领直接抛出"""
+        logger.error(f"Message bus connection lost: {reason}")
+        self._lost = ConnectionError(f"Message bus connection lost: {reason}")
+        claims, self._claims = self._claims, {}
+        for future in claims.values():
+            if not future.done():
+                future.set_exception(self._lost)
+
+    async def _read_loop(self):
+        while True:
+            try:
+                line = await self._reader.readline()
+            except (ConnectionError, OSError, ValueError) as e:
+                self._connection_lost(e)
+                return
+            if not line:
+                self._connection_lost("EOF")
+                return
+            try:
+                data = json.loads(line)
+                op = data['op']
+                game_id = data['game']
+            except (ValueError, KeyError, TypeError) as e:
+                logger.warning(f"Ignoring malformed bus message: {e}")
+                continue
+            try:
+                if op == 'pub':
+                    if game_id in self._subscribed:
+                        self.on_message(game_id, data['data'])
+                elif op == 'home':
+                    if game_id in self._owned:
+                        self.on_home_message(game_id, data['data'])
+                elif op == 'claim':
+                    future = self._claims.pop(game_id, None)
+                    if future is not None and not future.done():
+                        future.set_result(data['ok'])
+                elif op == 'orphan':
+                    if game_id in self._subscribed:
+                        self.on_orphan(game_id)
+            except Exception:
+                logger.exception(f"Game {game_id} - Error handling bus message")
+
+    def subscribe(self, game_id):
+        if game_id not in self._subscribed:
+            self._subscribed.add(game_id)
+            self._send({'op': 'sub', 'game': game_id})
+
+    def unsubscribe(self, game_id):
+        if game_id in self._subscribed:
+            self._subscribed.discard(game_id)
+            # 连接断开后代理已经清除了本进程的订阅，只需要更新本地状态
+            if self._lost is None:
+                self._send({'op': 'unsub', 'game': game_id})
+
+    def publish(self, game_id, message):
+        # 本进程的订阅者直接处理，代理只转发给其他进程
+        if game_id in self._subscribed:
+            self.on_message(game_id, message)
+        self._send({'op': 'pub', 'game': game_id, 'data': message})
+
+    async def claim(self, game_id):
+        if self._lost is not None:
+            raise self._lost
+        future = self._claims.get(game_id)
+        if future is None:
+            future = self._claims[game_id] = asyncio.get_running_loop().create_future()
+            self._send({'op': 'claim', 'game': game_id})
+        ok = await asyncio.shield(future)
+        if ok:
+            self._owned.add(game_id)
+        return ok
+
+    def release(self, game_id):
+        if game_id in self._owned:
+            self._owned.discard(game_id)
+            if self._lost is None:
+                self._send({'op': 'release', 'game': game_id})
+
+    def send_home(self, game_id, message):
+        if game_id in self._owned:
+            self.on_home_message(game_id, message)
+        else:
+            self._send({'op': 'home', 'game': game_id, 'data': message})
+
+
+class _BrokerClient:
+    """代理进程中的一个工作进程连接：有界的发送队列和独立的写任务"""
+    def __init__(self, writer, max_queue, send_timeout):
+        self.writer = writer
+        self.send_timeout = send_timeout
+        self.queue = asyncio.Queue(maxsize=max_queue)
+        self.closed = False
+        self._task = asyncio.create_task(self._write_loop())
+
+    def send(self, line):
+        """把一行消息放入发送队列，不等待发送完成；队列满时断开该工作进程"""
+        if self.closed:
+            return
+        try:
+            self.queue.put_nowait(line)
+        except asyncio.QueueFull:
+            logger.warning("Bus client send queue full, disconnecting")
+            self.close()
+
+    async def _write_loop(self):
+        """依次发送队列中的消息，每条都等待写缓冲区降到水位线以下"""
+        try:
+            while True:
+                line = await self.queue.get()
+                self.writer.write(line)
+                await asyncio.wait_for(self.writer.drain(), self.send_timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Bus client send timeout, disconnecting")
+            self.close()
+        except ConnectionError as e:
+            logger.debug(f"Bus client send failed: {e}")
+            self.close()
+
+    def close(self):
+        """
+        关闭连接并丢弃未发送的消息
+        直接中止连接而不等待写缓冲区清空（对方可能已经不再读取），
+        该工作进程的读循环随即收到EOF，由handle_client清理它的订阅和对局；
+        工作进程一侧的UnixSocketBus会发现连接断开
+        """
+        if self.closed:
+            return
+        self.closed = True
+        if self._task is not asyncio.current_task():
+            self._task.cancel()
+        self.writer.transport.abort()
+
+
+class BusBroker:
+    """
+    代理进程：记录每个对局的订阅者和主进程，在工作进程之间转发消息
+    发给每个工作进程的消息经过有界队列，处理太慢的工作进程会被断开，代理的内存不会无限增长
+    """
+    def __init__(self, max_queue=1024, send_timeout=5.0):
+        """
+        max_queue: 每个工作进程发送队列的最大长度（行数）
+        send_timeout: 单条消息的发送超时（秒）
+        """
+        self.max_queue = max_queue
+        self.send_timeout = send_timeout
+        self.subscribers = {}   # game_id -> 订阅该对局的连接集合
+        self.owners = {}        # game_id -> 主进程的连接
+
+    async def handle_client(self, reader, writer):
+        client = _BrokerClient(writer, self.max_queue, self.send_timeout)
+        games = set()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                data = json.loads(line)
+                op = data['op']
+                game_id = data['game']
+                if op == 'sub':
+                    self.subscribers.setdefault(game_id, set()).add(client)
+                    games.add(game_id)
+                elif op == 'unsub':
+                    self._unsubscribe(game_id, client)
+                    games.discard(game_id)
+                elif op == 'pub':
+                    for other in self.subscribers.get(game_id, ()):
+                        if other is not client:
+                            other.send(line)
+                elif op == 'claim':
+                    ok = game_id not in self.owners
+                    if ok:
+                        self.owners[game_id] = client
+                    self._write(client, {'op': 'claim', 'game': game_id, 'ok': ok})
+                elif op == 'release':
+                    if self.owners.get(game_id) is client:
+                        self._orphan(game_id)
+                elif op == 'home':
+                    owner = self.owners.get(game_id)
+                    if owner is not None:
+                        owner.send(line)
+                    else:
+                        self._write(client, {'op': 'orphan', 'game': game_id})
+        except (ConnectionError, json.JSONDecodeError, KeyError) as e:
+            logger.warning(f"Bus client error: {e}")
+        finally:
+            for game_id in games:
+                self._unsubscribe(game_id, client)
+            for game_id in [g for g, owner in self.owners.items() if owner is client]:
+                self._orphan(game_id)
+            client.close()
+
+    def _unsubscribe(self, game_id, client):
+        subscribers = self.subscribers.get(game_id)
+        if subscribers is not None:
+            subscribers.discard(client)
+            if not subscribers:
+                del self.subscribers[game_id]
+
+    def _orphan(self, game_id):
+        """对局失去主进程，通知仍然订阅它的进程重新认领"""
+        del self.owners[game_id]
+        for client in self.subscribers.get(game_id, ()):
+            self._write(client, {'op': 'orphan', 'game': game_id})
+
+    @staticmethod
+    def _write(client, data):
+        client.send(json.dumps(data, separators=(',', ':')).encode() + b'\n')
+
+
+def create_bus(spec):
+    """
+    根据配置创建消息总线
+    spec: "local" 或 "unix:/path/to/socket"
+    """
+    if spec == 'local':
+        return LocalBus()
+    if spec.startswith('unix:'):
+        return UnixSocketBus(spec[len('unix:'):])
+    raise ValueError(f"Unknown message bus: {spec}")
+
+
+async def run_broker(path, max_queue=1024):
+    """在Unix套接字上运行代理"""
+    if os.path.exists(path):
+        os.remove(path)
+    broker = BusBroker(max_queue=max_queue)
+    server = await asyncio.start_unix_server(broker.handle_client, path)
+    logger.info(f"Message bus broker listening on {path}")
+    async with server:
+        await server.serve_forever()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='国际象棋服务器的消息总线代理')
+    parser.add_argument('path', nargs='?', default='/tmp/chess_bus.sock', help='Unix套接字路径')
+    parser.add_argument('--max-queue', type=int, default=1024,
+                        help='每个工作进程发送队列的最大长度，超出时断开该工作进程')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    try:
+        asyncio.run(run_broker(args.path, args.max_queue))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
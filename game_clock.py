@@ -0,0 +1,217 @@
+"""对局计时：服务器端的棋钟和驱动所有棋钟的定时调度器
+
+- GameClock 记录双方剩余时间和每步加秒，只在走棋时更新，不需要逐秒计时
+- TimerScheduler 用一个最小堆保存所有对局的超时时刻，由一个asyncio任务等待最早的那个，
+  每步棋只需一次堆插入，开销只与到期的对局数有关，不随对局总数增长。
+  重新安排或取消的定时器不从堆中删除，到达堆顶时按编号判断已经作废并丢弃，
+  作废的记录过多时整体重建堆
+时间都使用 time.monotonic()。
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+
+from chess_bitboard import COLORS
+
+logger = logging.getLogger(__name__)
+
+
+def parse_time_control(text):
+    """
+    解析时间控制，例如 '300+2'（每方300秒，每步加2秒）或 '600'
+    返回: (每方的初始时间, 每步加秒)，空字符串返回None
+    """
+    if not text:
+        return None
+    base, _, increment = text.partition('+')
+    try:
+        base = float(base)
+        increment = float(increment) if increment else 0.0
+    except ValueError:
+        raise ValueError(f'Invalid time control: {text}') from None
+    if base <= 0 or increment < 0:
+        raise ValueError(f'Invalid time control: {text}')
+    return base, increment
+
+
+class GameClock:
+    """一局棋的棋钟：双方各自第一步不计时也不加秒，之后行棋方的时间持续减少，走完一步加上加秒"""
+    __slots__ = ('remaining', 'increment', 'running', 'started_at', 'flagged', 'moves')
+
+    def __init__(self, initial, increment=0.0):
+        """
+        initial: 每方的初始时间（秒）
+        increment: 每步加秒
+        """
+        self.remaining = {'white': float(initial), 'black': float(initial)}
+        self.increment = increment
+        # 正在计时的一方（还没开始或已经停止时为None）和开始计时的时刻
+        self.running = None
+        self.started_at = 0.0
+        # 超时的一方
+        self.flagged = None
+        # 已经走过的步数，双方都走完第一步后才开始计时
+        self.moves = 0
+
+    def time_left(self, color, now=None):
+        """一方的剩余时间（秒），不小于0"""
+        left = self.remaining[color]
+        if self.running == color:
+            left -= (time.monotonic() if now is None else now) - self.started_at
+        return max(left, 0.0)
+
+    def deadline(self):
+        """正在计时的一方超时的时刻，没有在计时时返回None"""
+        if self.running is None:
+            return None
+        return self.started_at + self.remaining[self.running]
+
+    def press(self, color, now=None):
+        """
+        color方走完一步：扣除用时并加上加秒，开始计对方的时间
+        返回: 布尔值，False表示走棋前已经超时（时间不变）
+        """
+        now = time.monotonic() if now is None else now
+        if self.running == color:
+            left = self.remaining[color] - (now - self.started_at)
+            if left <= 0:
+                return False
+            self.remaining[color] = left + self.increment
+        self.moves += 1
+        if self.moves < 2:
+            # 对方的第一步也不计时
+            return True
+        self.running = 'black' if color == 'white' else 'white'
+        self.started_at = now
+        return True
+
+    def stop(self, now=None):
+        """对局结束，停止计时"""
+        if self.running is not None:
+            self.remaining[self.running] = self.time_left(self.running, now)
+            self.running = None
+
+    def flag(self, now=None):
+        """
+        检查正在计时的一方是否超时，超时时停止计时
+        返回: 超时的一方，没有超时时返回None
+        """
+        color = self.running
+        if color is None or self.time_left(color, now) > 0:
+            return None
+        self.stop(now)
+        self.remaining[color] = 0.0
+        self.flagged = color
+        return color
+
+    def to_message(self, now=None):
+        """广播给客户端的棋钟消息（毫秒）"""
+        return {"type": "clock",
+                "white": round(self.time_left('white', now) * 1000),
+                "black": round(self.time_left('black', now) * 1000),
+                "running": self.running}
+
+    def to_state(self, now=None):
+        """
+        导出可以JSON序列化的状态，用于对局日志和进程间同步
+        剩余时间按调用时刻计算，不同进程的 time.monotonic() 不可比较
+        """
+        return [self.time_left('white', now), self.time_left('black', now), self.increment,
+                self.running, self.flagged, self.moves]
+
+    @classmethod
+    def from_state(cls, state, running=True):
+        """
+        根据to_state的结果创建棋钟
+        running: 为False时不恢复计时（例如服务器重启后，等到下一步棋再开始）
+        """
+        white, black, increment, color, flagged, moves = state
+        clock = cls(0.0, increment)
+        clock.remaining = {'white': white, 'black': black}
+        clock.flagged = flagged
+        clock.moves = moves
+        if running and color in COLORS:
+            clock.running = color
+            clock.started_at = time.monotonic()
+        return clock
+
+
+class TimerScheduler:
+    """所有定时器共用一个最小堆和一个asyncio任务"""
+    # 作废的记录超过有效记录的这个倍数时重建堆
+    COMPACT_RATIO = 2
+
+    def __init__(self):
+        self._heap = []          # (到期时刻, 编号, 键, 回调)
+        self._tokens = {}        # 键 -> 当前有效的编号
+        self._counter = itertools.count()
+        self._wakeup = None
+        self._task = None
+
+    def start(self):
+        """启动调度任务（需要在事件循环中调用）"""
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        """停止调度任务，未到期的定时器全部丢弃"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self._heap.clear()
+        self._tokens.clear()
+
+    def __len__(self):
+        return len(self._tokens)
+
+    def schedule(self, key, deadline, callback):
+        """
+        安排在deadline时刻调用callback(key)，同一个键之前的定时器作废
+        deadline: time.monotonic() 的时刻
+        """
+        token = next(self._counter)
+        self._tokens[key] = token
+        heapq.heappush(self._heap, (deadline, token, key, callback))
+        if len(self._heap) > (self.COMPACT_RATIO + 1) * len(self._tokens) + 64:
+            self._compact()
+        # 新的定时器比调度任务正在等待的更早到期时唤醒它
+        if self._wakeup is not None and self._heap[0][1] == token:
+            self._wakeup.set()
+
+    def cancel(self, key):
+        """取消一个键的定时器"""
+        self._tokens.pop(key, None)
+
+    def _compact(self):
+        self._heap = [entry for entry in self._heap if self._tokens.get(entry[2]) == entry[1]]
+        heapq.heapify(self._heap)
+
+    async def _run(self):
+        while True:
+            heap = self._heap
+            # 丢弃已经作废的记录
+            while heap and self._tokens.get(heap[0][2]) != heap[0][1]:
+                heapq.heappop(heap)
+            self._wakeup.clear()
+            if not heap:
+                await self._wakeup.wait()
+                continue
+            delay = heap[0][0] - time.monotonic()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            _, _, key, callback = heapq.heappop(heap)
+            del self._tokens[key]
+            try:
+                callback(key)
+            except Exception:
+                logger.exception(f"Timer callback failed for {key}")
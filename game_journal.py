@@ -0,0 +1,258 @@
+"""对局日志：把每步棋追加写入磁盘，定期保存局面快照，服务器重启后可以恢复对局
+
+每个对局在日志目录下有两类文件：
+- {game_id}.journal      只追加的走法记录，每条6字节：序号(uint32)、起点格子、终点格子
+- {game_id}.snap         JSON格式的局面快照：序号、ChessBoard.to_state()、附加信息
+写入只进入操作系统缓存，后台任务每隔一段时间对有新记录的文件批量fsync。
+每走snapshot_every步保存一次快照：先把当前日志改名为 .journal.old 并开始新文件，
+快照落盘后再删除旧日志，任何时刻崩溃都能从“快照 + 旧日志 + 新日志”恢复。
+"""
+import asyncio
+import json
+import logging
+import os
+import re
+import struct
+
+from chess_bitboard import position_of, square_of
+from chess_board import ChessBoard
+
+logger = logging.getLogger(__name__)
+
+RECORD = struct.Struct('<IBB')
+# game_id会成为文件名，只允许安全的字符
+_SAFE_GAME_ID = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+
+
+class GameJournal:
+    """对局日志管理"""
+    def __init__(self, directory='journal', flush_interval=0.05, snapshot_every=32):
+        """
+        directory: 日志目录
+        flush_interval: 批量fsync的间隔（秒）
+        snapshot_every: 每走多少步保存一次快照
+        """
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.snapshot_every = snapshot_every
+        self._files = {}        # game_id -> 打开的日志文件
+        self._dirty = set()     # 有未fsync记录的对局
+        self._meta = {}         # game_id -> 写入快照的附加信息
+        self._snapshots = {}    # game_id -> 正在保存快照的任务
+        self._tasks = set()
+        self._flusher = None
+
+    def start(self):
+        """创建目录并启动后台fsync任务"""
+        os.makedirs(self.directory, exist_ok=True)
+        self._flusher = asyncio.create_task(self._flush_loop())
+
+    async def close(self):
+        """停止后台任务，把所有记录写入磁盘并关闭文件"""
+        if self._flusher is not None:
+            self._flusher.cancel()
+            self._flusher = None
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        await self._flush()
+        for f in self._files.values():
+            f.close()
+        self._files.clear()
+
+    @staticmethod
+    def is_valid_game_id(game_id):
+        return bool(_SAFE_GAME_ID.match(game_id))
+
+    def _path(self, game_id, suffix):
+        return os.path.join(self.directory, f'{game_id}{suffix}')
+
+    def set_meta(self, game_id, meta):
+        """设置对局的附加信息（例如电脑执子颜色），随快照一起保存"""
+        self._meta[game_id] = meta
+
+    def append(self, game_id, seq, from_pos, to_pos):
+        """
+        追加一条走法记录（只写入缓存，由后台任务批量fsync）
+        seq: 该步的序号，即走完这一步后的ChessBoard.ply
+        """
+        if not self.is_valid_game_id(game_id):
+            return
+        f = self._files.get(game_id)
+        if f is None:
+            f = self._files[game_id] = open(self._path(game_id, '.journal'), 'ab')
+        f.write(RECORD.pack(seq, square_of(*from_pos), square_of(*to_pos)))
+        self._dirty.add(game_id)
+
+    def maybe_snapshot(self, game_id, board, force=False):
+        """每走snapshot_every步（或force为True时）在后台保存一次快照并压缩日志"""
+        if not self.is_valid_game_id(game_id) or game_id in self._snapshots:
+            return
+        if not force and (board.ply == 0 or board.ply % self.snapshot_every):
+            return
+
+        # 在事件循环中切换日志文件，保证快照之后的记录都写入新文件。
+        # 上次压缩没有完成（崩溃后残留 .journal.old）时不切换，快照写完后旧日志已被覆盖，直接删除
+        old_journal = self._path(game_id, '.journal.old')
+        journal_path = self._path(game_id, '.journal')
+        if not os.path.exists(old_journal) and os.path.exists(journal_path):
+            f = self._files.pop(game_id, None)
+            if f is not None:
+                f.close()
+                self._dirty.discard(game_id)
+            os.replace(journal_path, old_journal)
+        snapshot = {'seq': board.ply, 'state': board.to_state(), 'meta': self._meta.get(game_id, {})}
+        self._snapshots[game_id] = self._spawn(self._write_snapshot(game_id, snapshot, old_journal))
+
+    def _spawn(self, coro):
+        """创建后台任务并保存引用，关闭时等待它们完成"""
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def _write_snapshot(self, game_id, snapshot, old_journal):
+        try:
+            await asyncio.to_thread(self._write_snapshot_sync, game_id, snapshot, old_journal)
+        except OSError as e:
+            logger.error(f"Game {game_id} - Snapshot failed: {e}")
+        finally:
+            self._snapshots.pop(game_id, None)
+
+    def _write_snapshot_sync(self, game_id, snapshot, old_journal):
+        """先让旧日志落盘，再原子地替换快照，最后删除旧日志"""
+        if os.path.exists(old_journal):
+            with open(old_journal, 'rb') as f:
+                os.fsync(f.fileno())
+        path = self._path(game_id, '.snap')
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(snapshot, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        self._fsync_directory()
+        try:
+            os.remove(old_journal)
+        except FileNotFoundError:
+            pass
+
+    def _fsync_directory(self):
+        """确保文件改名已经落盘（Windows不支持对目录fsync）"""
+        if not hasattr(os, 'O_DIRECTORY'):
+            return
+        fd = os.open(self.directory, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self._flush()
+
+    async def _flush(self):
+        """把有新记录的日志文件写出缓冲区，然后在线程中批量fsync"""
+        if not self._dirty:
+            return
+        files = []
+        for game_id in self._dirty:
+            f = self._files.get(game_id)
+            if f is not None:
+                f.flush()
+                files.append(f)
+        self._dirty.clear()
+        await asyncio.to_thread(self._fsync_files, files)
+
+    @staticmethod
+    def _fsync_files(files):
+        for f in files:
+            try:
+                os.fsync(f.fileno())
+            except (OSError, ValueError):
+                # 文件在此期间被关闭（切换日志或对局结束），内容已在关闭前处理
+                pass
+
+    async def load(self, game_id):
+        """
+        从快照和日志恢复对局
+        返回: (ChessBoard, 附加信息)，没有保存的对局时返回None
+        """
+        if not self.is_valid_game_id(game_id):
+            return None
+        return await asyncio.to_thread(self._load_sync, game_id)
+
+    def _load_sync(self, game_id):
+        snapshot = None
+        snap_path = self._path(game_id, '.snap')
+        if os.path.exists(snap_path):
+            with open(snap_path, encoding='utf-8') as f:
+                snapshot = json.load(f)
+
+        records = []
+        for suffix in ('.journal.old', '.journal'):
+            path = self._path(game_id, suffix)
+            if os.path.exists(path):
+                with open(path, 'rb') as f:
+                    data = f.read()
+                # 忽略崩溃时写了一半的最后一条记录
+                usable = len(data) - len(data) % RECORD.size
+                records.extend(RECORD.iter_unpack(data[:usable]))
+
+        if snapshot is None and not records:
+            return None
+        if snapshot is not None:
+            board = ChessBoard.from_state(tuple(snapshot['state']), ply=snapshot['seq'])
+            meta = snapshot.get('meta', {})
+        else:
+            board = ChessBoard()
+            meta = {}
+
+        # 重放快照之后的记录
+        for seq, from_square, to_square in records:
+            if seq <= board.ply:
+                continue
+            if seq != board.ply + 1 or not board.move_piece(position_of(from_square), position_of(to_square)):
+                logger.warning(f"Game {game_id} - Journal replay stopped at seq {seq}")
+                break
+        self._meta[game_id] = meta
+        return board, meta
+
+    def discard(self, game_id):
+        """对局结束后删除它的日志和快照"""
+        f = self._files.pop(game_id, None)
+        if f is not None:
+            f.close()
+        self._dirty.discard(game_id)
+        self._meta.pop(game_id, None)
+        if not self.is_valid_game_id(game_id):
+            return
+        snapshot_task = self._snapshots.get(game_id)
+        if snapshot_task is not None:
+            # 等正在保存的快照写完再删除，否则快照会在删除之后重新出现
+            snapshot_task.add_done_callback(lambda _: self._remove_files(game_id))
+        else:
+            self._remove_files(game_id)
+
+    def _remove_files(self, game_id):
+        for suffix in ('.journal', '.journal.old', '.snap'):
+            try:
+                os.remove(self._path(game_id, suffix))
+            except FileNotFoundError:
+                pass
+
+    def release(self, game_id):
+        """对局从内存中移除（玩家都已离开）时关闭文件，保留磁盘上的记录以便重连后恢复"""
+        f = self._files.pop(game_id, None)
+        if f is not None:
+            f.flush()
+            self._spawn(asyncio.to_thread(self._fsync_and_close, f))
+        self._dirty.discard(game_id)
+        self._meta.pop(game_id, None)
+
+    @staticmethod
+    def _fsync_and_close(f):
+        try:
+            os.fsync(f.fileno())
+        finally:
+            f.close()
@@ -0,0 +1,305 @@
+"""WebSocket负载测试：成对打开 /ws/{game_id}/{player} 连接，按设定的速度下合法的棋，
+统计走法到广播的延迟、吞吐量和每局占用的内存
+
+用法：
+    python loadtest.py --games 500                            # 在本进程中启动web_main.app
+    python loadtest.py --url ws://localhost:8000 --games 2000 --proto bin
+    python loadtest.py --games 500 --output load.json          # 保存JSON结果作为基准
+    python loadtest.py --games 500 --compare load.json         # 与之前保存的结果比较
+
+走法从服务器随每步棋发来的合法走法表中随机选择（固定随机种子，结果可重复）。
+延迟是从发出走法到对局中每个玩家收到该步广播的时间，每步有两个样本。
+每局内存是所有对局建立连接后进程常驻内存的增量除以对局数：在本进程中启动服务器时包括
+服务器和测试客户端，连接外部服务器时可以用 --server-pid 指定服务器进程。
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+import websockets
+
+from perft import current_commit
+from wire_protocol import CLIENT_MOVE_FRAME, FRAME_MOVE, decode_server_frame
+
+DEFAULT_PORT = 8765
+# 等待一步棋广播的超时（秒）
+MOVE_TIMEOUT = 10.0
+
+
+def rss_bytes(pid='self'):
+    """读取进程的常驻内存（Linux），无法读取时返回None"""
+    try:
+        with open(f'/proc/{pid}/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def raise_file_limit():
+    """数千个连接需要足够的文件描述符"""
+    try:
+        import resource
+    except ImportError:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+class LoadStats:
+    """所有对局共享的统计数据"""
+    def __init__(self, games):
+        self.games = games
+        self.latencies = []
+        self.moves = 0
+        self.errors = 0
+        self.completed = 0
+        self.connected = 0
+        self.all_connected = asyncio.Event()
+
+    def game_connected(self):
+        self.connected += 1
+        if self.connected == self.games:
+            self.all_connected.set()
+
+
+class LoadGame:
+    """一局测试对局：两个连接轮流走棋"""
+    def __init__(self, index, args, stats, run_id):
+        self.game_id = f'load-{run_id}-{index}'
+        self.args = args
+        self.stats = stats
+        self.rng = random.Random(args.seed + index)
+        self.binary = args.proto == 'bin'
+        self.sent_at = {}       # 序号 -> 发出走法的时间
+        self.state = None       # 白方连接看到的最新局面
+        self.placement = None
+        self.updated = asyncio.Event()
+
+    def url(self, player):
+        query = '?proto=bin' if self.binary else ''
+        return f'{self.args.url}/ws/{self.game_id}/{player}{query}'
+
+    def decode(self, raw):
+        if isinstance(raw, bytes):
+            return decode_server_frame(raw)
+        return json.loads(raw)
+
+    def encode_move(self, from_square, to_square):
+        if self.binary:
+            return CLIENT_MOVE_FRAME.pack(FRAME_MOVE, from_square, to_square)
+        return json.dumps({'type': 'move', 'from': divmod(from_square, 8), 'to': divmod(to_square, 8)})
+
+    async def read_loop(self, websocket, tracks_state):
+        """接收广播，记录每步的到达时间；tracks_state为True的连接负责更新局面"""
+        async for raw in websocket:
+            message = self.decode(raw)
+            if message is None:
+                continue
+            if message['type'] == 'move':
+                sent = self.sent_at.get(message['seq'])
+                if sent is not None:
+                    self.stats.latencies.append(time.perf_counter() - sent)
+                if tracks_state:
+                    self.apply(message)
+            elif message['type'] == 'snapshot' and tracks_state:
+                self.state = message
+                self.placement = list(message['board'])
+                self.updated.set()
+
+    def apply(self, message):
+        from_square = message['from'][0] * 8 + message['from'][1]
+        to_square = message['to'][0] * 8 + message['to'][1]
+        self.placement[to_square] = self.placement[from_square]
+        self.placement[from_square] = '.'
+        self.state = message
+        self.updated.set()
+
+    async def wait_update(self):
+        """等待局面更新（调用方在发出请求之前清除updated）"""
+        await asyncio.wait_for(self.updated.wait(), MOVE_TIMEOUT)
+
+    async def run(self, connect_semaphore):
+        sockets = {}
+        readers = []
+        counted = False
+        try:
+            async with connect_semaphore:
+                # 使用二进制格式时，服务器在连接后立即发送完整局面
+                self.updated.clear()
+                sockets['white'] = await websockets.connect(self.url('white'), max_size=None)
+                sockets['black'] = await websockets.connect(self.url('black'), max_size=None)
+            readers = [asyncio.create_task(self.read_loop(sockets['white'], True)),
+                       asyncio.create_task(self.read_loop(sockets['black'], False))]
+            if not self.binary:
+                # JSON客户端连接时不会收到局面，主动请求一次
+                await sockets['white'].send(json.dumps({'type': 'resync'}))
+            await self.wait_update()
+            counted = True
+            self.stats.game_connected()
+            await self.stats.all_connected.wait()
+            await self.play(sockets)
+            self.stats.completed += 1
+        except (OSError, asyncio.TimeoutError, websockets.WebSocketException) as e:
+            self.stats.errors += 1
+            print(f'{self.game_id}: {type(e).__name__}: {e}', file=sys.stderr)
+            if not counted:
+                self.stats.game_connected()
+        finally:
+            for reader in readers:
+                reader.cancel()
+            for websocket in sockets.values():
+                await websocket.close()
+
+    async def play(self, sockets):
+        for _ in range(self.args.moves):
+            state = self.state
+            if not state['legal_moves']:
+                return
+            from_square, targets = self.rng.choice(state['legal_moves'])
+            to_square = self.rng.choice(targets)
+            captures_king = self.placement[to_square] in ('k', 'K')
+            self.updated.clear()
+            self.sent_at[state['seq'] + 1] = time.perf_counter()
+            await sockets[state['current_player']].send(self.encode_move(from_square, to_square))
+            await self.wait_update()
+            self.stats.moves += 1
+            if captures_king:
+                return
+            if self.args.move_interval > 0:
+                await asyncio.sleep(self.args.move_interval)
+
+
+async def start_server(port):
+    """在本进程中启动web_main.app"""
+    # 负载测试时关闭每步棋的日志，对局日志写入临时目录
+    os.environ.setdefault('CHESS_MOVE_LOG_LEVEL', 'WARNING')
+    os.environ.setdefault('CHESS_JOURNAL_DIR', tempfile.mkdtemp(prefix='chess-load-'))
+    import uvicorn
+    from web_main import app
+    config = uvicorn.Config(app, host='127.0.0.1', port=port, log_level='warning')
+    server = uvicorn.Server(config)
+    task = asyncio.create_task(server.serve())
+    while not server.started:
+        if task.done():
+            task.result()
+        await asyncio.sleep(0.05)
+    return server, task
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=1000, method='inclusive')[round(fraction * 1000) - 1]
+
+
+async def run(args):
+    server = server_task = None
+    if args.url is None:
+        server, server_task = await start_server(args.port)
+        args.url = f'ws://127.0.0.1:{args.port}'
+    memory_pid = args.server_pid or 'self'
+
+    stats = LoadStats(args.games)
+    run_id = f'{os.getpid()}-{int(time.time())}'
+    connect_semaphore = asyncio.Semaphore(args.connect_concurrency)
+    games = [LoadGame(index, args, stats, run_id) for index in range(args.games)]
+
+    rss_before = rss_bytes(memory_pid)
+    start = time.perf_counter()
+    tasks = [asyncio.create_task(game.run(connect_semaphore)) for game in games]
+    await stats.all_connected.wait()
+    connect_seconds = time.perf_counter() - start
+    rss_after = rss_bytes(memory_pid)
+
+    play_start = time.perf_counter()
+    await asyncio.gather(*tasks)
+    play_seconds = time.perf_counter() - play_start
+
+    if server is not None:
+        server.should_exit = True
+        await server_task
+
+    latencies = sorted(stats.latencies)
+    return {
+        'commit': current_commit(),
+        'python': platform.python_version(),
+        'mode': 'external' if server is None else 'in-process',
+        'proto': args.proto,
+        'games': args.games,
+        'moves_per_game': args.moves,
+        'move_interval': args.move_interval,
+        'completed': stats.completed,
+        'errors': stats.errors,
+        'moves': stats.moves,
+        'connect_seconds': round(connect_seconds, 3),
+        'play_seconds': round(play_seconds, 3),
+        'moves_per_second': round(stats.moves / play_seconds, 1) if play_seconds > 0 else None,
+        'latency_ms': {
+            'p50': _ms(percentile(latencies, 0.5)),
+            'p90': _ms(percentile(latencies, 0.9)),
+            'p99': _ms(percentile(latencies, 0.99)),
+            'max': _ms(latencies[-1] if latencies else None),
+        },
+        'rss_per_game_kb': (round((rss_after - rss_before) / args.games / 1024, 1)
+                            if rss_before is not None and rss_after is not None else None),
+    }
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 3)
+
+
+def compare(report, previous):
+    """与之前的结果比较，打印延迟、吞吐量和内存的变化"""
+    rows = [('p50 延迟(ms)', previous['latency_ms']['p50'], report['latency_ms']['p50']),
+            ('p99 延迟(ms)', previous['latency_ms']['p99'], report['latency_ms']['p99']),
+            ('吞吐量(步/秒)', previous['moves_per_second'], report['moves_per_second']),
+            ('每局内存(KB)', previous['rss_per_game_kb'], report['rss_per_game_kb'])]
+    if (previous['games'], previous['proto']) != (report['games'], report['proto']):
+        print('注意：两次测试的对局数或消息格式不同', file=sys.stderr)
+    for name, old, new in rows:
+        if old and new:
+            print(f'{name}: {old} -> {new} ({new / old:.2f}x)', file=sys.stderr)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='web_main的WebSocket负载测试')
+    parser.add_argument('--url', help='服务器地址，例如 ws://localhost:8000；不指定时在本进程中启动服务器')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help='在本进程中启动服务器时使用的端口')
+    parser.add_argument('--server-pid', type=int, help='外部服务器的进程号，用于统计内存')
+    parser.add_argument('--games', type=int, default=100, help='同时进行的对局数（每局两个连接）')
+    parser.add_argument('--moves', type=int, default=40, help='每局最多走的步数')
+    parser.add_argument('--move-interval', type=float, default=0.1, help='每局两步之间的间隔（秒），0为尽快')
+    parser.add_argument('--proto', choices=('json', 'bin'), default='json', help='消息格式')
+    parser.add_argument('--connect-concurrency', type=int, default=100, help='同时建立的连接数')
+    parser.add_argument('--seed', type=int, default=1, help='随机种子')
+    parser.add_argument('--output', help='把JSON结果写入文件')
+    parser.add_argument('--compare', help='与之前保存的JSON结果比较')
+    args = parser.parse_args(argv)
+
+    raise_file_limit()
+    report = asyncio.run(run(args))
+
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            compare(report, json.load(f))
+    return 1 if report['errors'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
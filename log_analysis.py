@@ -0,0 +1,416 @@
+"""对局日志分析：流式读取 chess_game.log（包括轮转的旧文件），重放每局棋并输出统计结果
+
+- 逐行读取，只在内存中保留还没结束的对局，日志再大内存占用也不变
+- 旧版本的日志处理器把同一条记录以两种时间格式（有无毫秒）各写一次，重复的行被去掉
+- 支持文本格式和 CHESS_LOG_JSON=1 的JSON格式，两种格式可以混在一起
+- 每局棋的成功走法通过 ChessBoard.move_piece 重放校验；从对局日志恢复的对局缺少开头的走法，只统计不重放
+- 结果写成列式文件（见下面的格式说明），汇总信息以JSON格式输出到标准输出
+
+列式文件格式（小端序）：魔数 b'CHCL'、版本(uint16)，然后是若干行组，每个行组为
+    头部长度(uint32) + JSON头部 {"rows": 行数, "columns": [{"name", "type", "size"}, ...]} + 各列的数据
+列类型：'q' int64，'d' float64，'str' 为 (行数+1) 个uint32偏移量加上UTF-8字节。
+每个行组最多 ROW_GROUP_SIZE 行，写入时只缓存一个行组。
+
+用法：
+    python log_analysis.py chess_game.log                  # 自动包含 chess_game.log.1、.2 等轮转文件
+    python log_analysis.py old.log.gz chess_game.log --output games.chcol
+    python log_analysis.py --show games.chcol              # 以制表符分隔的文本输出列式文件
+"""
+import argparse
+import array
+import collections
+import datetime
+import glob
+import gzip
+import json
+import os
+import re
+import struct
+import sys
+import time
+
+from chess_board import ChessBoard
+
+MAGIC = b'CHCL'
+VERSION = 1
+ROW_GROUP_SIZE = 65536
+# 去重时记住的最近记录数：重复的两行总是相邻写入，只需要一个很小的窗口
+DEDUP_WINDOW = 256
+DEFAULT_OUTPUT = 'games.chcol'
+
+_LINE = re.compile(r'^(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d)(?:,(\d{3}))? - (\w+) - (.*)$')
+_POS = r'[(\[](\d), (\d)[)\]]'
+_MOVE_OK = re.compile(rf'^Game (\S+) - Player (\S+) - Move successful: {_POS} -> {_POS}$')
+_MOVE_ATTEMPT = re.compile(rf'^Game (\S+) - Player (\S+) - Move attempt: from {_POS} to {_POS}$')
+_MOVE_INVALID = re.compile(rf'^Game (\S+) - Player (\S+) - Invalid move: {_POS} -> {_POS}$')
+_CREATED = re.compile(r'^New game created: (\S+)$')
+_RESTORED = re.compile(r'^Game (\S+)(?: restored from journal| - Took over as home process) at ply (\d+)$')
+_GAME_OVER = re.compile(r'^Game (\S+) - Game over, winner: (\w+)$')
+_TIMEOUT = re.compile(r'^Game (\S+) - \w+ ran out of time, winner: (\w+)$')
+_REMOVED = re.compile(r'^Game (\S+) - No players(?: or spectators)? left, removing game$')
+_EVICTED = re.compile(r'^Game (\S+) - Evicted: (\w+)$')
+
+# (列名, 类型)
+COLUMNS = (
+    ('game_id', 'str'),
+    ('start_time', 'd'),        # 第一条记录的时间（Unix时间戳）
+    ('end_time', 'd'),
+    ('moves', 'q'),             # 成功的走法数
+    ('attempts', 'q'),          # 走法尝试数
+    ('invalid', 'q'),           # 非法走法数
+    ('invalid_rate', 'd'),      # 非法走法数 / (成功 + 非法)
+    ('replayed', 'q'),          # 1 表示从初始局面完整重放
+    ('replay_error_ply', 'q'),  # 重放失败的步数，没有失败时为 -1
+    ('white_think', 'd'),       # 白方思考时间合计（秒）
+    ('black_think', 'd'),
+    ('mean_think', 'd'),        # 每步平均思考时间（秒）
+    ('max_think', 'd'),
+    ('winner', 'str'),
+    ('end', 'str'),             # 结束方式：game_over、timeout、removed、evicted、eof
+)
+
+
+def rotated_paths(path):
+    """日志文件及其轮转的旧文件（path.1、path.2 ...），按从旧到新排列"""
+    rotated = []
+    for candidate in glob.glob(glob.escape(path) + '.*'):
+        suffix = candidate[len(path) + 1:].removesuffix('.gz')
+        if suffix.isdigit():
+            rotated.append((int(suffix), candidate))
+    paths = [candidate for _, candidate in sorted(rotated, reverse=True)]
+    if os.path.exists(path):
+        paths.append(path)
+    return paths
+
+
+def _open(path):
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8', errors='replace')
+    return open(path, encoding='utf-8', errors='replace')
+
+
+def _parse_time(text, millis):
+    seconds = datetime.datetime.strptime(text, '%Y-%m-%d %H:%M:%S').timestamp()
+    return seconds + (int(millis) / 1000 if millis else 0.0)
+
+
+def iter_records(lines, stats=None):
+    """
+    解析日志行并去掉重复写入的记录
+    stats: 可选的Counter，累计 lines、duplicates、unparsed
+    返回: 生成器，每个元素是 (时间戳, 消息)
+    """
+    # (秒级时间, 级别, 消息) -> [无毫秒格式的未配对行数, 有毫秒格式的未配对行数]
+    recent = collections.OrderedDict()
+    for line in lines:
+        if stats is not None:
+            stats['lines'] += 1
+        line = line.rstrip('\n')
+        if line.startswith('{'):
+            try:
+                data = json.loads(line)
+                match = _LINE.match(f"{data['time']} - {data['level']} - {data['message']}")
+            except (ValueError, KeyError, TypeError):
+                match = None
+        else:
+            match = _LINE.match(line)
+        if match is None:
+            # 异常堆栈等多行记录的后续行
+            if stats is not None:
+                stats['unparsed'] += 1
+            continue
+        second, millis, level, message = match.groups()
+        key = (second, level, message)
+        fmt = 1 if millis else 0
+        counts = recent.get(key)
+        if counts is not None and counts[1 - fmt] > 0:
+            # 同一条记录以另一种时间格式写过一次
+            counts[1 - fmt] -= 1
+            if stats is not None:
+                stats['duplicates'] += 1
+            continue
+        if counts is None:
+            counts = recent[key] = [0, 0]
+            if len(recent) > DEDUP_WINDOW:
+                recent.popitem(last=False)
+        counts[fmt] += 1
+        yield _parse_time(second, millis), message
+
+
+class _GameStats:
+    """一局棋的统计（只在对局进行中保存）"""
+    __slots__ = ('game_id', 'start_time', 'end_time', 'moves', 'attempts', 'invalid', 'board', 'ply',
+                 'replay_error_ply', 'last_move_time', 'think', 'max_think', 'winner')
+
+    def __init__(self, game_id, now, board, ply=0):
+        self.game_id = game_id
+        self.start_time = now
+        self.end_time = now
+        self.moves = 0
+        self.attempts = 0
+        self.invalid = 0
+        self.board = board
+        self.ply = ply
+        self.replay_error_ply = -1
+        self.last_move_time = now
+        self.think = [0.0, 0.0]
+        self.max_think = 0.0
+        self.winner = ''
+
+    def move(self, now, from_pos, to_pos):
+        mover = self.ply % 2
+        elapsed = max(now - self.last_move_time, 0.0)
+        self.think[mover] += elapsed
+        self.max_think = max(self.max_think, elapsed)
+        self.last_move_time = now
+        self.moves += 1
+        self.ply += 1
+        if self.board is not None and not self.board.move_piece(from_pos, to_pos):
+            self.replay_error_ply = self.ply
+            self.board = None
+
+    def row(self, end):
+        decided = self.moves + self.invalid
+        return (self.game_id, self.start_time, self.end_time, self.moves, self.attempts, self.invalid,
+                self.invalid / decided if decided else 0.0,
+                1 if self.board is not None else 0, self.replay_error_ply,
+                self.think[0], self.think[1],
+                sum(self.think) / self.moves if self.moves else 0.0, self.max_think,
+                self.winner, end)
+
+
+def _position(groups):
+    return (int(groups[0]), int(groups[1])), (int(groups[2]), int(groups[3]))
+
+
+def analyze(records, stats=None):
+    """
+    重建每局棋并统计
+    records: iter_records返回的 (时间戳, 消息)
+    stats: 可选的Counter，累计 games、moves、invalid、replay_failures
+    返回: 生成器，对局结束时产生一行（按COLUMNS顺序的元组）
+    """
+    live = {}
+
+    def game(game_id, now):
+        entry = live.get(game_id)
+        if entry is None:
+            # 没有看到创建记录的对局（日志从中间开始），不重放
+            entry = live[game_id] = _GameStats(game_id, now, None)
+        entry.end_time = now
+        return entry
+
+    def finish(game_id, end):
+        entry = live.pop(game_id, None)
+        if entry is None:
+            return None
+        if stats is not None:
+            stats['games'] += 1
+            stats['moves'] += entry.moves
+            stats['invalid'] += entry.invalid
+            if entry.replay_error_ply >= 0:
+                stats['replay_failures'] += 1
+        return entry.row(end)
+
+    for now, message in records:
+        if not message.startswith(('Game ', 'New game')):
+            continue
+        match = _MOVE_OK.match(message)
+        if match:
+            game(match[1], now).move(now, *_position(match.groups()[2:]))
+            continue
+        match = _MOVE_ATTEMPT.match(message)
+        if match:
+            game(match[1], now).attempts += 1
+            continue
+        match = _MOVE_INVALID.match(message)
+        if match:
+            game(match[1], now).invalid += 1
+            continue
+        match = _CREATED.match(message)
+        if match:
+            row = finish(match[1], 'removed')
+            if row:
+                yield row
+            live[match[1]] = _GameStats(match[1], now, ChessBoard())
+            continue
+        match = _RESTORED.match(message)
+        if match:
+            row = finish(match[1], 'removed')
+            if row:
+                yield row
+            live[match[1]] = _GameStats(match[1], now, None, int(match[2]))
+            continue
+        match = _GAME_OVER.match(message) or _TIMEOUT.match(message)
+        if match:
+            game(match[1], now).winner = match[2]
+            row = finish(match[1], 'game_over' if match.re is _GAME_OVER else 'timeout')
+            if row:
+                yield row
+            continue
+        match = _REMOVED.match(message) or _EVICTED.match(message)
+        if match:
+            if match[1] in live:
+                live[match[1]].end_time = now
+            row = finish(match[1], 'removed' if match.re is _REMOVED else 'evicted')
+            if row:
+                yield row
+    for game_id in list(live):
+        yield finish(game_id, 'eof')
+
+
+class ColumnWriter:
+    """按行组写列式文件，只缓存一个行组"""
+    def __init__(self, path, columns=COLUMNS, row_group_size=ROW_GROUP_SIZE):
+        self.columns = columns
+        self.row_group_size = row_group_size
+        self.rows = 0
+        self._file = open(path, 'wb')
+        self._file.write(MAGIC + struct.pack('<H', VERSION))
+        self._reset()
+
+    def _reset(self):
+        self._buffers = [[] if kind == 'str' else array.array(kind) for _, kind in self.columns]
+        self._pending = 0
+
+    def write(self, row):
+        for buffer, value in zip(self._buffers, row):
+            buffer.append(value)
+        self._pending += 1
+        self.rows += 1
+        if self._pending >= self.row_group_size:
+            self._flush()
+
+    def _flush(self):
+        if not self._pending:
+            return
+        blobs = []
+        for (_, kind), buffer in zip(self.columns, self._buffers):
+            if kind == 'str':
+                encoded = [value.encode('utf-8') for value in buffer]
+                offsets = array.array('I', [0])
+                for value in encoded:
+                    offsets.append(offsets[-1] + len(value))
+                blobs.append(_little_endian(offsets) + b''.join(encoded))
+            else:
+                blobs.append(_little_endian(buffer))
+        header = json.dumps({
+            'rows': self._pending,
+            'columns': [{'name': name, 'type': kind, 'size': len(blob)}
+                        for (name, kind), blob in zip(self.columns, blobs)],
+        }).encode()
+        self._file.write(struct.pack('<I', len(header)) + header)
+        for blob in blobs:
+            self._file.write(blob)
+        self._reset()
+
+    def close(self):
+        self._flush()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _little_endian(values):
+    if sys.byteorder != 'little':
+        values = array.array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def read_columns(path):
+    """
+    读取列式文件
+    返回: {列名: 值列表}
+    """
+    result = {}
+    with open(path, 'rb') as f:
+        if f.read(4) != MAGIC or struct.unpack('<H', f.read(2))[0] != VERSION:
+            raise ValueError(f'{path} is not a version {VERSION} column file')
+        while True:
+            size = f.read(4)
+            if not size:
+                break
+            header = json.loads(f.read(struct.unpack('<I', size)[0]))
+            for column in header['columns']:
+                blob = f.read(column['size'])
+                values = result.setdefault(column['name'], [])
+                if column['type'] == 'str':
+                    offsets = array.array('I')
+                    offsets.frombytes(blob[:4 * (header['rows'] + 1)])
+                    if sys.byteorder != 'little':
+                        offsets.byteswap()
+                    data = blob[4 * (header['rows'] + 1):]
+                    values.extend(data[offsets[i]:offsets[i + 1]].decode('utf-8')
+                                  for i in range(header['rows']))
+                else:
+                    column_values = array.array(column['type'])
+                    column_values.frombytes(blob)
+                    if sys.byteorder != 'little':
+                        column_values.byteswap()
+                    values.extend(column_values)
+    return result
+
+
+def _lines(paths):
+    for path in paths:
+        with _open(path) as f:
+            yield from f
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='重放和统计 chess_game.log 中的对局')
+    parser.add_argument('paths', nargs='*', default=['chess_game.log'],
+                        help='日志文件，按时间顺序排列；不带数字后缀的文件自动包含它的轮转文件')
+    parser.add_argument('--output', default=DEFAULT_OUTPUT, help='列式结果文件')
+    parser.add_argument('--show', help='以制表符分隔的文本输出已有的列式文件')
+    args = parser.parse_args(argv)
+
+    if args.show:
+        columns = read_columns(args.show)
+        names = [name for name, _ in COLUMNS if name in columns]
+        print('\t'.join(names))
+        for row in zip(*(columns[name] for name in names)):
+            print('\t'.join(f'{value:.3f}' if isinstance(value, float) else str(value) for value in row))
+        return 0
+
+    paths = []
+    for path in args.paths:
+        for candidate in rotated_paths(path) if not path[-1].isdigit() else [path]:
+            if candidate not in paths:
+                paths.append(candidate)
+    if not paths:
+        print('没有找到日志文件', file=sys.stderr)
+        return 1
+
+    stats = collections.Counter()
+    start = time.perf_counter()
+    with ColumnWriter(args.output) as writer:
+        for row in analyze(iter_records(_lines(paths), stats), stats):
+            writer.write(row)
+    seconds = time.perf_counter() - start
+    decided = stats['moves'] + stats['invalid']
+    print(json.dumps({
+        'files': paths,
+        'output': args.output,
+        'lines': stats['lines'],
+        'duplicate_lines': stats['duplicates'],
+        'unparsed_lines': stats['unparsed'],
+        'games': stats['games'],
+        'moves': stats['moves'],
+        'invalid_moves': stats['invalid'],
+        'invalid_rate': round(stats['invalid'] / decided, 6) if decided else 0.0,
+        'replay_failures': stats['replay_failures'],
+        'seconds': round(seconds, 6),
+        'games_per_second': round(stats['games'] / seconds) if seconds > 0 else None,
+        'lines_per_second': round(stats['lines'] / seconds) if seconds > 0 else None,
+    }, indent=2, ensure_ascii=False))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
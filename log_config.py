@@ -0,0 +1,109 @@
+"""日志配置：记录写入队列，由后台线程统一写文件和控制台
+
+- 调用方只把LogRecord放入内存队列，文件I/O在QueueListener的线程中完成
+- 每条事件只有一个处理链，不会再出现同一行以两种时间格式写两次的问题
+- 每步棋的日志使用单独的 chess.moves 记录器，可以单独设置级别和采样率
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+MOVE_LOGGER_NAME = 'chess.moves'
+
+
+class LocalQueueHandler(logging.handlers.QueueHandler):
+    """进程内的队列处理器：不在调用方线程格式化消息，格式化留给后台线程"""
+    def prepare(self, record):
+        return record
+
+    def emit(self, record):
+        try:
+            self.enqueue(record)
+        except Exception:
+            self.handleError(record)
+
+
+class SampleFilter(logging.Filter):
+    """按固定比例保留日志记录，例如rate=0.1时每10条保留1条"""
+    def __init__(self, rate):
+        super().__init__()
+        self.every = max(1, round(1 / rate)) if rate > 0 else 0
+        self.count = 0
+
+    def filter(self, record):
+        if self.every == 0:
+            return False
+        self.count += 1
+        return (self.count - 1) % self.every == 0
+
+
+class JsonFormatter(logging.Formatter):
+    """每条记录输出一行JSON，附带通过extra={'event': ..., 'fields': {...}}传入的结构化字段"""
+    def format(self, record):
+        data = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        event = getattr(record, 'event', None)
+        if event:
+            data['event'] = event
+            data.update(getattr(record, 'fields', None) or {})
+        if record.exc_info:
+            data['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+def setup_logging(filename='chess_game.log', level=logging.INFO, move_level=logging.INFO,
+                  move_sample_rate=1.0, json_format=False, console=True):
+    """
+    配置根记录器
+    filename: 日志文件
+    level: 根记录器级别
+    move_level: chess.moves 记录器的级别（例如设为WARNING即关闭每步棋的INFO日志）
+    move_sample_rate: 每步棋日志的采样率（0到1）
+    json_format: 是否输出JSON格式
+    console: 是否同时输出到控制台
+    返回: 已启动的QueueListener
+    """
+    formatter = JsonFormatter() if json_format else logging.Formatter(LOG_FORMAT)
+    handlers = [logging.FileHandler(filename, encoding='utf-8')]
+    if console:
+        handlers.append(logging.StreamHandler())
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(LocalQueueHandler(log_queue))
+    root.setLevel(level)
+
+    move_logger = logging.getLogger(MOVE_LOGGER_NAME)
+    move_logger.setLevel(move_level)
+    for old_filter in list(move_logger.filters):
+        move_logger.removeFilter(old_filter)
+    if move_sample_rate < 1:
+        move_logger.addFilter(SampleFilter(move_sample_rate))
+
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    # 退出时把队列中剩余的记录写完
+    atexit.register(listener.stop)
+    return listener
+
+
+def log_event(logger, level, event, message, *args, **fields):
+    """
+    记录一条结构化事件
+    event: 事件类型，例如 'move_ok'
+    message: 文本格式的消息模板（%-格式，参数延迟到后台线程格式化）
+    fields: 附加的结构化字段，JSON格式输出时会展开
+    """
+    if logger.isEnabledFor(level):
+        logger.log(level, message, *args, extra={'event': event, 'fields': fields})
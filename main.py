@@ -1,9 +1,18 @@
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
 import pygame
 from chess_board import ChessBoard
 from chess_ui import ChessUI
+from chess_ai import ChessAI
+from opening_book import DEFAULT_PATH, open_book
+from tablebase import DEFAULT_DIRECTORY, open_tablebase
+
+# 默认的最高帧率
+DEFAULT_FPS = 30
 
 class ChessGame:
-    def __init__(self):
+    def __init__(self, ai_color=None, ai_time=1.0, book_path=None, tablebase_dir=None):
         # 初始化Pygame
         pygame.init()
         # 修改为合适的窗口大小
@@ -14,37 +23,125 @@ class ChessGame:
         self.board = ChessBoard()
         # 创建棋盘UI对象
         self.ui = ChessUI(self.screen, self.board)
+        # 创建电脑玩家（可选）
+        self.ai = ChessAI(ai_color, time_limit=ai_time, book=open_book(book_path),
+                          tablebase=open_tablebase(tablebase_dir)) if ai_color else None
+        self.ui.ai_color = ai_color
+        # 电脑在后台线程中搜索棋盘的副本，主循环继续处理事件和重绘
+        self.ai_executor = ThreadPoolExecutor(max_workers=1) if ai_color else None
+        # 正在进行的搜索：(Future, 开始搜索时的局面哈希值)
+        self.ai_search = None
+        # 搜索完成时由后台线程放入事件队列的事件，用来唤醒主循环
+        self.ai_done_event = pygame.event.custom_type()
+
+    def ai_to_move(self):
+        """是否轮到电脑走棋"""
+        return bool(self.ai) and not self.ui.game_over and self.board.current_player == self.ai.color
+
+    def wait_for_events(self):
+        """
+        没有待处理的事件时阻塞等待，最多等到计时显示下一次跳秒，空闲时不占用CPU
+        电脑思考期间同样阻塞等待，搜索完成的事件会唤醒主循环
+        返回: 事件列表
+        """
+        events = pygame.event.get()
+        if events or (self.ai_to_move() and self.ai_search is None):
+            return events
+        timeout = self.ui.seconds_until_timer_tick()
+        if timeout is None:
+            event = pygame.event.wait()
+        else:
+            # 多等1毫秒，保证醒来时显示的秒数已经变化
+            event = pygame.event.wait(int(timeout * 1000) + 1)
+        if event.type == pygame.NOEVENT:
+            return []
+        return [event] + pygame.event.get()
+
+    def play_ai_move(self):
+        """轮到电脑时在后台开始搜索，搜索完成后走棋（每次主循环调用一次，不会阻塞）"""
+        if not self.ai:
+            return
+        if self.ai_search is not None:
+            future, key = self.ai_search
+            if not future.done():
+                return
+            self.ai_search = None
+            move = future.result()
+            # 搜索期间玩家可能悔棋或重新开局，局面已经改变时丢弃结果
+            if move and not self.ui.game_over and self.board.zobrist_key == key:
+                # 思考时间记入电脑一方的用时
+                self.ui.update_timer()
+                self.ui.apply_move(*move)
+            return
+        if self.ui.game_over or self.board.current_player != self.ai.color:
+            return
+        future = self.ai_executor.submit(self.ai.choose_move, self.board.copy())
+        future.add_done_callback(lambda _: pygame.event.post(pygame.event.Event(self.ai_done_event)))
+        self.ai_search = (future, self.board.zobrist_key)
+
+    def close(self):
+        """退出前等待后台搜索结束（最多一步的思考时间）"""
+        if self.ai_executor is not None:
+            self.ai_executor.shutdown(wait=True, cancel_futures=True)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="国际象棋")
+    parser.add_argument("--ai", choices=["white", "black"], help="由电脑执子的一方")
+    parser.add_argument("--ai-time", type=float, default=1.0, help="电脑每步的思考时间（秒）")
+    parser.add_argument("--book", default=DEFAULT_PATH, help="开局库文件，文件不存在时不使用开局库")
+    parser.add_argument("--tablebases", default=DEFAULT_DIRECTORY, help="残局库目录，目录不存在时不使用残局库")
+    parser.add_argument("--fps", type=int, default=DEFAULT_FPS, help="最高帧率")
+    return parser.parse_args()
 
 def main():
-    game = ChessGame()
+    args = parse_args()
+    game = ChessGame(ai_color=args.ai, ai_time=args.ai_time, book_path=args.book,
+                     tablebase_dir=args.tablebases)
+    clock = pygame.time.Clock()
+    # 界面不使用鼠标移动事件，屏蔽后移动鼠标不会唤醒主循环
+    pygame.event.set_blocked(pygame.MOUSEMOTION)
 
-    # 主游戏循环
+    # 主游戏循环：只在有输入、局面变化或计时跳秒时醒来重绘
     running = True
     while running:
         # 处理所有事件
-        for event in pygame.event.get():
+        for event in game.wait_for_events():
             # 如果点击关闭窗口，则退出游戏
             if event.type == pygame.QUIT:
                 running = False
+            # 窗口被遮挡后恢复时重绘整个窗口
+            elif event.type in (pygame.VIDEOEXPOSE, pygame.WINDOWEXPOSED):
+                game.ui.invalidate()
             # 如果按下空格键，重置游戏和计时器
             elif event.type == pygame.KEYDOWN:
                 if event.key == pygame.K_SPACE:
                     game.board.reset_board()
                     game.ui.reset_timers()
+                # 按下退格键悔棋
+                elif event.key == pygame.K_BACKSPACE:
+                    game.ui.undo_move()
             # 处理棋盘上的鼠标事件
             game.ui.handle_event(event)
 
         # 更新计时器
         game.ui.update_timer()
 
-        # 绘制棋盘和棋子
-        game.ui.draw()
+        # 只重绘发生变化的格子和计时条，并只更新这些区域
+        dirty_rects = game.ui.draw()
 
         # 更新屏幕显示
-        pygame.display.flip()
+        if dirty_rects:
+            pygame.display.update(dirty_rects)
+
+        # 轮到电脑时开始搜索或取回搜索结果
+        game.play_ai_move()
+
+        # 限制最高帧率
+        clock.tick(args.fps)
 
     # 退出Pygame
+    game.close()
     pygame.quit()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,257 @@
+"""运行指标：低开销的计数器、仪表和直方图，以Prometheus文本格式输出
+
+指标对象在模块级创建并自动注册到REGISTRY，热点路径上只做一次加法或一次二分查找。
+只在事件循环线程中更新，不加锁。
+
+还包括：
+- EventLoopLagMonitor: 定时测量事件循环的延迟
+- StackSampler: 采样分析器，定时抓取各线程的调用栈，输出折叠栈格式（可直接生成火焰图）
+"""
+import abc
+import asyncio
+import bisect
+import collections
+import os
+import sys
+import threading
+import time
+
+# 默认的直方图分桶（秒），覆盖从几十微秒到几秒
+DEFAULT_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+                   0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class Registry:
+    """指标注册表"""
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+
+    def render(self):
+        """返回Prometheus文本格式的全部指标"""
+        lines = []
+        for metric in self.metrics:
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{value}"' for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric(abc.ABC):
+    kind = ''
+
+    def __init__(self, name, documentation, registry=REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        if registry is not None:
+            registry.register(self)
+
+    @abc.abstractmethod
+    def samples(self):
+        """文本格式的样本行"""
+
+
+class _LabelledMetric(_Metric):
+    """可以按标签值拆分为子指标的指标"""
+    def __init__(self, name, documentation, labelnames=(), registry=REGISTRY):
+        super().__init__(name, documentation, registry)
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+
+    def labels(self, *values):
+        """返回指定标签值的子指标"""
+        child = self._children.get(values)
+        if child is None:
+            child = self._children[values] = self._new_child()
+        return child
+
+    @abc.abstractmethod
+    def _new_child(self):
+        """创建一组标签值对应的子指标"""
+
+    def _items(self):
+        if self.labelnames:
+            return self._children.items()
+        return [((), self)]
+
+
+class Counter(_LabelledMetric):
+    """只增不减的计数器"""
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=(), registry=REGISTRY):
+        super().__init__(name, documentation, labelnames, registry)
+        self.value = 0
+
+    def _new_child(self):
+        return Counter(self.name, self.documentation, registry=None)
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def samples(self):
+        return [f'{self.name}{_format_labels(self.labelnames, values)} {_format_value(child.value)}'
+                for values, child in self._items()]
+
+
+class Gauge(_Metric):
+    """可增可减的数值，也可以传入函数在输出时计算"""
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, func=None, registry=REGISTRY):
+        super().__init__(name, documentation, registry)
+        self.func = func
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+    def samples(self):
+        value = self.func() if self.func is not None else self.value
+        return [f'{self.name} {_format_value(value)}']
+
+
+class Histogram(_LabelledMetric):
+    """固定分桶的直方图"""
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS, registry=REGISTRY):
+        super().__init__(name, documentation, labelnames, registry)
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def _new_child(self):
+        return Histogram(self.name, self.documentation, buckets=self.buckets, registry=None)
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def time(self):
+        """用于with语句，记录代码块的耗时"""
+        return _Timer(self)
+
+    def samples(self):
+        lines = []
+        for values, child in self._items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), child.counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, values, [('le', _format_value(bound))])
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _format_labels(self.labelnames, values)
+            lines.append(f'{self.name}_sum{labels} {_format_value(child.sum)}')
+            lines.append(f'{self.name}_count{labels} {child.count}')
+        return lines
+
+
+class _Timer:
+    __slots__ = ('histogram', 'start')
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.start)
+
+
+class EventLoopLagMonitor:
+    """每隔interval秒醒来一次，实际醒来时间与预期的差值就是事件循环的延迟"""
+    def __init__(self, histogram, interval=0.1):
+        self.histogram = histogram
+        self.interval = interval
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            self.histogram.observe(max(0.0, loop.time() - expected))
+
+
+class StackSampler:
+    """
+    采样分析器：在后台线程中定时抓取所有线程的调用栈并计数
+    结果为折叠栈格式，每行 “线程名;函数1;函数2;... 次数”，可以用flamegraph.pl等工具生成火焰图
+    """
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                self.stacks[';'.join(reversed(stack))] += 1
+            self.samples += 1
+
+    def render(self):
+        """返回折叠栈格式的结果，按次数从多到少排列"""
+        return ''.join(f'{stack} {count}\n' for stack, count in self.stacks.most_common())
@@ -0,0 +1,233 @@
+"""开局库：按局面哈希值排序的定长记录文件，通过mmap和二分查找查询
+
+文件格式（小端序）：
+- 文件头 12 字节：魔数 b'CHBK'、版本(uint16)、记录长度(uint16)、记录数(uint32)
+- 记录 12 字节：局面的Zobrist哈希值(uint64)、走法(uint16，起点格子 << 6 | 终点格子)、权重(uint16)
+记录按哈希值和走法排序，同一局面的走法相邻。
+
+查询时文件通过mmap映射到内存，只读取二分查找经过的几页：不需要加载时间，
+多个进程打开同一个开局库时共享操作系统的页缓存，不会各自复制一份。
+
+用法：
+    python opening_book.py build                       # 用内置的常见开局生成 opening_book.bin
+    python opening_book.py build --games games.txt     # 每行一局，坐标记法，例如 "e2e4 e7e5 g1f3"
+    python opening_book.py probe e2e4 e7e5             # 查看走完这些棋之后的开局库走法
+
+本项目没有王车易位、吃过路兵和升变，这些走法会被忽略（该局的剩余走法也不再使用）。
+"""
+import argparse
+import collections
+import mmap
+import os
+import random
+import struct
+import sys
+
+from chess_bitboard import position_of, square_of
+from chess_board import ChessBoard
+
+MAGIC = b'CHBK'
+VERSION = 1
+HEADER = struct.Struct('<4sHHI')
+RECORD = struct.Struct('<QHH')
+KEY = struct.Struct('<Q')
+MAX_WEIGHT = 0xFFFF
+DEFAULT_PATH = 'opening_book.bin'
+DEFAULT_MAX_PLY = 16
+
+# 内置的常见开局（坐标记法），生成默认开局库时使用
+DEFAULT_LINES = [
+    'e2e4 e7e5 g1f3 b8c6 f1b5 a7a6 b5a4 g8f6',          # 西班牙开局
+    'e2e4 e7e5 g1f3 b8c6 f1c4 f8c5 c2c3 g8f6 d2d3 d7d6',  # 意大利开局
+    'e2e4 e7e5 g1f3 b8c6 d2d4 e5d4 f3d4 g8f6 d4c6 b7c6',  # 苏格兰开局
+    'e2e4 e7e5 g1f3 g8f6 f3e5 d7d6 e5f3 f6e4',          # 俄罗斯防御
+    'e2e4 c7c5 g1f3 d7d6 d2d4 c5d4 f3d4 g8f6 b1c3 a7a6',  # 西西里防御
+    'e2e4 c7c5 g1f3 b8c6 d2d4 c5d4 f3d4 g8f6 b1c3 e7e5',
+    'e2e4 c7c5 g1f3 e7e6 d2d4 c5d4 f3d4 a7a6',
+    'e2e4 e7e6 d2d4 d7d5 b1c3 g8f6 c1g5 f8e7',          # 法兰西防御
+    'e2e4 e7e6 d2d4 d7d5 e4e5 c7c5 c2c3 b8c6',
+    'e2e4 c7c6 d2d4 d7d5 b1c3 d5e4 c3e4 c8f5',          # 卡罗-康防御
+    'e2e4 d7d5 e4d5 d8d5 b1c3 d5a5',                    # 斯堪的纳维亚防御
+    'd2d4 d7d5 c2c4 e7e6 b1c3 g8f6 c1g5 f8e7',          # 后翼弃兵拒绝
+    'd2d4 d7d5 c2c4 c7c6 g1f3 g8f6 b1c3 d5c4',          # 斯拉夫防御
+    'd2d4 d7d5 c2c4 d5c4 g1f3 g8f6 e2e3 e7e6',          # 后翼弃兵接受
+    'd2d4 g8f6 c2c4 e7e6 b1c3 f8b4 e2e3',               # 尼姆佐印度防御
+    'd2d4 g8f6 c2c4 e7e6 g1f3 b7b6 g2g3 c8b7',          # 后翼印度防御
+    'd2d4 g8f6 c2c4 g7g6 b1c3 f8g7 e2e4 d7d6 g1f3',     # 古印度防御
+    'd2d4 g8f6 c2c4 g7g6 b1c3 d7d5 c4d5 f6d5 e2e4 d5c3', # 格林菲尔德防御
+    'c2c4 e7e5 b1c3 g8f6 g1f3 b8c6 g2g3',               # 英国式开局
+    'c2c4 g8f6 b1c3 e7e6 g1f3 d7d5 d2d4',
+    'g1f3 d7d5 d2d4 g8f6 c2c4 e7e6 b1c3',               # 列蒂开局
+    'g1f3 g8f6 c2c4 g7g6 b1c3 f8g7 e2e4',
+]
+
+
+def encode_move(from_pos, to_pos):
+    return square_of(*from_pos) << 6 | square_of(*to_pos)
+
+
+def decode_move(move):
+    return position_of(move >> 6), position_of(move & 63)
+
+
+def parse_square(text):
+    """把坐标记法的格子（例如 'e2'）转为(行, 列)"""
+    col = ord(text[0]) - ord('a')
+    row = int(text[1]) - 1
+    if not (0 <= row < 8 and 0 <= col < 8):
+        raise ValueError(f'Invalid square: {text}')
+    return row, col
+
+
+def parse_move(text):
+    """把坐标记法的走法（例如 'e2e4'）转为(起始位置, 目标位置)"""
+    if len(text) != 4:
+        raise ValueError(f'Invalid move: {text}')
+    return parse_square(text[:2]), parse_square(text[2:])
+
+
+def format_move(from_pos, to_pos):
+    return ''.join(f"{chr(ord('a') + col)}{row + 1}" for row, col in (from_pos, to_pos))
+
+
+def collect_moves(lines, max_ply=DEFAULT_MAX_PLY):
+    """
+    统计每个局面下各走法出现的次数
+    lines: 每个元素是一局的走法（坐标记法，空格分隔）
+    返回: Counter，键为(局面哈希值, 走法编码)
+    """
+    counts = collections.Counter()
+    for line_number, line in enumerate(lines, 1):
+        board = ChessBoard()
+        for text in line.split()[:max_ply]:
+            try:
+                from_pos, to_pos = parse_move(text)
+            except ValueError:
+                from_pos = to_pos = None
+            if from_pos is None or not board.is_legal_move(from_pos, to_pos):
+                print(f'第{line_number}局：忽略 {text} 及之后的走法', file=sys.stderr)
+                break
+            counts[(board.zobrist_key, encode_move(from_pos, to_pos))] += 1
+            board.make_move(from_pos, to_pos)
+    return counts
+
+
+def write_book(path, counts):
+    """把统计结果写成排序的定长记录文件（先写临时文件再替换）"""
+    records = sorted(counts.items())
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, RECORD.size, len(records)))
+        for (key, move), weight in records:
+            f.write(RECORD.pack(key, move, min(weight, MAX_WEIGHT)))
+    os.replace(tmp_path, path)
+    return len(records)
+
+
+class OpeningBook:
+    """只读的开局库"""
+    def __init__(self, path=DEFAULT_PATH, rng=None):
+        self.path = path
+        self.rng = rng or random.Random()
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, record_size, self.count = HEADER.unpack_from(self._mm)
+        if magic != MAGIC or version != VERSION or record_size != RECORD.size:
+            self._mm.close()
+            raise ValueError(f'{path} is not a version {VERSION} opening book')
+
+    def close(self):
+        self._mm.close()
+
+    def __len__(self):
+        return self.count
+
+    def _key_at(self, index):
+        return KEY.unpack_from(self._mm, HEADER.size + index * RECORD.size)[0]
+
+    def probe(self, key):
+        """
+        查询局面的开局库走法
+        key: 局面的Zobrist哈希值
+        返回: [((起始行, 起始列), (目标行, 目标列), 权重), ...]，不在开局库中时为空列表
+        """
+        # 二分查找第一条哈希值不小于key的记录
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key_at(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        moves = []
+        offset = HEADER.size + lo * RECORD.size
+        end = HEADER.size + self.count * RECORD.size
+        while offset < end:
+            record_key, move, weight = RECORD.unpack_from(self._mm, offset)
+            if record_key != key:
+                break
+            moves.append((*decode_move(move), weight))
+            offset += RECORD.size
+        return moves
+
+    def choose(self, board):
+        """
+        按权重随机选择一步开局库走法
+        返回: (起始位置, 目标位置)，不在开局库中时返回None
+        """
+        # 哈希值碰撞时开局库的走法可能不合法，跳过
+        moves = [move for move in self.probe(board.zobrist_key)
+                 if board.is_legal_move(move[0], move[1])]
+        if not moves:
+            return None
+        from_pos, to_pos, _ = self.rng.choices(moves, weights=[move[2] for move in moves])[0]
+        return from_pos, to_pos
+
+
+def open_book(path):
+    """打开开局库，文件不存在时返回None"""
+    if not path or not os.path.exists(path):
+        return None
+    return OpeningBook(path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='开局库的生成和查询')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    build = subparsers.add_parser('build', help='生成开局库')
+    build.add_argument('--games', help='对局文件，每行一局，坐标记法；不指定时使用内置的常见开局')
+    build.add_argument('--max-ply', type=int, default=DEFAULT_MAX_PLY, help='每局最多使用的步数')
+    build.add_argument('--output', default=DEFAULT_PATH, help='输出文件')
+    probe = subparsers.add_parser('probe', help='查询走完指定走法之后的开局库走法')
+    probe.add_argument('moves', nargs='*', help='坐标记法的走法，例如 e2e4 e7e5')
+    probe.add_argument('--book', default=DEFAULT_PATH, help='开局库文件')
+    args = parser.parse_args(argv)
+
+    if args.command == 'build':
+        if args.games:
+            with open(args.games, encoding='utf-8') as f:
+                lines = [line for line in f if line.strip() and not line.startswith('#')]
+        else:
+            lines = DEFAULT_LINES
+        records = write_book(args.output, collect_moves(lines, args.max_ply))
+        print(f'{args.output}: {records} 条记录，来自 {len(lines)} 局')
+        return 0
+
+    book = OpeningBook(args.book)
+    board = ChessBoard()
+    for text in args.moves:
+        from_pos, to_pos = parse_move(text)
+        if not board.move_piece(from_pos, to_pos):
+            print(f'不合法的走法: {text}', file=sys.stderr)
+            return 1
+    moves = book.probe(board.zobrist_key)
+    total = sum(weight for _, _, weight in moves)
+    for from_pos, to_pos, weight in sorted(moves, key=lambda move: -move[2]):
+        print(f'{format_move(from_pos, to_pos)}  {weight}  {weight / total:.0%}')
+    if not moves:
+        print('不在开局库中')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
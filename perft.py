@@ -0,0 +1,140 @@
+"""Perft基准测试：统计从标准局面出发N步之内的叶子节点数，并测量走法生成速度
+
+用法：
+    python perft.py                          # 所有局面，默认深度
+    python perft.py --depth 4 --positions start
+    python perft.py --output perft.json      # 保存JSON结果，便于不同提交之间比较
+    python perft.py --compare perft.json     # 与之前保存的结果比较
+
+本项目的规则没有王车易位、吃过路兵和兵的升变，未移动的兵走两格时不检查中间格子，
+吃掉对方的王即结束对局，所以节点数与标准国际象棋的perft结果不同。
+下面的已知答案由最初逐格检查的实现计算得到。
+"""
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import time
+
+from chess_board import ChessBoard
+
+# 名称: (棋子布局（FEN格式，第8横行即第7行在前）, 行棋方, {深度: 已知节点数})
+POSITIONS = {
+    'start': ('rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR', 'white',
+              {1: 20, 2: 400, 3: 8982, 4: 201378, 5: 5050956}),
+    'kiwipete': ('r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R', 'white',
+                 {1: 49, 2: 2090, 3: 102724}),
+    'endgame': ('8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8', 'white',
+                {1: 16, 2: 276, 3: 4807, 4: 88063}),
+    'rooks': ('r3k2r/8/8/8/8/8/8/R3K2R', 'black',
+              {1: 24, 2: 515, 3: 13029}),
+}
+DEFAULT_DEPTH = 3
+
+
+def load_position(placement, current_player):
+    """根据FEN格式的棋子布局创建棋盘"""
+    return ChessBoard.from_fen(f'{placement} {current_player[0]}')
+
+
+def perft(board, depth):
+    """
+    统计叶子节点数
+    王被吃掉的局面视为对局结束，不再向下展开
+    """
+    if depth == 0:
+        return 1
+    if board.is_king_captured(board.current_player):
+        return 0
+    moves = board.get_all_valid_moves()
+    if depth == 1:
+        return len(moves)
+    nodes = 0
+    for from_pos, to_pos in moves:
+        board.make_move(from_pos, to_pos)
+        nodes += perft(board, depth - 1)
+        board.unmake_move()
+    return nodes
+
+
+def run_position(name, depth):
+    """对一个局面运行perft，返回结果字典"""
+    placement, current_player, expected = POSITIONS[name]
+    board = load_position(placement, current_player)
+    start = time.perf_counter()
+    nodes = perft(board, depth)
+    seconds = time.perf_counter() - start
+    result = {
+        'position': name,
+        'depth': depth,
+        'nodes': nodes,
+        'seconds': round(seconds, 6),
+        'nps': round(nodes / seconds) if seconds > 0 else None,
+        'expected': expected.get(depth),
+    }
+    result['ok'] = None if result['expected'] is None else nodes == result['expected']
+    return result
+
+
+def current_commit():
+    """获取当前git提交，失败时返回None"""
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(report, previous):
+    """与之前的结果比较，打印节点数差异和速度变化"""
+    old_results = {(r['position'], r['depth']): r for r in previous['results']}
+    for result in report['results']:
+        old = old_results.get((result['position'], result['depth']))
+        if not old:
+            continue
+        note = '' if old['nodes'] == result['nodes'] else \
+            f"  节点数不同: {old['nodes']} -> {result['nodes']}"
+        if old['nps'] and result['nps']:
+            print(f"{result['position']} depth {result['depth']}: "
+                  f"{old['nps']} -> {result['nps']} nps ({result['nps'] / old['nps']:.2f}x){note}",
+                  file=sys.stderr)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='ChessBoard走法生成的perft基准测试')
+    parser.add_argument('--depth', type=int, default=DEFAULT_DEPTH, help='搜索深度')
+    parser.add_argument('--positions', default=','.join(POSITIONS),
+                        help='逗号分隔的局面名称: ' + ', '.join(POSITIONS))
+    parser.add_argument('--output', help='把JSON结果写入文件')
+    parser.add_argument('--compare', help='与之前保存的JSON结果比较')
+    args = parser.parse_args(argv)
+
+    results = [run_position(name, args.depth) for name in args.positions.split(',')]
+    total_nodes = sum(r['nodes'] for r in results)
+    total_seconds = sum(r['seconds'] for r in results)
+    report = {
+        'commit': current_commit(),
+        'python': platform.python_version(),
+        'depth': args.depth,
+        'results': results,
+        'total_nodes': total_nodes,
+        'total_seconds': round(total_seconds, 6),
+        'nps': round(total_nodes / total_seconds) if total_seconds > 0 else None,
+    }
+
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            compare(report, json.load(f))
+
+    # 有已知答案不一致时返回非零退出码
+    return 1 if any(r['ok'] is False for r in results) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,426 @@
+"""PGN/FEN导入导出：流式读写PGN文件，并在多个进程中批量回放校验对局
+
+读取时逐行扫描，每次只在内存中保留一局的文本，可以处理包含数百万局的文件。
+走法使用标准代数记法（SAN），例如 'e4'、'Nf3'、'exd5'、'Rad1'；
+本项目没有王车易位、吃过路兵和兵的升变，包含这些走法的对局视为无效。
+带有 [SetUp "1"] 和 [FEN "..."] 标签的对局从FEN局面开始。
+
+用法：
+    python pgn.py validate games.pgn                 # 在进程池中回放校验所有对局，报告每秒局数
+    python pgn.py validate a.pgn b.pgn --workers 4 --batch 500
+    python pgn.py fen games.pgn                      # 输出每局最终局面的FEN
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from chess_bitboard import position_of, square_of
+from chess_board import PIECE_LETTERS, ChessBoard
+
+START_FEN = 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w - - 0 1'
+RESULTS = ('1-0', '0-1', '1/2-1/2', '*')
+# 导出时按七个标准标签的顺序写在最前面
+SEVEN_TAG_ROSTER = ('Event', 'Site', 'Date', 'Round', 'White', 'Black', 'Result')
+LINE_WIDTH = 79
+DEFAULT_BATCH = 200
+
+_TAG = re.compile(r'\[\s*(\w+)\s+"((?:[^"\\]|\\.)*)"\s*\]')
+_SAN = re.compile(r'^([KQRBN])?([a-h])?([1-8])?(x)?([a-h][1-8])(=[QRBN])?[+#]?[!?]*$')
+_MOVE_NUMBER = re.compile(r'^\d+\.+')
+_SAN_PIECES = {letter.upper(): piece_type for piece_type, letter in PIECE_LETTERS.items()}
+
+
+class PgnGame:
+    """一局PGN对局：标签和SAN走法列表"""
+    def __init__(self, headers=None, moves=None, result='*'):
+        self.headers = headers if headers is not None else {}
+        self.moves = moves if moves is not None else []
+        self.result = result
+
+    def start_board(self):
+        """对局的初始局面（有FEN标签时从FEN开始）"""
+        fen = self.headers.get('FEN')
+        return ChessBoard.from_fen(fen) if fen else ChessBoard()
+
+
+def iter_game_texts(f):
+    """
+    按局切分PGN文本，每次只读入一局
+    f: 文本文件对象或任意可迭代的行
+    返回: 生成器，每个元素是一局的原始文本
+    """
+    lines = []
+    in_movetext = False
+    for line in f:
+        stripped = line.strip()
+        if stripped.startswith('[') and in_movetext:
+            yield ''.join(lines)
+            lines = []
+            in_movetext = False
+        if stripped and not stripped.startswith('[') and not stripped.startswith('%'):
+            in_movetext = True
+        lines.append(line)
+    if any(line.strip() for line in lines):
+        yield ''.join(lines)
+
+
+def _movetext_tokens(text):
+    """去掉注释、变着和NAG，返回走法和结果记号"""
+    tokens = []
+    depth = 0
+    position = 0
+    length = len(text)
+    while position < length:
+        char = text[position]
+        if char == '{':
+            end = text.find('}', position)
+            position = length if end < 0 else end + 1
+            continue
+        if char == ';':
+            end = text.find('\n', position)
+            position = length if end < 0 else end + 1
+            continue
+        if char == '(':
+            depth += 1
+            position += 1
+            continue
+        if char == ')':
+            depth = max(depth - 1, 0)
+            position += 1
+            continue
+        if char.isspace():
+            position += 1
+            continue
+        end = position
+        while end < length and not text[end].isspace() and text[end] not in '{;()':
+            end += 1
+        token = text[position:end]
+        position = end
+        if depth:
+            continue
+        token = _MOVE_NUMBER.sub('', token)
+        if token and not token.startswith('$'):
+            tokens.append(token)
+    return tokens
+
+
+def parse_game(text):
+    """
+    解析一局PGN文本（不检查走法是否合法）
+    返回: PgnGame
+    """
+    headers = {}
+    movetext = []
+    for line in text.splitlines(keepends=True):
+        stripped = line.strip()
+        if stripped.startswith('%'):
+            continue
+        if stripped.startswith('[') and not movetext:
+            for name, value in _TAG.findall(stripped):
+                headers[name] = value.replace('\\"', '"').replace('\\\\', '\\')
+            continue
+        movetext.append(line)
+    game = PgnGame(headers)
+    for token in _movetext_tokens(''.join(movetext)):
+        if token in RESULTS:
+            game.result = token
+            break
+        game.moves.append(token)
+    return game
+
+
+def read_games(f):
+    """
+    流式读取PGN文件
+    返回: 生成器，每个元素是PgnGame
+    """
+    for text in iter_game_texts(f):
+        yield parse_game(text)
+
+
+def parse_san(board, san):
+    """
+    把SAN走法转为当前局面下的(起始位置, 目标位置)
+    走法不合法、有歧义或使用本项目不支持的规则时抛出ValueError
+    """
+    match = _SAN.match(san)
+    if match is None:
+        raise ValueError(f'Unsupported move: {san}')
+    letter, from_file, from_rank, _, target, promotion = match.groups()
+    if promotion:
+        raise ValueError(f'Promotion is not supported: {san}')
+    piece_type = _SAN_PIECES[letter] if letter else 'pawn'
+    to_square = square_of(int(target[1]) - 1, ord(target[0]) - ord('a'))
+    candidates = []
+    for from_square, targets in board.legal_move_map().items():
+        if not targets >> to_square & 1:
+            continue
+        row, col = position_of(from_square)
+        if board.board[row][col].type != piece_type:
+            continue
+        if from_file and col != ord(from_file) - ord('a'):
+            continue
+        if from_rank and row != int(from_rank) - 1:
+            continue
+        candidates.append((row, col))
+    if len(candidates) != 1:
+        raise ValueError(f'{"Ambiguous" if candidates else "Illegal"} move: {san}')
+    return candidates[0], position_of(to_square)
+
+
+def _square_name(row, col):
+    return f"{chr(ord('a') + col)}{row + 1}"
+
+
+def format_san(board, from_pos, to_pos):
+    """
+    把当前局面下的一步合法走法转为SAN（不包括将军标记）
+    返回: 例如 'Nbd2'、'exd5'，同一列的两个兵都能走到目标格时写成 'c2c4'
+    """
+    piece = board.board[from_pos[0]][from_pos[1]]
+    capture = board.board[to_pos[0]][to_pos[1]] is not None
+    # 同类棋子也能走到目标格时加上起始列或行区分
+    # （本项目的兵走两格时不检查中间格子，同一列的两个兵可能走到同一格）
+    to_square = square_of(*to_pos)
+    rivals = []
+    for from_square, targets in board.legal_move_map().items():
+        rival = position_of(from_square)
+        if rival != from_pos and targets >> to_square & 1 and \
+                board.board[rival[0]][rival[1]].type == piece.type:
+            rivals.append(rival)
+    if piece.type == 'pawn':
+        letter = ''
+        # 兵吃子时总是写出起始列
+        if capture and all(col != from_pos[1] for _, col in rivals):
+            prefix = chr(ord('a') + from_pos[1])
+        elif rivals:
+            prefix = _square_name(*from_pos)
+        else:
+            prefix = ''
+    else:
+        letter = PIECE_LETTERS[piece.type].upper()
+        if not rivals:
+            prefix = ''
+        elif all(col != from_pos[1] for _, col in rivals):
+            prefix = chr(ord('a') + from_pos[1])
+        elif all(row != from_pos[0] for row, _ in rivals):
+            prefix = str(from_pos[0] + 1)
+        else:
+            prefix = _square_name(*from_pos)
+    return f"{letter}{prefix}{'x' if capture else ''}{_square_name(*to_pos)}"
+
+
+def _result_after(board):
+    """对局结束（有一方的王被吃掉）时返回结果，否则返回None"""
+    if board.is_king_captured('black'):
+        return '1-0'
+    if board.is_king_captured('white'):
+        return '0-1'
+    return None
+
+
+def write_game(f, moves, headers=None, start_fen=None):
+    """
+    把一局棋写成PGN
+    f: 文本文件对象
+    moves: [(起始位置, 目标位置), ...]，按顺序从初始局面（或start_fen）开始
+    headers: 可选的标签字典，缺少的七个标准标签用 '?' 补齐
+    返回: 对局结果 '1-0'、'0-1' 或 '*'
+    """
+    board = ChessBoard.from_fen(start_fen) if start_fen else ChessBoard()
+    tokens = []
+    result = '*'
+    for from_pos, to_pos in moves:
+        if not board.is_legal_move(from_pos, to_pos):
+            raise ValueError(f'Illegal move: {_square_name(*from_pos)}{_square_name(*to_pos)}')
+        if board.current_player == 'white' or not tokens:
+            number = board.ply // 2 + 1
+            tokens.append(f'{number}.' if board.current_player == 'white' else f'{number}...')
+        san = format_san(board, from_pos, to_pos)
+        board.make_move(from_pos, to_pos)
+        finished = _result_after(board)
+        if finished:
+            tokens.append(san)
+            result = finished
+            break
+        if board.is_king_in_check(board.current_player):
+            san += '+'
+        tokens.append(san)
+    tokens.append(result)
+
+    tags = dict(headers or {})
+    tags['Result'] = result
+    if start_fen:
+        tags['SetUp'] = '1'
+        tags['FEN'] = start_fen
+    for name in SEVEN_TAG_ROSTER:
+        f.write(f'[{name} "{_escape(tags.get(name, "?"))}"]\n')
+    for name, value in tags.items():
+        if name not in SEVEN_TAG_ROSTER:
+            f.write(f'[{name} "{_escape(value)}"]\n')
+    f.write('\n')
+    line = ''
+    for token in tokens:
+        if line and len(line) + 1 + len(token) > LINE_WIDTH:
+            f.write(line + '\n')
+            line = token
+        else:
+            line = f'{line} {token}' if line else token
+    f.write(line + '\n\n')
+    return result
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"')
+
+
+def board_history(board):
+    """
+    从撤销栈还原棋盘的走法记录
+    返回: (起始局面的FEN（标准初始局面时为None）, [(起始位置, 目标位置), ...])
+    """
+    moves = [(record[0], record[1]) for record in board.undo_stack]
+    # copy不包括撤销栈，在原棋盘上撤销再重做来得到起始局面
+    undone = []
+    while board.undo_stack:
+        undone.append(board.unmake_move())
+    start = board.to_fen()
+    for from_pos, to_pos in reversed(undone):
+        board.make_move(from_pos, to_pos)
+    return (None if start == START_FEN else start), moves
+
+
+def replay_game(game):
+    """
+    用move_piece逐步回放一局棋
+    返回: (回放后的棋盘, 回放的步数, 错误信息)，全部合法时错误信息为None，
+          FEN标签无效时棋盘为None
+    """
+    try:
+        board = game.start_board()
+    except ValueError as e:
+        return None, 0, str(e)
+    for ply, san in enumerate(game.moves):
+        if _result_after(board):
+            return board, ply, f'Move after the game ended: {san}'
+        try:
+            from_pos, to_pos = parse_san(board, san)
+        except ValueError as e:
+            return board, ply, str(e)
+        if not board.move_piece(from_pos, to_pos):
+            return board, ply, f'Illegal move: {san}'
+    return board, len(game.moves), None
+
+
+def _validate_batch(first_index, texts):
+    """
+    在子进程中校验一批对局
+    返回: (对局数, 总步数, [(对局编号, 错误信息), ...])
+    """
+    plies = 0
+    errors = []
+    for index, text in enumerate(texts, first_index):
+        _, count, error = replay_game(parse_game(text))
+        plies += count
+        if error is not None:
+            errors.append((index, error))
+    return len(texts), plies, errors
+
+
+def _batches(paths, batch_size):
+    """依次读取文件，按batch_size把对局文本分批，返回(第一局的编号, 文本列表)"""
+    index = 1
+    for path in paths:
+        with open(path, encoding='utf-8', errors='replace') as f:
+            batch = []
+            for text in iter_game_texts(f):
+                batch.append(text)
+                if len(batch) >= batch_size:
+                    yield index, batch
+                    index += len(batch)
+                    batch = []
+            if batch:
+                yield index, batch
+                index += len(batch)
+
+
+def validate(paths, workers=None, batch_size=DEFAULT_BATCH, on_error=None):
+    """
+    在进程池中回放校验PGN文件中的所有对局
+    同时提交的批次数量有上限，内存占用与文件大小无关
+    on_error: 可选的函数 on_error(对局编号, 错误信息)
+    返回: 统计结果字典
+    """
+    workers = workers or os.cpu_count() or 1
+    games = plies = invalid = 0
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = set()
+        batches = _batches(paths, batch_size)
+        exhausted = False
+        while pending or not exhausted:
+            while not exhausted and len(pending) < workers * 2:
+                batch = next(batches, None)
+                if batch is None:
+                    exhausted = True
+                else:
+                    pending.add(executor.submit(_validate_batch, *batch))
+            if not pending:
+                break
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                count, batch_plies, errors = future.result()
+                games += count
+                plies += batch_plies
+                invalid += len(errors)
+                if on_error:
+                    for index, error in errors:
+                        on_error(index, error)
+    seconds = time.perf_counter() - start
+    return {
+        'games': games,
+        'valid': games - invalid,
+        'invalid': invalid,
+        'plies': plies,
+        'seconds': round(seconds, 6),
+        'games_per_second': round(games / seconds) if seconds > 0 else None,
+        'workers': workers,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='PGN/FEN导入导出和批量校验')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    validate_parser = subparsers.add_parser('validate', help='在进程池中回放校验对局')
+    validate_parser.add_argument('paths', nargs='+', help='PGN文件')
+    validate_parser.add_argument('--workers', type=int, help='进程数，默认等于CPU核数')
+    validate_parser.add_argument('--batch', type=int, default=DEFAULT_BATCH, help='每个任务包含的对局数')
+    fen_parser = subparsers.add_parser('fen', help='输出每局最终局面的FEN')
+    fen_parser.add_argument('paths', nargs='+', help='PGN文件')
+    args = parser.parse_args(argv)
+
+    if args.command == 'validate':
+        report = validate(args.paths, args.workers, args.batch,
+                          on_error=lambda index, error: print(f'第{index}局：{error}', file=sys.stderr))
+        print(json.dumps(report, indent=2))
+        return 1 if report['invalid'] else 0
+
+    status = 0
+    for path in args.paths:
+        with open(path, encoding='utf-8', errors='replace') as f:
+            for game in read_games(f):
+                board, count, error = replay_game(game)
+                if error is not None:
+                    status = 1
+                    print(f'{path}: 第{count + 1}步：{error}', file=sys.stderr)
+                    continue
+                print(board.to_fen())
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
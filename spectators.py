@@ -0,0 +1,113 @@
+"""观战：每个对局的观战连接组成一个组，消息只编码一次，由组自己的任务分发
+
+- 广播时只把已经编码好的JSON文本和二进制帧放入组的待发列表，立即返回，
+  观战人数再多也不会拖慢走棋方的接收循环
+- 分发任务依次把同一个帧放入各观战连接的发送队列，每处理一批连接让出一次事件循环
+- 当前局面的完整快照按局面缓存，同一局面下新加入的观战者共用一份
+"""
+import asyncio
+import collections
+import json
+import logging
+
+from metrics import Counter
+
+logger = logging.getLogger(__name__)
+
+SPECTATOR_FRAMES = Counter('chess_spectator_frames_total', '放入观战连接发送队列的消息数')
+
+
+class EncodedMessage:
+    """一条广播消息的JSON文本和二进制帧，都在第一次使用时编码，之后共用"""
+    __slots__ = ('data', '_text', '_frame', '_encode_frame')
+
+    def __init__(self, data, encode_frame, text=None, frame=None):
+        """
+        data: JSON消息字典
+        encode_frame: 把字典编码为二进制帧的函数（见wire_protocol.encode_message）
+        text, frame: 已经编码好的结果（没有时为None）
+        """
+        self.data = data
+        self._text = text
+        self._frame = frame
+        self._encode_frame = encode_frame
+
+    @property
+    def text(self):
+        if self._text is None:
+            self._text = json.dumps(self.data)
+        return self._text
+
+    @property
+    def frame(self):
+        if self._frame is None:
+            self._frame = self._encode_frame(self.data)
+        return self._frame
+
+    def for_connection(self, conn):
+        return self.frame if conn.binary else self.text
+
+
+class SpectatorGroup:
+    """一个对局的所有观战连接"""
+    def __init__(self, batch_size=256):
+        """
+        batch_size: 分发时每处理多少个连接让出一次事件循环
+        """
+        self.batch_size = batch_size
+        self.members = set()
+        self._pending = collections.deque()
+        self._wakeup = asyncio.Event()
+        self._close_reason = None
+        self._task = asyncio.create_task(self._fan_out())
+        # 缓存的快照：(局面标识, EncodedMessage)
+        self._snapshot = None
+
+    def __len__(self):
+        return len(self.members)
+
+    def add(self, conn):
+        self.members.add(conn)
+
+    def discard(self, conn):
+        self.members.discard(conn)
+
+    def publish(self, message):
+        """把一条EncodedMessage交给分发任务，不等待发送"""
+        if not self.members or self._close_reason is not None:
+            return
+        self._pending.append(message)
+        self._wakeup.set()
+
+    def snapshot(self, key, build):
+        """
+        获取当前局面的快照消息，局面不变时使用缓存
+        key: 局面标识，例如 (ply, zobrist_key)
+        build: 无参函数，返回新的EncodedMessage
+        """
+        if self._snapshot is None or self._snapshot[0] != key:
+            self._snapshot = (key, build())
+        return self._snapshot[1]
+
+    async def _fan_out(self):
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            while self._pending:
+                message = self._pending.popleft()
+                # 复制成员列表：分发期间可能有观战者加入或离开
+                for index, conn in enumerate(list(self.members), 1):
+                    conn.send(message.for_connection(conn))
+                    if index % self.batch_size == 0:
+                        await asyncio.sleep(0)
+                SPECTATOR_FRAMES.inc(len(self.members))
+            if self._close_reason is not None:
+                for conn in list(self.members):
+                    conn.disconnect(self._close_reason, drain=True)
+                self.members.clear()
+                return
+
+    def close(self, reason):
+        """分发完已经广播的消息后断开所有观战连接（连接发送完队列中的消息再关闭）"""
+        self._close_reason = reason
+        self._wakeup.set()
@@ -0,0 +1,612 @@
+"""残局库：用逆向分析求解少子残局（例如王后对王、车王对王），保存为紧凑的索引文件
+
+本项目以吃掉对方的王结束对局，王可以走到被攻击的格子，没有兵和升变，所以：
+- 行棋方能吃掉对方的王时，1步（半回合）获胜
+- 没有兵时棋盘上下、左右翻转和沿对角线翻转后局面等价，只保存白王在 a1-d1-d4 三角形内的局面
+
+每个局面用一个字节表示从行棋方角度的结果：
+- 0: 和棋（双方都无法强制吃王）
+- 奇数 n: 行棋方在 n 步（半回合）内吃掉对方的王
+- 偶数 n: 行棋方在 n 步内被吃掉王
+- 255: 不存在的局面（两个棋子在同一格，或不是对称变换下的标准形式）
+
+文件格式（小端序）：文件头 16 字节：魔数 b'CHTB'、版本(uint16)、棋子数(uint16)、子力(8字节，
+例如 b'KQK'，不足补0)，随后每个局面一个字节。局面的索引为
+    ((行棋方 * 10 + 白王在三角形中的编号) * 64 + 第2个棋子的格子) * 64 + ...
+棋子顺序为白王、白方其他棋子、黑王、黑方其他棋子，子力较强的一方总是作为白方保存，
+查询时交换双方颜色。查询通过mmap读取，多个进程共享操作系统的页缓存。
+
+生成过程：先在进程池中逐段扫描所有局面，找出能直接吃王和吃子后进入已生成的子残局的结果，
+然后按步数从小到大逐层逆推：被判负的局面的所有前驱局面获胜；获胜的局面的前驱局面在
+所有后继局面都已判定为对方获胜时判负。每层的前驱局面也在进程池中计算，每个进程分到一段。
+生成中的结果表保存在目录中的临时文件里，主进程和子进程都通过mmap访问，每层不需要把整个表
+发送给子进程。
+
+用法：
+    python tablebase.py generate                     # 生成默认的 KQK、KRK（以及依赖的 KK）
+    python tablebase.py generate KQK KBNK --workers 4
+    python tablebase.py probe Ke1 Qd1 ke8            # 大写为白方，小写为黑方，默认白方行棋
+    python tablebase.py probe Ke1 Qd1 ke8 --black
+"""
+import argparse
+import collections
+import mmap
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from chess_bitboard import COLORS, PIECE_TYPES, iter_squares, piece_attacks, position_of, square_of
+from chess_board import LETTER_PIECES, PIECE_LETTERS
+from opening_book import format_move, parse_square
+
+MAGIC = b'CHTB'
+VERSION = 1
+HEADER_SIZE = 16
+DEFAULT_DIRECTORY = 'tablebases'
+DEFAULT_MATERIAL = ('KQK', 'KRK')
+# 局面数随棋子数按64倍增长，4个棋子的残局需要较长的生成时间
+MAX_PIECES = 4
+DRAW = 0
+INVALID = 255
+# 初始扫描时每个进程池任务处理的局面数
+CHUNK_SIZE = 4096
+
+# 8种对称变换下每个格子的去向：变换编号的第0位左右翻转，第1位上下翻转，第2位沿对角线翻转
+TRANSFORMS = []
+for _t in range(8):
+    _table = []
+    for _square in range(64):
+        _row, _col = position_of(_square)
+        if _t & 4:
+            _row, _col = _col, _row
+        if _t & 1:
+            _col = 7 - _col
+        if _t & 2:
+            _row = 7 - _row
+        _table.append(square_of(_row, _col))
+    TRANSFORMS.append(_table)
+
+# 白王的标准位置：a1-d1-d4 三角形（行 <= 列 <= 3）中的10个格子
+TRIANGLE = [square for square in range(64)
+            if position_of(square)[0] <= position_of(square)[1] <= 3]
+TRIANGLE_INDEX = {square: index for index, square in enumerate(TRIANGLE)}
+# 每个格子可以把白王移入三角形的变换（在对角线上时有两个）
+KING_TRANSFORMS = [[t for t in range(8) if TRANSFORMS[t][square] in TRIANGLE_INDEX]
+                   for square in range(64)]
+
+
+def parse_material(name):
+    """
+    解析子力名称，例如 'KQK'、'KRKN'
+    返回: (白方棋子类型元组, 黑方棋子类型元组)，都以王开头，其余按PIECE_TYPES顺序
+    """
+    name = name.upper()
+    split = name.find('K', 1)
+    if not name.startswith('K') or split < 0:
+        raise ValueError(f'Invalid material: {name}')
+    sides = []
+    for letters in (name[:split], name[split:]):
+        if 'K' in letters[1:]:
+            raise ValueError(f'Invalid material: {name}')
+        try:
+            types = [LETTER_PIECES[letter.lower()] for letter in letters[1:]]
+        except KeyError:
+            raise ValueError(f'Invalid material: {name}') from None
+        if 'pawn' in types:
+            raise ValueError(f'Pawns are not supported: {name}')
+        sides.append(('king',) + tuple(sorted(types, key=PIECE_TYPES.index)))
+    if len(sides[0]) + len(sides[1]) > MAX_PIECES:
+        raise ValueError(f'At most {MAX_PIECES} pieces are supported: {name}')
+    return tuple(sides)
+
+
+def material_name(material):
+    return ''.join(PIECE_LETTERS[piece_type].upper() for side in material for piece_type in side)
+
+
+def _strength(side):
+    return len(side), tuple(-PIECE_TYPES.index(piece_type) for piece_type in side)
+
+
+def is_normalized(material):
+    """子力较强的一方是否为白方（保存的残局库都是这种形式）"""
+    return _strength(material[0]) >= _strength(material[1])
+
+
+def dependencies(material):
+    """
+    吃掉一个棋子（王以外）后可能进入的子残局，包括间接依赖，按生成顺序排列
+    返回: [子力, ...]，都已转为白方较强的形式，最后一个是material本身
+    """
+    order = []
+
+    def visit(current):
+        if not is_normalized(current):
+            current = (current[1], current[0])
+        if current in order:
+            return
+        for color in range(2):
+            side = current[color]
+            for index in range(1, len(side)):
+                reduced = list(current)
+                reduced[color] = side[:index] + side[index + 1:]
+                visit(tuple(reduced))
+        order.append(current)
+
+    visit(material)
+    return order
+
+
+class _Layout:
+    """一种子力的索引计算"""
+    def __init__(self, material):
+        self.material = material
+        self.types = material[0] + material[1]
+        self.colors = (0,) * len(material[0]) + (1,) * len(material[1])
+        self.pieces = len(self.types)
+        self.base = 64 ** (self.pieces - 1)
+        self.size = 2 * len(TRIANGLE) * self.base
+
+    def index(self, squares, side_to_move):
+        """
+        squares: 按白王、白方其他棋子、黑王、黑方其他棋子顺序的格子编号
+        返回: 对称变换后最小的索引
+        """
+        best = None
+        for t in KING_TRANSFORMS[squares[0]]:
+            table = TRANSFORMS[t]
+            index = side_to_move * len(TRIANGLE) + TRIANGLE_INDEX[table[squares[0]]]
+            for square in squares[1:]:
+                index = index * 64 + table[square]
+            if best is None or index < best:
+                best = index
+        return best
+
+    def decode(self, index):
+        """返回: (格子编号列表, 行棋方)"""
+        squares = []
+        for _ in range(self.pieces - 1):
+            index, square = divmod(index, 64)
+            squares.append(square)
+        side_to_move, king = divmod(index, len(TRIANGLE))
+        squares.append(TRIANGLE[king])
+        squares.reverse()
+        return squares, side_to_move
+
+
+# 进程池子进程中的全局状态：正在生成的子力、已经生成的子残局（子力 -> 字节串）
+# 和主进程正在填写的结果表（只读映射）
+_layout = None
+_subtables = {}
+_table = None
+
+
+def _init_worker(material, subtables, work_path):
+    global _layout, _subtables, _table
+    _layout = _Layout(material)
+    _subtables = {sub: (_Layout(sub), data) for sub, data in subtables.items()}
+    with open(work_path, 'rb') as f:
+        _table = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def _lookup_capture(squares, side_to_move, captured):
+    """吃掉第captured个棋子后的局面在子残局中的结果（从新的行棋方角度）"""
+    types = _layout.types[:captured] + _layout.types[captured + 1:]
+    colors = _layout.colors[:captured] + _layout.colors[captured + 1:]
+    squares = squares[:captured] + squares[captured + 1:]
+    white = tuple(piece_type for piece_type, color in zip(types, colors) if color == 0)
+    black = tuple(piece_type for piece_type, color in zip(types, colors) if color == 1)
+    if is_normalized((white, black)):
+        material = (white, black)
+    else:
+        # 交换双方颜色：原来的黑方棋子排在前面，行棋方也随之交换
+        material = (black, white)
+        squares = ([s for s, color in zip(squares, colors) if color == 1] +
+                   [s for s, color in zip(squares, colors) if color == 0])
+        side_to_move = 1 - side_to_move
+    layout, data = _subtables[material]
+    return data[layout.index(squares, side_to_move)]
+
+
+def _successors(squares, side_to_move, table):
+    """
+    遍历行棋方的所有走法
+    返回: 后继局面的结果列表（从对方角度），能吃掉对方的王时返回None
+    """
+    occupied = 0
+    own = 0
+    for square, color in zip(squares, _layout.colors):
+        occupied |= 1 << square
+        if color == side_to_move:
+            own |= 1 << square
+    results = []
+    for moving, (square, color) in enumerate(zip(squares, _layout.colors)):
+        if color != side_to_move:
+            continue
+        targets = piece_attacks(_layout.types[moving], COLORS[color], square, occupied) & ~own
+        for target in iter_squares(targets):
+            moved = list(squares)
+            moved[moving] = target
+            if occupied >> target & 1:
+                captured = squares.index(target)
+                if _layout.types[captured] == 'king':
+                    return None
+                results.append(_lookup_capture(moved, 1 - side_to_move, captured))
+            else:
+                results.append(table[_layout.index(moved, 1 - side_to_move)])
+    return results
+
+
+def _loss_distance(results):
+    """所有后继局面都是对方获胜时返回判负的步数，否则返回None"""
+    if not results or any(value == DRAW or value % 2 == 0 for value in results):
+        return None
+    return max(results) + 1
+
+
+def _scan_worker(start, end):
+    """
+    初始扫描一段索引
+    返回: (这一段的初始结果字节串, [(索引, 步数), ...] 待定的结果)
+    """
+    values = bytearray(end - start)
+    pending = []
+    for index in range(start, end):
+        squares, side_to_move = _layout.decode(index)
+        if len(set(squares)) < len(squares) or _layout.index(squares, side_to_move) != index:
+            values[index - start] = INVALID
+            continue
+        # 扫描期间结果表全部为0：同一子残局内的后继局面都还未知（按和棋处理），
+        # 只看吃王和吃子进入的子残局
+        results = _successors(squares, side_to_move, _table)
+        if results is None:
+            pending.append((index, 1))
+            continue
+        wins = [value + 1 for value in results if value != DRAW and value % 2 == 0]
+        if wins:
+            pending.append((index, min(wins)))
+        else:
+            # 只有吃子的走法且都进入对方获胜的子残局
+            loss = _loss_distance(results)
+            if loss is not None:
+                pending.append((index, loss))
+    return bytes(values), pending
+
+
+def _predecessors(index):
+    """前驱局面：对方的一个棋子从空格走到现在的位置（不包括吃子，吃子的前驱在更大的残局中）"""
+    squares, side_to_move = _layout.decode(index)
+    mover = 1 - side_to_move
+    occupied = 0
+    for square in squares:
+        occupied |= 1 << square
+    for moving, (square, color) in enumerate(zip(squares, _layout.colors)):
+        if color != mover:
+            continue
+        # 棋子的走法是对称的，从现在的位置反向走到的空格就是可能的起点
+        sources = piece_attacks(_layout.types[moving], COLORS[color], square, occupied) & ~occupied
+        for source in iter_squares(sources):
+            moved = list(squares)
+            moved[moving] = source
+            yield _layout.index(moved, mover)
+
+
+def _retro_worker(frontier, distance):
+    """
+    计算一层新判定局面的前驱局面（主进程在这一层计算完成前不修改结果表）
+    frontier: 在distance步判定的局面索引
+    返回: [(前驱局面索引, 步数), ...]
+    """
+    table = _table
+    pending = []
+    seen = set()
+    for index in frontier:
+        for previous in _predecessors(index):
+            if table[previous] != DRAW or previous in seen:
+                continue
+            seen.add(previous)
+            if distance % 2 == 0:
+                # 走到对方判负的局面即获胜
+                pending.append((previous, distance + 1))
+            else:
+                squares, side_to_move = _layout.decode(previous)
+                loss = _loss_distance(_successors(squares, side_to_move, table) or [])
+                if loss is not None:
+                    pending.append((previous, loss))
+    return pending
+
+
+def _chunks(start, end, size):
+    return [(position, min(position + size, end)) for position in range(start, end, size)]
+
+
+def solve(material, executor, table, workers):
+    """
+    逆向分析一种子力
+    executor: 进程池，子进程已经用_init_worker映射了table对应的文件
+    table: 可写的结果表（全部为0），长度为局面数
+    workers: 进程池的进程数，每层的前驱局面平均分给各进程
+    """
+    layout = _Layout(material)
+    buckets = collections.defaultdict(set)
+
+    # 子进程扫描时读取结果表，全部扫描完成后才写入
+    chunks = _chunks(0, layout.size, CHUNK_SIZE)
+    scanned = list(executor.map(_scan_worker, *zip(*chunks)))
+    for (start, end), (values, pending) in zip(chunks, scanned):
+        table[start:end] = values
+        for index, distance in pending:
+            buckets[distance].add(index)
+    del scanned
+
+    distance = 1
+    while buckets:
+        frontier = [index for index in buckets.pop(distance, ()) if table[index] == DRAW]
+        for index in frontier:
+            table[index] = distance
+        if frontier:
+            size = -(-len(frontier) // workers)
+            parts = [frontier[position:position + size] for position in range(0, len(frontier), size)]
+            for pending in executor.map(_retro_worker, parts, [distance] * len(parts)):
+                for index, found in pending:
+                    buckets[found].add(index)
+        distance += 1
+        if distance >= INVALID:
+            raise ValueError(f'{material_name(material)}: distance exceeds {INVALID - 1} plies')
+    return bytes(table)
+
+
+def table_path(directory, material):
+    return os.path.join(directory, f'{material_name(material)}.tb')
+
+
+def write_table(path, material, data):
+    """写入残局库文件（先写临时文件再替换）"""
+    name = material_name(material).encode()
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(MAGIC + VERSION.to_bytes(2, 'little') + len(name).to_bytes(2, 'little') + name.ljust(8, b'\0'))
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def generate(names, directory=DEFAULT_DIRECTORY, workers=None, log=print):
+    """
+    生成残局库文件，依赖的子残局已经存在时直接读取，否则一并生成
+    names: 子力名称列表，例如 ['KQK', 'KRK']
+    workers: 进程数，默认等于CPU核数
+    """
+    workers = workers or os.cpu_count() or 1
+    os.makedirs(directory, exist_ok=True)
+    order = []
+    for name in names:
+        for material in dependencies(parse_material(name)):
+            if material not in order:
+                order.append(material)
+
+    tables = {}
+    for material in order:
+        path = table_path(directory, material)
+        if os.path.exists(path):
+            tables[material] = _read_table(path, material)
+            continue
+        subtables = {sub: tables[sub] for sub in dependencies(material)[:-1]}
+        start = time.perf_counter()
+        work_path = path + '.work'
+        with open(work_path, 'w+b') as f:
+            f.truncate(_Layout(material).size)
+            table = mmap.mmap(f.fileno(), 0)
+        try:
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                     initargs=(material, subtables, work_path)) as executor:
+                solve(material, executor, table, workers)
+            tables[material] = bytes(table)
+        finally:
+            table.close()
+            os.remove(work_path)
+        write_table(path, material, tables[material])
+        log(f'{path}: {_summary(tables[material])}，用时 {time.perf_counter() - start:.1f} 秒')
+    return [table_path(directory, material) for material in order]
+
+
+def _summary(data):
+    counts = collections.Counter(data)
+    wins = sum(count for value, count in counts.items() if value != INVALID and value % 2 == 1)
+    losses = sum(count for value, count in counts.items() if value != DRAW and value % 2 == 0)
+    longest = max((value for value in counts if value != INVALID), default=0)
+    return f'{wins} 个胜局，{losses} 个负局，{counts[DRAW]} 个和局，最长 {longest} 步'
+
+
+def _read_table(path, material):
+    with open(path, 'rb') as f:
+        header = f.read(HEADER_SIZE)
+        data = f.read()
+    if header[:4] != MAGIC or int.from_bytes(header[4:6], 'little') != VERSION:
+        raise ValueError(f'{path} is not a version {VERSION} tablebase')
+    if len(data) != _Layout(material).size:
+        raise ValueError(f'{path} has the wrong size')
+    return data
+
+
+class Tablebase:
+    """只读的残局库，载入目录中的所有 .tb 文件"""
+    def __init__(self, directory=DEFAULT_DIRECTORY):
+        self.directory = directory
+        self._tables = {}
+        self.max_pieces = 0
+        for filename in sorted(os.listdir(directory)):
+            if not filename.endswith('.tb'):
+                continue
+            path = os.path.join(directory, filename)
+            with open(path, 'rb') as f:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            if mm[:4] != MAGIC or int.from_bytes(mm[4:6], 'little') != VERSION:
+                mm.close()
+                raise ValueError(f'{path} is not a version {VERSION} tablebase')
+            material = parse_material(mm[8:8 + int.from_bytes(mm[6:8], 'little')].decode())
+            layout = _Layout(material)
+            if len(mm) != HEADER_SIZE + layout.size:
+                mm.close()
+                raise ValueError(f'{path} has the wrong size')
+            self._tables[material] = (layout, mm)
+            self.max_pieces = max(self.max_pieces, layout.pieces)
+
+    def close(self):
+        for _, mm in self._tables.values():
+            mm.close()
+        self._tables = {}
+
+    def __contains__(self, material):
+        return material in self._tables
+
+    def _value(self, pieces, side_to_move):
+        """
+        pieces: [(颜色编号, 棋子类型, 格子编号), ...]
+        返回: 局面的结果字节，子力不在残局库中时返回None
+        """
+        sides = ([], [])
+        for color, piece_type, square in pieces:
+            sides[color].append((PIECE_TYPES.index(piece_type), square))
+        if not (sides[0] and sides[1] and sides[0][0][0] == 0 and sides[1][0][0] == 0):
+            return None
+        for side in sides:
+            side.sort()
+        material = tuple(tuple(PIECE_TYPES[kind] for kind, _ in side) for side in sides)
+        if not is_normalized(material):
+            material = (material[1], material[0])
+            sides = (sides[1], sides[0])
+            side_to_move = 1 - side_to_move
+        entry = self._tables.get(material)
+        if entry is None:
+            return None
+        layout, mm = entry
+        squares = [square for side in sides for _, square in side]
+        return mm[HEADER_SIZE + layout.index(squares, side_to_move)]
+
+    def _pieces(self, board):
+        if board.bitboards.all_occupied.bit_count() > self.max_pieces:
+            return None
+        pieces = []
+        for color_index, color in enumerate(COLORS):
+            for piece_type, bitboard in board.bitboards.pieces[color].items():
+                for square in iter_squares(bitboard):
+                    pieces.append((color_index, piece_type, square))
+        return pieces
+
+    def probe(self, board):
+        """
+        查询ChessBoard的当前局面
+        返回: ('win' | 'loss' | 'draw', 步数)，从行棋方角度，和棋的步数为0；
+              棋子数超过残局库或子力不在残局库中时返回None
+        """
+        pieces = self._pieces(board)
+        if pieces is None:
+            return None
+        value = self._value(pieces, COLORS.index(board.current_player))
+        return _outcome(value)
+
+    def best_move(self, board):
+        """
+        按残局库选择最佳走法：获胜时走最快获胜的棋，判负时走拖得最久的棋，和棋时保持和棋
+        返回: (起始位置, 目标位置)，局面不在残局库中时返回None
+        """
+        pieces = self._pieces(board)
+        if pieces is None:
+            return None
+        side_to_move = COLORS.index(board.current_player)
+        value = self._value(pieces, side_to_move)
+        if value is None or value == INVALID:
+            return None
+        best = None
+        best_key = None
+        for from_square, targets in board.legal_move_map().items():
+            for to_square in iter_squares(targets):
+                result = self._after_move(pieces, side_to_move, from_square, to_square)
+                if result is None:
+                    continue
+                # 排序键越小越好：先走能让对方判负（偶数，越小越快），再走和棋，最后是对方获胜（越大越慢）
+                if result == -1:
+                    key = (0, 0)
+                elif result != DRAW and result % 2 == 0:
+                    key = (0, result)
+                elif result == DRAW:
+                    key = (1, 0)
+                else:
+                    key = (2, -result)
+                if best_key is None or key < best_key:
+                    best, best_key = (position_of(from_square), position_of(to_square)), key
+        return best
+
+    def _after_move(self, pieces, side_to_move, from_square, to_square):
+        """走一步之后的结果（从对方角度），吃掉对方的王时返回-1"""
+        moved = []
+        for color, piece_type, square in pieces:
+            if square == to_square:
+                if piece_type == 'king':
+                    return -1
+                continue
+            moved.append((color, piece_type, to_square if square == from_square else square))
+        return self._value(moved, 1 - side_to_move)
+
+
+def _outcome(value):
+    if value is None or value == INVALID:
+        return None
+    if value == DRAW:
+        return 'draw', 0
+    return ('win' if value % 2 == 1 else 'loss'), value
+
+
+def open_tablebase(directory):
+    """打开残局库目录，目录不存在或没有残局库文件时返回None"""
+    if not directory or not os.path.isdir(directory):
+        return None
+    tablebase = Tablebase(directory)
+    if not tablebase.max_pieces:
+        return None
+    return tablebase
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='残局库的生成和查询')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    generate_parser = subparsers.add_parser('generate', help='生成残局库')
+    generate_parser.add_argument('material', nargs='*', default=list(DEFAULT_MATERIAL),
+                                 help='子力，例如 KQK KRK KBNK')
+    generate_parser.add_argument('--directory', default=DEFAULT_DIRECTORY, help='残局库目录')
+    generate_parser.add_argument('--workers', type=int, help='进程数，默认等于CPU核数')
+    probe_parser = subparsers.add_parser('probe', help='查询局面')
+    probe_parser.add_argument('pieces', nargs='+', help='棋子和格子，大写为白方，例如 Ke1 Qd1 ke8')
+    probe_parser.add_argument('--black', action='store_true', help='黑方行棋')
+    probe_parser.add_argument('--directory', default=DEFAULT_DIRECTORY, help='残局库目录')
+    args = parser.parse_args(argv)
+
+    if args.command == 'generate':
+        generate(args.material, args.directory, args.workers)
+        return 0
+
+    from chess_board import ChessBoard
+    placement = ['.'] * 64
+    for text in args.pieces:
+        if len(text) != 3 or text[0].lower() not in LETTER_PIECES:
+            print(f'无法识别: {text}', file=sys.stderr)
+            return 1
+        placement[square_of(*parse_square(text[1:]))] = text[0]
+    board = ChessBoard.from_state((''.join(placement), 0, 'black' if args.black else 'white'))
+    tablebase = open_tablebase(args.directory)
+    result = tablebase.probe(board) if tablebase else None
+    if result is None:
+        print('不在残局库中')
+        return 1
+    outcome, distance = result
+    names = {'win': '行棋方获胜', 'loss': '行棋方失败', 'draw': '和棋'}
+    print(f'{names[outcome]}' + (f'，{distance} 步' if distance else ''))
+    move = tablebase.best_move(board)
+    if move:
+        print(f'最佳走法: {format_move(*move)}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,57 @@
+"""分析服务：按对局和用途取消搜索"""
+import asyncio
+
+from analysis_service import AnalysisService
+from chess_board import ChessBoard
+
+
+def _run(coro_factory):
+    async def main():
+        service = AnalysisService(max_workers=2, table_mb=1)
+        service.start()
+        try:
+            return await coro_factory(service)
+        finally:
+            await service.shutdown()
+    return asyncio.run(main())
+
+
+def test_hint_does_not_cancel_engine_search():
+    async def scenario(service):
+        board = ChessBoard()
+        engine = asyncio.create_task(service.search('g', board, 'white', 0.3))
+        await asyncio.sleep(0.05)
+        hint = asyncio.create_task(service.search('g', board, 'white', 0.1, purpose='hint:white'))
+        return await engine, await hint
+
+    engine_move, hint_move = _run(scenario)
+    assert engine_move is not None
+    assert hint_move is not None
+
+
+def test_new_search_with_same_purpose_cancels_previous():
+    async def scenario(service):
+        board = ChessBoard()
+        first = asyncio.create_task(service.search('g', board, 'white', 2.0, purpose='hint:white'))
+        await asyncio.sleep(0.05)
+        second = await service.search('g', board, 'white', 0.1, purpose='hint:white')
+        return await first, second
+
+    first, second = _run(scenario)
+    assert first is None
+    assert second is not None
+
+
+def test_cancel_game_stops_all_searches():
+    async def scenario(service):
+        board = ChessBoard()
+        tasks = [asyncio.create_task(service.search('g', board, 'white', 2.0, purpose=purpose))
+                 for purpose in ('move', 'hint:white', 'hint:black')]
+        other = asyncio.create_task(service.search('other', board, 'white', 0.1))
+        await asyncio.sleep(0.05)
+        service.cancel('g')
+        return [await task for task in tasks], await other
+
+    results, other = _run(scenario)
+    assert results == [None, None, None]
+    assert other is not None
@@ -0,0 +1,72 @@
+"""批量局面评估：与 chess_ai.evaluate 和逐个计算的机动性结果一致"""
+import random
+
+import pytest
+
+from chess_ai import evaluate
+from chess_board import ChessBoard
+from pgn import START_FEN
+
+np = pytest.importorskip('numpy')
+
+import batch_eval  # noqa: E402
+
+
+def _random_boards(seed, count=200, max_moves=80):
+    """随机对局中的局面（包括开局、中局和子力较少的局面）"""
+    rng = random.Random(seed)
+    boards = []
+    board = ChessBoard()
+    while len(boards) < count:
+        if board.is_game_over() or board.ply >= max_moves:
+            board = ChessBoard()
+        board.make_move(*rng.choice(board.get_all_valid_moves()))
+        boards.append(board.copy())
+    return boards
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_material_and_position_match_evaluate(seed):
+    boards = _random_boards(seed)
+    scores = batch_eval.evaluate_planes(*batch_eval.pack_boards(boards), mobility=False)
+    assert scores.tolist() == [evaluate(board) for board in boards]
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_mobility_matches_single_board(seed):
+    boards = _random_boards(seed)
+    scores = batch_eval.evaluate_boards(boards)
+    assert scores.tolist() == [batch_eval.evaluate_board(board) for board in boards]
+
+
+def test_chunks_give_same_scores(monkeypatch):
+    boards = _random_boards(4, count=50)
+    planes, white_to_move = batch_eval.pack_boards(boards)
+    expected = batch_eval.evaluate_planes(planes, white_to_move)
+    # 分成多个不满的块计算，结果不变
+    monkeypatch.setattr(batch_eval, 'CHUNK_SIZE', 7)
+    assert batch_eval.evaluate_planes(planes, white_to_move).tolist() == expected.tolist()
+
+
+def test_pack_fens_and_square_codes():
+    planes, white_to_move = batch_eval.pack_fens([START_FEN, START_FEN.replace(' w ', ' b ')])
+    assert planes.shape == (2, len(batch_eval.PLANES), 64)
+    assert white_to_move.tolist() == [True, False]
+    codes = batch_eval.square_codes(planes)
+    king = batch_eval.PIECE_TYPES.index('king') + 1
+    assert codes[0, 4] == king and codes[0, 60] == -king
+    assert (codes[0, 16:48] == 0).all()
+    assert int(planes.sum()) == 64
+
+
+def test_score_moves_matches_make_and_evaluate():
+    board = _random_boards(5, count=30)[-1]
+    before = board.to_fen()
+    scored = batch_eval.score_moves(board)
+    assert board.to_fen() == before
+    assert len(scored) == len(board.get_all_valid_moves())
+    assert [score for score, _, _ in scored] == sorted((score for score, _, _ in scored), reverse=True)
+    for score, from_pos, to_pos in scored:
+        board.make_move(from_pos, to_pos)
+        assert score == -batch_eval.evaluate_board(board)
+        board.unmake_move()
@@ -0,0 +1,59 @@
+"""电脑玩家：置换表中吃王得分的换算和基本的走法选择"""
+import pytest
+
+from chess_ai import MATE_SCORE, MAX_PLY, ChessAI, _score_from_table, _score_to_table
+from chess_board import ChessBoard, Piece
+from transposition_table import TranspositionTable
+
+
+@pytest.mark.parametrize('score', [0, 150, -3200, MATE_SCORE - MAX_PLY - 1, -MATE_SCORE + MAX_PLY + 1])
+def test_ordinary_scores_are_stored_unchanged(score):
+    for ply in (0, 1, 7, MAX_PLY):
+        assert _score_to_table(score, ply) == score
+        assert _score_from_table(score, ply) == score
+
+
+@pytest.mark.parametrize('ply', [0, 1, 5, 20])
+def test_mate_scores_round_trip(ply):
+    for distance in (1, 2, 9):
+        win = MATE_SCORE - (ply + distance)
+        loss = -MATE_SCORE + ply + distance
+        assert _score_from_table(_score_to_table(win, ply), ply) == win
+        assert _score_from_table(_score_to_table(loss, ply), ply) == loss
+
+
+def test_mate_scores_are_stored_relative_to_the_node():
+    # 在第3层发现2步后吃王，存入表中的是“距该节点2步”
+    assert _score_to_table(MATE_SCORE - 5, 3) == MATE_SCORE - 2
+    assert _score_to_table(-MATE_SCORE + 5, 3) == -MATE_SCORE + 2
+    # 同一个节点在第1层被取出时，距根节点是3步
+    assert _score_from_table(MATE_SCORE - 2, 1) == MATE_SCORE - 3
+    assert _score_from_table(-MATE_SCORE + 2, 1) == -MATE_SCORE + 3
+
+
+def _board(pieces, current_player):
+    """pieces: {(行, 列): (颜色, 类型)}"""
+    board = ChessBoard()
+    grid = [[None for _ in range(8)] for _ in range(8)]
+    for (row, col), (color, piece_type) in pieces.items():
+        grid[row][col] = Piece(color, piece_type)
+    board.load_position(grid, current_player)
+    return board
+
+
+def test_captures_the_king_when_possible():
+    board = _board({(0, 4): ('white', 'king'), (0, 0): ('white', 'rook'),
+                    (7, 0): ('black', 'king'), (7, 7): ('black', 'queen')}, 'white')
+    ai = ChessAI('white', time_limit=1.0, max_depth=3)
+    assert ai.choose_move(board) == ((0, 0), (7, 0))
+
+
+def test_search_leaves_board_unchanged_with_shared_table():
+    table = TranspositionTable(max_mb=1)
+    board = ChessBoard(table)
+    key = board.zobrist_key
+    for _ in range(2):
+        move = ChessAI('white', time_limit=0.2, max_depth=3).choose_move(board)
+        assert move in board.get_all_valid_moves()
+        assert board.zobrist_key == key
+        assert board.undo_stack == []
@@ -0,0 +1,104 @@
+"""位棋盘走法生成与原来逐格扫描的实现对比"""
+import random
+
+import pytest
+
+from chess_bitboard import iter_squares, position_of, square_of
+from chess_board import ChessBoard
+
+
+def _path_clear(board, from_pos, to_pos):
+    """原实现：检查两点之间的路径是否有其他棋子阻挡"""
+    row_dir = (to_pos[0] > from_pos[0]) - (to_pos[0] < from_pos[0])
+    col_dir = (to_pos[1] > from_pos[1]) - (to_pos[1] < from_pos[1])
+    row, col = from_pos[0] + row_dir, from_pos[1] + col_dir
+    while (row, col) != to_pos:
+        if board.board[row][col]:
+            return False
+        row += row_dir
+        col += col_dir
+    return True
+
+
+def _scanner_valid(board, from_pos, to_pos):
+    """原实现：按棋子类型逐条检查移动规则"""
+    piece = board.board[from_pos[0]][from_pos[1]]
+    target = board.board[to_pos[0]][to_pos[1]]
+    if not piece or piece.color != board.current_player:
+        return False
+    if target and target.color == piece.color:
+        return False
+    row_diff = to_pos[0] - from_pos[0]
+    col_diff = to_pos[1] - from_pos[1]
+    if piece.type == 'pawn':
+        direction = 1 if piece.color == 'white' else -1
+        if target:
+            return abs(col_diff) == 1 and row_diff == direction
+        if col_diff != 0:
+            return False
+        return row_diff == direction or (not piece.has_moved and row_diff == 2 * direction)
+    if piece.type == 'rook':
+        return (row_diff == 0 or col_diff == 0) and _path_clear(board, from_pos, to_pos)
+    if piece.type == 'knight':
+        return (abs(row_diff), abs(col_diff)) in ((2, 1), (1, 2))
+    if piece.type == 'bishop':
+        return abs(row_diff) == abs(col_diff) and _path_clear(board, from_pos, to_pos)
+    if piece.type == 'queen':
+        return ((row_diff == 0 or col_diff == 0 or abs(row_diff) == abs(col_diff)) and
+                _path_clear(board, from_pos, to_pos))
+    return abs(row_diff) <= 1 and abs(col_diff) <= 1
+
+
+def _scanner_moves(board, row, col):
+    """原实现：逐格扫描得到一个棋子的全部目标格子"""
+    return [(to_row, to_col) for to_row in range(8) for to_col in range(8)
+            if (to_row, to_col) != (row, col) and _scanner_valid(board, (row, col), (to_row, to_col))]
+
+
+def _random_positions(seed, games=10, max_moves=80):
+    """随机对局中经过的所有局面（王被吃掉后结束）"""
+    rng = random.Random(seed)
+    for _ in range(games):
+        board = ChessBoard()
+        for _ in range(max_moves):
+            yield board
+            moves = [((row, col), to_pos) for row in range(8) for col in range(8)
+                     for to_pos in board.get_valid_moves(row, col)]
+            if not moves or board.is_king_captured('white') or board.is_king_captured('black'):
+                break
+            assert board.move_piece(*rng.choice(moves))
+
+
+def test_square_numbering():
+    assert square_of(0, 0) == 0
+    assert square_of(7, 7) == 63
+    assert position_of(square_of(3, 5)) == (3, 5)
+    assert list(iter_squares(0b1010_0001)) == [0, 5, 7]
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_move_targets_match_scanner(seed):
+    for board in _random_positions(seed):
+        for row in range(8):
+            for col in range(8):
+                assert sorted(board.get_valid_moves(row, col)) == _scanner_moves(board, row, col)
+
+
+def test_is_valid_move_matches_scanner():
+    for board in _random_positions(seed=99, games=2):
+        for from_square in range(64):
+            from_pos = position_of(from_square)
+            for to_square in range(64):
+                to_pos = position_of(to_square)
+                if from_pos == to_pos:
+                    continue
+                assert board.is_valid_move(from_pos, to_pos) == _scanner_valid(board, from_pos, to_pos)
+
+
+def test_pawn_cannot_push_into_occupied_square():
+    board = ChessBoard()
+    assert board.move_piece((1, 4), (3, 4))
+    assert board.move_piece((6, 4), (4, 4))
+    # e4 与 e5 的兵互相挡住，既不能前进也不能吃子
+    assert board.get_valid_moves(3, 4) == []
+    assert not board.is_valid_move((3, 4), (4, 4))
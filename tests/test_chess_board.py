@@ -0,0 +1,151 @@
+"""ChessBoard的make_move/unmake_move与Zobrist哈希"""
+import random
+
+import pytest
+
+from chess_board import ChessBoard
+from chess_zobrist import compute_key
+
+
+def _snapshot(board):
+    """局面的全部可观察状态，用于比较撤销前后是否一致"""
+    grid = tuple((piece.color, piece.type, piece.has_moved) if piece else None
+                 for row in board.board for piece in row)
+    bitboards = {color: dict(pieces) for color, pieces in board.bitboards.pieces.items()}
+    attacked = tuple(board.is_square_attacked((row, col), color)
+                     for color in ('white', 'black') for row in range(8) for col in range(8))
+    return (grid, bitboards, dict(board.king_squares), attacked,
+            board.current_player, board.is_white_turn)
+
+
+def _random_move(board, rng):
+    moves = [((row, col), to_pos) for row in range(8) for col in range(8)
+             for to_pos in board.get_valid_moves(row, col)]
+    return rng.choice(moves) if moves else None
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_unmake_restores_every_position(seed):
+    rng = random.Random(seed)
+    board = ChessBoard()
+    history = []
+    for _ in range(60):
+        move = _random_move(board, rng)
+        if move is None or board.is_king_captured('white') or board.is_king_captured('black'):
+            break
+        history.append((_snapshot(board), move))
+        board.make_move(*move)
+    for snapshot, move in reversed(history):
+        assert board.unmake_move() == move
+        assert _snapshot(board) == snapshot
+    assert board.unmake_move() is None
+
+
+def test_make_move_matches_fresh_board():
+    board = ChessBoard()
+    board.make_move((1, 4), (3, 4))
+    board.make_move((6, 3), (4, 3))
+    board.make_move((3, 4), (4, 3))
+
+    expected = ChessBoard()
+    assert expected.move_piece((1, 4), (3, 4))
+    assert expected.move_piece((6, 3), (4, 3))
+    assert expected.move_piece((3, 4), (4, 3))
+    assert _snapshot(board) == _snapshot(expected)
+
+
+def test_unmake_restores_captured_king():
+    board = ChessBoard()
+    for move in [((1, 4), (3, 4)), ((6, 5), (5, 5)), ((0, 3), (4, 7)), ((6, 6), (4, 6)),
+                 ((4, 7), (7, 4))]:
+        assert board.move_piece(*move)
+    assert board.is_king_captured('black')
+    assert board.is_game_over()
+    board.unmake_move()
+    assert not board.is_king_captured('black')
+    assert not board.is_game_over()
+    assert board.is_king_in_check('black')
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_zobrist_key_is_incremental_and_restored(seed):
+    rng = random.Random(seed)
+    board = ChessBoard()
+    keys = []
+    for _ in range(60):
+        move = _random_move(board, rng)
+        if move is None or board.is_king_captured('white') or board.is_king_captured('black'):
+            break
+        keys.append(board.zobrist_key)
+        board.make_move(*move)
+        assert board.zobrist_key == compute_key(board)
+    for key in reversed(keys):
+        board.unmake_move()
+        assert board.zobrist_key == key
+    assert board.zobrist_key == ChessBoard().zobrist_key
+
+
+def test_zobrist_key_depends_on_side_to_move():
+    board = ChessBoard()
+    start = board.zobrist_key
+    # 马跳出再跳回：棋子位置相同但行棋方不同
+    board.make_move((0, 6), (2, 5))
+    board.make_move((7, 6), (5, 5))
+    board.make_move((2, 5), (0, 6))
+    assert board.zobrist_key != start
+    board.make_move((5, 5), (7, 6))
+    assert board.zobrist_key == start
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_legal_move_map_matches_valid_moves(seed):
+    rng = random.Random(seed)
+    board = ChessBoard()
+    for _ in range(40):
+        if board.is_game_over():
+            break
+        expected = sorted(((row, col), to_pos) for row in range(8) for col in range(8)
+                          for to_pos in board.get_valid_moves(row, col))
+        moves = sorted(((from_square >> 3, from_square & 7), (to_square >> 3, to_square & 7))
+                       for from_square, targets in board.legal_move_map().items()
+                       for to_square in range(64) if targets >> to_square & 1)
+        assert moves == expected
+        for from_pos, to_pos in expected:
+            assert board.is_legal_move(from_pos, to_pos)
+        board.make_move(*rng.choice(expected))
+
+
+def test_no_legal_moves_after_king_capture():
+    board = ChessBoard()
+    for move in [((1, 4), (3, 4)), ((6, 5), (5, 5)), ((0, 3), (4, 7)), ((6, 6), (4, 6)),
+                 ((4, 7), (7, 4))]:
+        assert board.is_legal_move(*move)
+        board.make_move(*move)
+    assert board.legal_move_map() == {}
+    assert not board.is_legal_move((6, 0), (5, 0))
+
+
+def test_pieces_are_shared_and_never_modified():
+    board = ChessBoard()
+    other = ChessBoard()
+    pawn = board.board[1][4]
+    assert other.board[1][4] is pawn
+    board.make_move((1, 4), (3, 4))
+    assert not pawn.has_moved
+    assert board.board[3][4].has_moved
+    assert other.board[1][4] is pawn
+    board.unmake_move()
+    assert board.board[1][4] is pawn
+
+
+def test_trim_history_keeps_recent_moves():
+    rng = random.Random(4)
+    board = ChessBoard()
+    for _ in range(30):
+        board.make_move(*_random_move(board, rng))
+        board.trim_history(10)
+        assert len(board.undo_stack) <= 10
+    for _ in range(10):
+        assert board.unmake_move() is not None
+    assert board.unmake_move() is None
+    assert board.ply == 20
@@ -0,0 +1,73 @@
+"""消息总线代理：慢的工作进程被断开，不会让代理的缓冲区无限增长"""
+import asyncio
+import json
+
+from game_bus import BusBroker
+
+
+def _line(data):
+    return json.dumps(data).encode() + b'\n'
+
+
+async def _connect(path, game_id):
+    reader, writer = await asyncio.open_unix_connection(path)
+    writer.write(_line({'op': 'sub', 'game': game_id}))
+    await writer.drain()
+    return reader, writer
+
+
+def test_slow_subscriber_is_disconnected(tmp_path):
+    path = str(tmp_path / 'bus.sock')
+
+    async def scenario():
+        broker = BusBroker(max_queue=8, send_timeout=0.5)
+        server = await asyncio.start_unix_server(broker.handle_client, path)
+        async with server:
+            # 订阅后从不读取的工作进程
+            slow_reader, slow_writer = await _connect(path, 'g')
+            fast_reader, fast_writer = await _connect(path, 'g')
+            publisher_reader, publisher = await _connect(path, 'g')
+            await asyncio.sleep(0.05)
+
+            payload = 'x' * 16384
+            for seq in range(400):
+                publisher.write(_line({'op': 'pub', 'game': 'g', 'seq': seq, 'data': payload}))
+                await publisher.drain()
+                # 正常的订阅者持续读取
+                line = await asyncio.wait_for(fast_reader.readline(), 5)
+                assert json.loads(line)['seq'] == seq
+
+            await asyncio.sleep(0.1)
+            subscribers = broker.subscribers['g']
+            # 慢的订阅者被移除，代理不再为它缓存消息
+            assert len(subscribers) == 2
+            for client in subscribers:
+                assert client.queue.qsize() <= 8
+            # 慢的订阅者读完已经发出的数据后收到EOF
+            while await asyncio.wait_for(slow_reader.read(1 << 20), 5):
+                pass
+            for writer in (slow_writer, fast_writer, publisher):
+                writer.close()
+
+    asyncio.run(scenario())
+
+
+def test_claim_and_orphan(tmp_path):
+    path = str(tmp_path / 'bus.sock')
+
+    async def scenario():
+        broker = BusBroker()
+        server = await asyncio.start_unix_server(broker.handle_client, path)
+        async with server:
+            owner_reader, owner = await _connect(path, 'g')
+            other_reader, other = await _connect(path, 'g')
+            owner.write(_line({'op': 'claim', 'game': 'g'}))
+            assert json.loads(await owner_reader.readline()) == {'op': 'claim', 'game': 'g', 'ok': True}
+            other.write(_line({'op': 'claim', 'game': 'g'}))
+            assert json.loads(await other_reader.readline()) == {'op': 'claim', 'game': 'g', 'ok': False}
+            # 主进程断开后，其他订阅者收到orphan通知
+            owner.close()
+            assert json.loads(await asyncio.wait_for(other_reader.readline(), 5)) == {'op': 'orphan', 'game': 'g'}
+            other.close()
+
+    asyncio.run(scenario())
@@ -0,0 +1,127 @@
+"""对局计时：棋钟的扣时、加秒、超时，以及定时调度器"""
+import asyncio
+import time
+
+import pytest
+
+from game_clock import GameClock, TimerScheduler, parse_time_control
+
+
+def test_parse_time_control():
+    assert parse_time_control('300+2') == (300.0, 2.0)
+    assert parse_time_control('600') == (600.0, 0.0)
+    assert parse_time_control('') is None
+    for text in ('abc', '0', '-5', '300+-1', '300+x'):
+        with pytest.raises(ValueError):
+            parse_time_control(text)
+
+
+def test_first_moves_are_untimed():
+    clock = GameClock(60, increment=2)
+    assert clock.press('white', now=100.0)
+    assert clock.running is None
+    assert clock.press('black', now=130.0)
+    # 双方的第一步不扣时也不加秒
+    assert clock.remaining == {'white': 60.0, 'black': 60.0}
+    assert clock.running == 'white'
+    assert clock.deadline() == 190.0
+
+
+def test_press_deducts_time_and_adds_increment():
+    clock = GameClock(60, increment=2)
+    clock.press('white', now=0.0)
+    clock.press('black', now=0.0)
+    assert clock.time_left('white', now=10.0) == 50.0
+    assert clock.press('white', now=10.0)
+    assert clock.remaining['white'] == 52.0
+    assert clock.running == 'black'
+    assert clock.time_left('black', now=15.0) == 55.0
+    assert clock.to_message(now=15.0) == {"type": "clock", "white": 52000, "black": 55000,
+                                          "running": 'black'}
+
+
+def test_flag_after_time_runs_out():
+    clock = GameClock(10)
+    clock.press('white', now=0.0)
+    clock.press('black', now=0.0)
+    assert clock.flag(now=9.0) is None
+    # 超时后走棋被拒绝，时间不变
+    assert not clock.press('white', now=10.5)
+    assert clock.flag(now=10.5) == 'white'
+    assert clock.flagged == 'white'
+    assert clock.running is None
+    assert clock.time_left('white') == 0.0
+
+
+def test_stop_keeps_remaining_time():
+    clock = GameClock(30)
+    clock.press('white', now=0.0)
+    clock.press('black', now=0.0)
+    clock.stop(now=12.0)
+    assert clock.running is None
+    assert clock.remaining['white'] == 18.0
+    assert clock.deadline() is None
+
+
+def test_state_round_trip():
+    clock = GameClock(30, increment=1)
+    clock.press('white', now=0.0)
+    state = clock.to_state(now=0.0)
+    restored = GameClock.from_state(state)
+    assert restored.moves == 1
+    assert restored.running is None
+    # 对方的第一步仍然不计时
+    restored.press('black')
+    assert restored.running == 'white'
+
+    clock.press('black', now=0.0)
+    state = clock.to_state(now=5.0)
+    assert state == [25.0, 30.0, 1, 'white', None, 2]
+    restored = GameClock.from_state(state, running=False)
+    assert restored.running is None
+    assert restored.remaining == {'white': 25.0, 'black': 30.0}
+    restored = GameClock.from_state(state)
+    assert restored.running == 'white'
+    assert 24.0 < restored.time_left('white') <= 25.0
+
+
+def test_scheduler_fires_in_deadline_order():
+    async def scenario():
+        scheduler = TimerScheduler()
+        scheduler.start()
+        fired = []
+        now = time.monotonic()
+        scheduler.schedule('late', now + 0.15, fired.append)
+        scheduler.schedule('early', now + 0.05, fired.append)
+        scheduler.schedule('cancelled', now + 0.02, fired.append)
+        scheduler.cancel('cancelled')
+        # 重新安排后只在新的时刻触发一次
+        scheduler.schedule('moved', now + 0.01, fired.append)
+        scheduler.schedule('moved', now + 0.1, fired.append)
+        assert len(scheduler) == 3
+        await asyncio.sleep(0.3)
+        await scheduler.close()
+        return fired, len(scheduler)
+
+    fired, remaining = asyncio.run(scenario())
+    assert fired == ['early', 'moved', 'late']
+    assert remaining == 0
+
+
+def test_scheduler_compacts_stale_entries():
+    async def scenario():
+        scheduler = TimerScheduler()
+        scheduler.start()
+        fired = []
+        deadline = time.monotonic() + 60
+        for _ in range(1000):
+            scheduler.schedule('game', deadline, fired.append)
+        heap_size = len(scheduler._heap)
+        scheduler.schedule('soon', time.monotonic(), fired.append)
+        await asyncio.sleep(0.05)
+        await scheduler.close()
+        return fired, heap_size
+
+    fired, heap_size = asyncio.run(scenario())
+    assert fired == ['soon']
+    assert heap_size < 100
@@ -0,0 +1,117 @@
+"""对局日志分析：重复记录去重、对局统计和列式文件的读写"""
+import collections
+import json
+
+import pytest
+
+from log_analysis import COLUMNS, ColumnWriter, analyze, iter_records, read_columns, rotated_paths
+
+
+def _both_formats(message, second='2025-03-13 15:25:58', millis='714'):
+    """旧版本日志处理器写出的两行：无毫秒和有毫秒格式"""
+    return [f'{second} - INFO - {message}\n', f'{second},{millis} - INFO - {message}\n']
+
+
+def test_duplicate_lines_are_removed():
+    lines = (_both_formats('Game g - Player a disconnected')
+             + _both_formats('Game g - No players left, removing game'))
+    stats = collections.Counter()
+    records = list(iter_records(lines, stats))
+    assert [message for _, message in records] == [
+        'Game g - Player a disconnected', 'Game g - No players left, removing game']
+    assert stats['lines'] == 4
+    assert stats['duplicates'] == 2
+
+
+def test_repeated_records_in_one_format_are_kept():
+    # 同一条记录真的写了两次（有毫秒格式），只有一行无毫秒格式的与其中一次配对
+    line = '2025-03-13 15:25:58,100 - WARNING - Game g - Player a - Invalid move: (1, 4) -> (5, 4)\n'
+    other = '2025-03-13 15:25:58 - WARNING - Game g - Player a - Invalid move: (1, 4) -> (5, 4)\n'
+    records = list(iter_records([line, line, other]))
+    assert len(records) == 2
+    assert records[0] == records[1]
+
+
+def test_json_and_unparsed_lines():
+    stats = collections.Counter()
+    lines = [json.dumps({'time': '2025-03-13 15:25:58,500', 'level': 'INFO',
+                         'message': 'New game created: g'}) + '\n',
+             'Traceback (most recent call last):\n',
+             '{not json\n']
+    records = list(iter_records(lines, stats))
+    assert [message for _, message in records] == ['New game created: g']
+    assert stats['unparsed'] == 2
+
+
+def test_analyze_replays_games():
+    messages = [
+        'New game created: g',
+        'Game g - Player w - Move attempt: from (1, 4) to (3, 4)',
+        'Game g - Player w - Move successful: (1, 4) -> (3, 4)',
+        'Game g - Player b - Move attempt: from (6, 4) to (2, 4)',
+        'Game g - Player b - Invalid move: (6, 4) -> (2, 4)',
+        'Game g - Player b - Move successful: [6, 4] -> [4, 4]',
+        'Game g - Game over, winner: white',
+        'Game other - Player w - Move successful: (1, 0) -> (2, 0)',
+    ]
+    records = [(1000.0 + 2 * index, message) for index, message in enumerate(messages)]
+    stats = collections.Counter()
+    rows = [dict(zip((name for name, _ in COLUMNS), row)) for row in analyze(records, stats)]
+    assert len(rows) == 2
+    game, other = rows
+    assert game['game_id'] == 'g'
+    assert (game['moves'], game['attempts'], game['invalid']) == (2, 2, 1)
+    assert game['invalid_rate'] == pytest.approx(1 / 3)
+    assert game['replayed'] == 1 and game['replay_error_ply'] == -1
+    assert game['white_think'] == 4.0 and game['black_think'] == 6.0
+    assert (game['winner'], game['end']) == ('white', 'game_over')
+    # 没有看到创建记录的对局不重放
+    assert other['replayed'] == 0 and other['end'] == 'eof'
+    assert stats['games'] == 2
+
+
+def test_analyze_reports_replay_errors():
+    records = [(0.0, 'New game created: g'),
+               (1.0, 'Game g - Player w - Move successful: (1, 4) -> (3, 4)'),
+               (2.0, 'Game g - Player w - Move successful: (3, 4) -> (4, 4)'),
+               (3.0, 'Game g - No players left, removing game')]
+    stats = collections.Counter()
+    (row,) = analyze(records, stats)
+    row = dict(zip((name for name, _ in COLUMNS), row))
+    assert row['replayed'] == 0
+    assert row['replay_error_ply'] == 2
+    assert row['end'] == 'removed'
+    assert stats['replay_failures'] == 1
+
+
+def test_column_file_round_trip(tmp_path):
+    path = str(tmp_path / 'games.chcol')
+    rows = [(f'game-{index}', 1.5 * index, 2.5 * index, index, index + 1, index % 3, 0.25, 1, -1,
+             0.5, 0.75, 0.1, 1e-3, '白方' if index % 2 else '', 'eof')
+            for index in range(11)]
+    # 小的行组，覆盖多个行组和最后一个不满的行组
+    with ColumnWriter(path, row_group_size=4) as writer:
+        for row in rows:
+            writer.write(row)
+    assert writer.rows == len(rows)
+    columns = read_columns(path)
+    assert list(columns) == [name for name, _ in COLUMNS]
+    assert list(zip(*columns.values())) == rows
+
+
+def test_empty_and_invalid_column_files(tmp_path):
+    path = str(tmp_path / 'empty.chcol')
+    ColumnWriter(path).close()
+    assert read_columns(path) == {}
+    bad = tmp_path / 'bad.chcol'
+    bad.write_bytes(b'nope')
+    with pytest.raises(ValueError):
+        read_columns(str(bad))
+
+
+def test_rotated_paths(tmp_path):
+    base = tmp_path / 'chess_game.log'
+    for name in ('chess_game.log', 'chess_game.log.1', 'chess_game.log.2.gz', 'chess_game.log.bak'):
+        (tmp_path / name).write_text('')
+    assert rotated_paths(str(base)) == [str(tmp_path / 'chess_game.log.2.gz'),
+                                        str(tmp_path / 'chess_game.log.1'), str(base)]
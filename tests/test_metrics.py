@@ -0,0 +1,34 @@
+"""运行指标：Prometheus文本格式输出"""
+from metrics import Counter, Gauge, Histogram, Registry
+
+
+def test_render_labelled_and_plain_metrics():
+    registry = Registry()
+    moves = Counter('moves_total', 'moves', ['result'], registry=registry)
+    moves.labels('ok').inc()
+    moves.labels('ok').inc(2)
+    Gauge('games', 'games', func=lambda: 4, registry=registry)
+    histogram = Histogram('apply_seconds', 'apply', buckets=(0.1, 1.0), registry=registry)
+    histogram.observe(0.05)
+    histogram.observe(0.5)
+    histogram.observe(0.5)
+
+    lines = registry.render().splitlines()
+    assert 'moves_total{result="ok"} 3' in lines
+    assert 'games 4' in lines
+    assert 'apply_seconds_bucket{le="0.1"} 1' in lines
+    assert 'apply_seconds_bucket{le="1.0"} 3' in lines
+    assert 'apply_seconds_bucket{le="+Inf"} 3' in lines
+    assert 'apply_seconds_count 3' in lines
+
+
+def test_gauge_has_no_labels():
+    gauge = Gauge('games', 'games', registry=None)
+    assert not hasattr(gauge, 'labels')
+
+
+def test_histogram_timer_observes_once():
+    histogram = Histogram('seconds', 'seconds', registry=None)
+    with histogram.time():
+        pass
+    assert histogram.count == 1
@@ -0,0 +1,82 @@
+"""开局库：二分查找的结果与直接扫描所有记录相同"""
+import collections
+import random
+
+import pytest
+
+from chess_board import ChessBoard
+from opening_book import (DEFAULT_LINES, OpeningBook, collect_moves, decode_move, encode_move,
+                          parse_move, write_book)
+
+
+def _expected(counts, key):
+    return sorted((*decode_move(move), weight) for (record_key, move), weight in counts.items()
+                  if record_key == key)
+
+
+@pytest.fixture
+def book_path(tmp_path):
+    return str(tmp_path / 'book.bin')
+
+
+def test_move_encoding_round_trip():
+    for from_square in range(64):
+        for to_square in (0, 27, 63):
+            from_pos, to_pos = divmod(from_square, 8), divmod(to_square, 8)
+            assert decode_move(encode_move(from_pos, to_pos)) == (from_pos, to_pos)
+
+
+def test_probe_matches_linear_scan(book_path):
+    # 随机的哈希值，包括同一局面有多个走法、最小和最大的哈希值
+    rng = random.Random(1)
+    keys = [0, 2 ** 64 - 1] + [rng.getrandbits(64) for _ in range(300)]
+    counts = collections.Counter()
+    for key in keys:
+        for _ in range(rng.randint(1, 4)):
+            counts[(key, rng.getrandbits(12))] += rng.randint(1, 50)
+    assert write_book(book_path, counts) == len(counts)
+
+    book = OpeningBook(book_path)
+    try:
+        assert len(book) == len(counts)
+        for key in keys:
+            assert sorted(book.probe(key)) == _expected(counts, key)
+        # 不在开局库中的哈希值，包括比所有记录都小或都大的
+        for key in [1, 2 ** 64 - 2] + [rng.getrandbits(64) for _ in range(100)]:
+            if key not in keys:
+                assert book.probe(key) == []
+    finally:
+        book.close()
+
+
+def test_empty_book(book_path):
+    write_book(book_path, collections.Counter())
+    book = OpeningBook(book_path)
+    try:
+        assert book.probe(ChessBoard().zobrist_key) == []
+        assert book.choose(ChessBoard()) is None
+    finally:
+        book.close()
+
+
+def test_choose_follows_the_built_lines(book_path):
+    counts = collect_moves(DEFAULT_LINES)
+    write_book(book_path, counts)
+    book = OpeningBook(book_path, rng=random.Random(0))
+    try:
+        first_moves = {parse_move(line.split()[0]) for line in DEFAULT_LINES}
+        board = ChessBoard()
+        assert sorted(book.probe(board.zobrist_key)) == _expected(counts, board.zobrist_key)
+        for _ in range(20):
+            assert book.choose(board) in first_moves
+        board.make_move(*parse_move('e2e4'))
+        assert book.choose(board) in {parse_move(text) for text in ('e7e5', 'c7c5', 'e7e6', 'c7c6', 'd7d5')}
+    finally:
+        book.close()
+
+
+def test_rejects_other_files(book_path):
+    with open(book_path, 'wb') as f:
+        f.write(b'not a book at all')
+    with pytest.raises(ValueError):
+        OpeningBook(book_path)
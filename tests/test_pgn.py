@@ -0,0 +1,134 @@
+"""PGN/FEN：SAN和FEN的往返转换，写出的PGN可以读回并回放"""
+import io
+import random
+
+import pytest
+
+from chess_board import ChessBoard
+from pgn import START_FEN, board_history, format_san, parse_san, read_games, replay_game, write_game
+
+
+def _random_game(seed, max_moves=60):
+    """随机走棋，返回最后的棋盘和走法列表"""
+    rng = random.Random(seed)
+    board = ChessBoard()
+    moves = []
+    while len(moves) < max_moves and not board.is_game_over():
+        move = rng.choice(board.get_all_valid_moves())
+        moves.append(move)
+        board.make_move(*move)
+    return board, moves
+
+
+def _all_moves(board):
+    return [(divmod(from_square, 8), divmod(to_square, 8))
+            for from_square, targets in board.legal_move_map().items()
+            for to_square in range(64) if targets >> to_square & 1]
+
+
+def test_start_fen_round_trip():
+    assert ChessBoard().to_fen() == START_FEN
+    assert ChessBoard.from_fen(START_FEN).to_state() == ChessBoard().to_state()
+
+
+@pytest.mark.parametrize('seed', range(4))
+def test_fen_round_trip(seed):
+    board = ChessBoard()
+    for move in _random_game(seed)[1]:
+        board.make_move(*move)
+        fen = board.to_fen()
+        loaded = ChessBoard.from_fen(fen)
+        assert loaded.to_fen() == fen
+        assert loaded.to_state()[0] == board.to_state()[0]
+        assert loaded.current_player == board.current_player
+        assert loaded.ply == board.ply
+        # 不在初始行的兵视为已经移动过，走法与原局面相同
+        assert loaded.legal_move_map() == board.legal_move_map()
+
+
+@pytest.mark.parametrize('fen', [
+    '',
+    'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP w',
+    'rnbqkbnr/pppppppp/9/8/8/8/PPPPPPPP/RNBQKBNR w',
+    'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNX w',
+    'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR x',
+    'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w - - 0 one',
+])
+def test_invalid_fen(fen):
+    with pytest.raises(ValueError):
+        ChessBoard.from_fen(fen)
+
+
+@pytest.mark.parametrize('seed', range(4))
+def test_san_round_trip(seed):
+    board = ChessBoard()
+    for move in _random_game(seed, max_moves=40)[1]:
+        for from_pos, to_pos in _all_moves(board):
+            san = format_san(board, from_pos, to_pos)
+            assert parse_san(board, san) == (from_pos, to_pos), san
+        board.make_move(*move)
+
+
+def test_san_examples():
+    board = ChessBoard()
+    assert parse_san(board, 'e4') == ((1, 4), (3, 4))
+    assert parse_san(board, 'Nf3') == ((0, 6), (2, 5))
+    assert format_san(board, (0, 1), (2, 2)) == 'Nc3'
+    for san in ('e4', 'd5'):
+        board.make_move(*parse_san(board, san))
+    assert format_san(board, (3, 4), (4, 3)) == 'exd5'
+    assert parse_san(board, 'exd5+') == ((3, 4), (4, 3))
+
+    board = ChessBoard.from_fen('4k3/8/8/8/8/8/4K3/R6R w - - 0 1')
+    assert format_san(board, (0, 0), (0, 3)) == 'Rad1'
+    assert parse_san(board, 'Rhf1') == ((0, 7), (0, 5))
+    with pytest.raises(ValueError):
+        parse_san(board, 'Rd1')
+
+
+@pytest.mark.parametrize('san', ['Qd4', 'e5', 'O-O', 'e8=Q', 'Kxe8', 'z9'])
+def test_unsupported_or_illegal_san(san):
+    with pytest.raises(ValueError):
+        parse_san(ChessBoard(), san)
+
+
+@pytest.mark.parametrize('start_fen', [None, '4k3/8/8/8/8/8/4P3/R3K2R b - - 0 12'])
+def test_written_game_replays(start_fen):
+    board = ChessBoard.from_fen(start_fen) if start_fen else ChessBoard()
+    rng = random.Random(5)
+    moves = []
+    while len(moves) < 80 and not board.is_game_over():
+        move = rng.choice(board.get_all_valid_moves())
+        moves.append(move)
+        board.make_move(*move)
+
+    out = io.StringIO()
+    result = write_game(out, moves, {'White': 'A "quoted" name', 'Event': 'test'}, start_fen=start_fen)
+    games = list(read_games(io.StringIO(out.getvalue() * 2)))
+    assert len(games) == 2
+    game = games[0]
+    assert game.headers['White'] == 'A "quoted" name'
+    assert game.headers['Result'] == result == game.result
+    replayed, plies, error = replay_game(game)
+    assert error is None
+    assert plies == len(moves)
+    assert replayed.to_fen() == board.to_fen()
+
+
+def test_board_history():
+    board, moves = _random_game(2, max_moves=20)
+    fen = board.to_fen()
+    assert board_history(board) == (None, moves)
+    assert board.to_fen() == fen
+    assert len(board.undo_stack) == len(moves)
+
+
+def test_board_history_after_trim():
+    board, moves = _random_game(3, max_moves=30)
+    board.trim_history(8)
+    start_fen, recent = board_history(board)
+    assert recent == moves[-8:]
+    replay = ChessBoard.from_fen(start_fen)
+    for move in recent:
+        replay.make_move(*move)
+    assert replay.to_fen() == board.to_fen()
@@ -0,0 +1,72 @@
+"""观战：消息只编码一次，按顺序分发给所有观战连接"""
+import asyncio
+
+from spectators import EncodedMessage, SpectatorGroup
+
+
+class FakeConnection:
+    def __init__(self, binary=False):
+        self.binary = binary
+        self.sent = []
+        self.closed_with = None
+
+    def send(self, data):
+        self.sent.append(data)
+        return True
+
+    def disconnect(self, reason, drain=False):
+        self.closed_with = (reason, drain)
+
+
+def test_message_is_encoded_once():
+    calls = []
+
+    def encode(data):
+        calls.append(data)
+        return b'frame'
+
+    message = EncodedMessage({"type": "move"}, encode)
+    assert message.for_connection(FakeConnection(binary=True)) == b'frame'
+    assert message.for_connection(FakeConnection(binary=True)) == b'frame'
+    assert message.text == '{"type": "move"}'
+    assert message.text is message.text
+    assert len(calls) == 1
+
+
+def test_group_fans_out_in_order_and_closes():
+    async def scenario():
+        group = SpectatorGroup(batch_size=2)
+        members = [FakeConnection(binary=index % 2 == 0) for index in range(5)]
+        for conn in members:
+            group.add(conn)
+        for seq in range(3):
+            group.publish(EncodedMessage({"seq": seq}, lambda data: bytes([data["seq"]])))
+        group.close("game over")
+        await asyncio.wait_for(group._task, 1)
+        return members, len(group)
+
+    members, remaining = asyncio.run(scenario())
+    for conn in members:
+        expected = [bytes([seq]) if conn.binary else f'{{"seq": {seq}}}' for seq in range(3)]
+        assert conn.sent == expected
+        assert conn.closed_with == ("game over", True)
+    assert remaining == 0
+
+
+def test_snapshot_is_cached_per_position():
+    async def scenario():
+        group = SpectatorGroup()
+        builds = []
+
+        def build():
+            builds.append(1)
+            return EncodedMessage({"type": "snapshot"}, lambda data: b'')
+
+        first = group.snapshot((1, 42), build)
+        assert group.snapshot((1, 42), build) is first
+        assert group.snapshot((2, 43), build) is not first
+        group.close("done")
+        await group._task
+        return len(builds)
+
+    assert asyncio.run(scenario()) == 2
@@ -0,0 +1,100 @@
+"""残局库：每个局面的结果与走一步之后的结果一致"""
+import random
+
+import pytest
+
+from chess_board import ChessBoard
+from tablebase import Tablebase, dependencies, generate, material_name, parse_material
+
+
+@pytest.fixture(scope='module')
+def tablebase(tmp_path_factory):
+    directory = tmp_path_factory.mktemp('tablebases')
+    generate(['KQK'], str(directory), workers=2, log=lambda message: None)
+    tablebase = Tablebase(str(directory))
+    yield tablebase
+    tablebase.close()
+
+
+def _random_board(rng, letters):
+    squares = rng.sample(range(64), len(letters))
+    placement = ['.'] * 64
+    for letter, square in zip(letters, squares):
+        placement[square] = letter
+    return ChessBoard.from_state((''.join(placement), 0, rng.choice(['white', 'black'])))
+
+
+def _after(tablebase, board, from_square, to_square):
+    """走一步之后从对方角度的结果，吃掉对方的王时返回None"""
+    from_pos, to_pos = divmod(from_square, 8), divmod(to_square, 8)
+    target = board.board[to_pos[0]][to_pos[1]]
+    if target is not None and target.type == 'king':
+        return None
+    board.make_move(from_pos, to_pos)
+    try:
+        return tablebase.probe(board)
+    finally:
+        board.unmake_move()
+
+
+def _moves(board):
+    return [(from_square, to_square) for from_square, targets in board.legal_move_map().items()
+            for to_square in range(64) if targets >> to_square & 1]
+
+
+def test_material_dependencies():
+    assert [material_name(material) for material in dependencies(parse_material('KQK'))] == ['KK', 'KQK']
+    assert [material_name(material) for material in dependencies(parse_material('KKQ'))] == ['KK', 'KQK']
+    with pytest.raises(ValueError):
+        parse_material('KPK')
+    with pytest.raises(ValueError):
+        parse_material('KQRKR')
+
+
+def test_results_are_consistent_with_successors(tablebase):
+    rng = random.Random(7)
+    checked = 0
+    while checked < 300:
+        board = _random_board(rng, rng.choice(['KQk', 'kqK']))
+        result = tablebase.probe(board)
+        assert result is not None
+        outcome, distance = result
+        successors = [_after(tablebase, board, *move) for move in _moves(board)]
+        if any(after is None for after in successors):
+            # 能直接吃王
+            assert result == ('win', 1)
+        elif outcome == 'win':
+            # 存在走到对方在distance-1步内判负的走法，并且没有更快的
+            losses = [after[1] for after in successors if after[0] == 'loss']
+            assert min(losses) == distance - 1
+        elif outcome == 'loss':
+            # 所有走法都让对方获胜，最慢的一种在distance-1步获胜
+            assert all(after[0] == 'win' for after in successors)
+            assert max(after[1] for after in successors) == distance - 1
+        else:
+            assert all(after[0] != 'loss' for after in successors)
+            assert any(after[0] == 'draw' for after in successors)
+        checked += 1
+
+
+def test_best_move_makes_progress(tablebase):
+    rng = random.Random(3)
+    for _ in range(50):
+        board = _random_board(rng, 'KQk')
+        outcome, distance = tablebase.probe(board)
+        if outcome != 'win':
+            continue
+        from_pos, to_pos = tablebase.best_move(board)
+        assert board.is_legal_move(from_pos, to_pos)
+        if distance == 1:
+            assert board.board[to_pos[0]][to_pos[1]].type == 'king'
+        else:
+            board.make_move(from_pos, to_pos)
+            assert tablebase.probe(board) == ('loss', distance - 1)
+
+
+def test_positions_outside_the_tablebase(tablebase):
+    assert tablebase.probe(ChessBoard()) is None
+    board = _random_board(random.Random(1), 'KRk')
+    assert tablebase.probe(board) is None
+    assert tablebase.best_move(board) is None
@@ -0,0 +1,71 @@
+"""置换表的替换策略和内存上限"""
+from transposition_table import ENTRY_BYTES, EXACT, LOWER_BOUND, TranspositionTable
+
+
+def _colliding_keys(table, count):
+    """映射到同一个槽位的不同键"""
+    return [table.size * i + 7 for i in range(1, count + 1)]
+
+
+def test_size_follows_memory_limit():
+    assert TranspositionTable(max_mb=1).size == 1024 * 1024 // ENTRY_BYTES
+    assert TranspositionTable(max_mb=4).size == 4 * 1024 * 1024 // ENTRY_BYTES
+    # 上限再小也至少有一个槽位
+    assert TranspositionTable(max_mb=0).size == 1
+
+
+def test_entries_never_exceed_slots():
+    table = TranspositionTable(max_mb=0.01)
+    for key in range(10 * table.size):
+        table.store(key, depth=key % 5, score=key)
+    assert len(table.slots) == table.size
+    assert sum(entry is not None for entry in table.slots) <= table.size
+
+
+def test_store_and_probe():
+    table = TranspositionTable(max_mb=1)
+    assert table.probe(12345) is None
+    table.store(12345, depth=3, score=42, flag=LOWER_BOUND, best_move=((1, 4), (3, 4)))
+    entry = table.probe(12345)
+    assert (entry.depth, entry.score, entry.flag, entry.best_move) == (3, 42, LOWER_BOUND, ((1, 4), (3, 4)))
+    assert (table.hits, table.misses) == (1, 1)
+
+
+def test_deeper_result_replaces_shallower():
+    table = TranspositionTable(max_mb=0.01)
+    shallow, deep = _colliding_keys(table, 2)
+    table.store(shallow, depth=2, score=10)
+    table.store(deep, depth=4, score=20)
+    assert table.probe(shallow) is None
+    assert table.probe(deep).score == 20
+
+
+def test_shallower_result_does_not_replace_deeper():
+    table = TranspositionTable(max_mb=0.01)
+    deep, shallow = _colliding_keys(table, 2)
+    table.store(deep, depth=4, score=20)
+    table.store(shallow, depth=2, score=10)
+    assert table.probe(shallow) is None
+    assert table.probe(deep).score == 20
+
+
+def test_same_position_keeps_deeper_result_and_best_move():
+    table = TranspositionTable(max_mb=1)
+    table.store(99, depth=5, score=30, best_move=((0, 1), (2, 2)))
+    table.store(99, depth=3, score=-30)
+    assert table.probe(99).score == 30
+    table.store(99, depth=6, score=50, flag=EXACT)
+    entry = table.probe(99)
+    assert (entry.depth, entry.score, entry.best_move) == (6, 50, ((0, 1), (2, 2)))
+
+
+def test_move_lists_do_not_evict_search_results():
+    table = TranspositionTable(max_mb=0.01)
+    searched, listed = _colliding_keys(table, 2)
+    moves = [((1, 4), (3, 4)), ((0, 6), (2, 5))]
+    table.store(searched, depth=1, score=5)
+    table.store_moves(listed, moves)
+    assert table.probe_moves(listed) is None
+    table.store_moves(searched, moves)
+    assert table.probe_moves(searched) == moves
+    assert table.probe(searched).score == 5
@@ -0,0 +1,110 @@
+"""二进制消息格式：编码后按协议文档解码应得到原来的内容"""
+import pytest
+
+from chess_bitboard import COLORS, PIECE_TYPES, position_of
+from chess_board import ChessBoard, PIECE_LETTERS
+from wire_protocol import (BLACK_FLAG, CLIENT_MOVE_FRAME, FRAME_GAME_OVER, FRAME_HINT, FRAME_MOVE,
+                           FRAME_RESYNC, FRAME_SNAPSHOT, GAME_OVER_FRAME, HINT_FRAME, MOVE_FRAME,
+                           RESYNC_FRAME, SNAPSHOT_HEADER, decode_client_frame, encode_message,
+                           encode_move, encode_snapshot, legal_move_list)
+
+
+def _decode_code(code):
+    """棋子编码还原为to_state布局中的字母"""
+    if code == 0:
+        return '.'
+    letter = PIECE_LETTERS[PIECE_TYPES[(code & ~BLACK_FLAG) - 1]]
+    return letter if code & BLACK_FLAG else letter.upper()
+
+
+def _decode_legal_moves(data):
+    """解析帧末尾的合法走法表"""
+    legal_moves = []
+    offset = 1
+    for _ in range(data[0]):
+        from_square, count = data[offset], data[offset + 1]
+        legal_moves.append([from_square, list(data[offset + 2:offset + 2 + count])])
+        offset += 2 + count
+    assert offset == len(data)
+    return legal_moves
+
+
+def _decode_server_frame(frame):
+    """按协议文档解析服务器发出的帧，相当于网页客户端的解码"""
+    frame_type = frame[0]
+    if frame_type == FRAME_MOVE:
+        _, seq, from_square, to_square, player = MOVE_FRAME.unpack_from(frame)
+        return {"type": "move", "seq": seq, "from": position_of(from_square),
+                "to": position_of(to_square), "current_player": COLORS[player],
+                "legal_moves": _decode_legal_moves(frame[MOVE_FRAME.size:])}
+    if frame_type == FRAME_SNAPSHOT:
+        _, seq, player = SNAPSHOT_HEADER.unpack_from(frame)
+        board = frame[SNAPSHOT_HEADER.size:SNAPSHOT_HEADER.size + 64]
+        return {"type": "snapshot", "seq": seq, "current_player": COLORS[player],
+                "board": ''.join(_decode_code(code) for code in board),
+                "legal_moves": _decode_legal_moves(frame[SNAPSHOT_HEADER.size + 64:])}
+    if frame_type == FRAME_GAME_OVER:
+        return {"type": "game_over", "winner": COLORS[GAME_OVER_FRAME.unpack(frame)[1]]}
+    if frame_type == FRAME_HINT:
+        _, from_square, to_square = HINT_FRAME.unpack(frame)
+        return {"type": "hint", "from": position_of(from_square), "to": position_of(to_square)}
+    raise AssertionError(f"unknown frame type {frame_type}")
+
+
+def test_move_frame_round_trip():
+    frame = encode_move(70000, (6, 4), (4, 4), 'black')
+    assert len(frame) == 9
+    assert _decode_server_frame(frame) == {"type": "move", "seq": 70000, "from": (6, 4),
+                                           "to": (4, 4), "current_player": 'black', "legal_moves": []}
+
+
+@pytest.mark.parametrize('data', [
+    {"type": "move", "seq": 3, "from": (0, 1), "to": (2, 2), "current_player": 'white',
+     "legal_moves": [[1, [16, 18]], [12, [20, 28]]]},
+    {"type": "game_over", "winner": 'black'},
+    {"type": "game_over", "winner": 'white'},
+    {"type": "hint", "from": (7, 7), "to": (0, 0)},
+])
+def test_message_round_trip(data):
+    assert _decode_server_frame(encode_message(data)) == data
+
+
+def test_messages_without_frame_type_are_not_encoded():
+    assert encode_message({"type": "error", "message": "x"}) is None
+
+
+def test_snapshot_round_trip():
+    board = ChessBoard()
+    for move in [((1, 4), (3, 4)), ((6, 3), (4, 3)), ((3, 4), (4, 3)), ((7, 3), (4, 3))]:
+        assert board.move_piece(*move)
+    placement, _, current_player = board.to_state()
+    assert _decode_server_frame(encode_snapshot(board)) == {
+        "type": "snapshot", "seq": board.ply, "current_player": current_player, "board": placement,
+        "legal_moves": legal_move_list(board)}
+
+
+def test_legal_move_list_matches_valid_moves():
+    board = ChessBoard()
+    assert board.move_piece((1, 4), (3, 4))
+    moves = sorted((position_of(from_square), position_of(to_square))
+                   for from_square, targets in legal_move_list(board) for to_square in targets)
+    assert moves == sorted(board.get_all_valid_moves())
+
+
+def test_client_frames():
+    assert decode_client_frame(CLIENT_MOVE_FRAME.pack(FRAME_MOVE, 12, 28)) == {
+        "type": "move", "from": (1, 4), "to": (3, 4)}
+    assert decode_client_frame(RESYNC_FRAME.pack(FRAME_RESYNC, 41)) == {"type": "resync", "seq": 41}
+    assert decode_client_frame(bytes([FRAME_HINT])) == {"type": "hint"}
+
+
+@pytest.mark.parametrize('frame', [
+    b'',
+    bytes([FRAME_MOVE, 12]),
+    CLIENT_MOVE_FRAME.pack(FRAME_MOVE, 12, 64),
+    bytes([FRAME_RESYNC, 0, 0]),
+    bytes([FRAME_SNAPSHOT]),
+    bytes([99, 1, 2]),
+])
+def test_malformed_client_frames_are_ignored(frame):
+    assert decode_client_frame(frame) is None
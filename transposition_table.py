@@ -0,0 +1,101 @@
+"""置换表：以Zobrist哈希为键缓存局面的走法列表和评估结果
+
+表的大小在创建时根据内存上限固定，发生冲突时按搜索深度替换（深度更大的结果优先保留）。
+"""
+
+# 评估值的类型
+EXACT = 0        # 精确值
+LOWER_BOUND = 1  # 下界（发生了beta截断）
+UPPER_BOUND = 2  # 上界（没有走法超过alpha）
+
+# 每个表项的估算内存（字节），包括表项对象和压缩后的走法列表
+ENTRY_BYTES = 200
+
+
+class TableEntry:
+    """置换表中的一项"""
+    __slots__ = ('key', 'depth', 'score', 'flag', 'best_move', 'moves')
+
+    def __init__(self, key, depth=-1, score=None, flag=EXACT, best_move=None, moves=None):
+        self.key = key
+        self.depth = depth          # 评估时的搜索深度，只有走法列表时为-1
+        self.score = score          # 评估值
+        self.flag = flag            # 评估值的类型
+        self.best_move = best_move  # 最佳走法 (起始位置, 目标位置)
+        self.moves = moves          # 压缩后的走法列表，每步两个字节（起点、终点格子编号）
+
+
+def pack_moves(moves):
+    """把 [((行, 列), (行, 列)), ...] 压缩为bytes"""
+    return bytes(square for from_pos, to_pos in moves
+                 for square in (from_pos[0] * 8 + from_pos[1], to_pos[0] * 8 + to_pos[1]))
+
+
+def unpack_moves(data):
+    """把pack_moves的结果还原为走法列表"""
+    return [(divmod(data[i], 8), divmod(data[i + 1], 8)) for i in range(0, len(data), 2)]
+
+
+class TranspositionTable:
+    """固定大小的置换表"""
+    def __init__(self, max_mb=16):
+        """
+        max_mb: 内存上限（MB），决定表项数量
+        """
+        self.size = max(1, int(max_mb * 1024 * 1024) // ENTRY_BYTES)
+        self.slots = [None] * self.size
+        self.hits = 0
+        self.misses = 0
+
+    def probe(self, key):
+        """
+        查找局面
+        返回: TableEntry，未找到时返回None
+        """
+        entry = self.slots[key % self.size]
+        if entry is not None and entry.key == key:
+            self.hits += 1
+            return entry
+        self.misses += 1
+        return None
+
+    def store(self, key, depth, score, flag=EXACT, best_move=None):
+        """
+        保存评估结果
+        槽位为空、是同一局面或新结果的深度不小于旧结果时才会写入
+        """
+        index = key % self.size
+        entry = self.slots[index]
+        if entry is not None and entry.key == key:
+            if depth >= entry.depth:
+                entry.depth = depth
+                entry.score = score
+                entry.flag = flag
+                entry.best_move = best_move or entry.best_move
+        elif entry is None or depth >= entry.depth:
+            self.slots[index] = TableEntry(key, depth, score, flag, best_move)
+
+    def probe_moves(self, key):
+        """
+        查找局面的走法列表
+        返回: 走法列表，未缓存时返回None
+        """
+        entry = self.probe(key)
+        if entry is None or entry.moves is None:
+            return None
+        return unpack_moves(entry.moves)
+
+    def store_moves(self, key, moves):
+        """保存局面的走法列表（只占用空槽位或同一局面的槽位，不覆盖其他局面的评估结果）"""
+        index = key % self.size
+        entry = self.slots[index]
+        if entry is not None and entry.key == key:
+            entry.moves = pack_moves(moves)
+        elif entry is None or entry.depth < 0:
+            self.slots[index] = TableEntry(key, moves=pack_moves(moves))
+
+    def clear(self):
+        """清空置换表"""
+        self.slots = [None] * self.size
+        self.hits = 0
+        self.misses = 0
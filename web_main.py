@@ -2,71 +2,664 @@ from fastapi import FastAPI, WebSocket, WebSocketDisconnect
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from fastapi import Request
+from fastapi.responses import PlainTextResponse
 import json
 from chess_board import ChessBoard
+from analysis_service import AnalysisService
+from client_connection import ClientConnection
+from game_bus import create_bus
+from game_clock import GameClock, TimerScheduler, parse_time_control
+from game_journal import GameJournal
+from pgn import board_history, write_game
+from spectators import EncodedMessage, SpectatorGroup
+from log_config import MOVE_LOGGER_NAME, log_event, setup_logging
+from metrics import REGISTRY, Counter, EventLoopLagMonitor, Gauge, Histogram, StackSampler
+from wire_protocol import decode_client_frame, encode_message, encode_snapshot, legal_move_list
 import asyncio
-from typing import Dict
+import io
+import itertools
+import os
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Dict, Optional, Set
 import logging
 
-app = FastAPI()
+# 引擎搜索在进程池中运行，进程数和每核并发搜索数可以通过环境变量配置
+analysis = AnalysisService(
+    max_workers=int(os.environ.get("CHESS_ANALYSIS_WORKERS", 0)) or None,
+    searches_per_core=int(os.environ.get("CHESS_SEARCHES_PER_CORE", 1)),
+    book_path=os.environ.get("CHESS_OPENING_BOOK", "opening_book.bin"),
+    tablebase_dir=os.environ.get("CHESS_TABLEBASES", "tablebases"),
+)
+
+# 对局日志：每步棋追加写入磁盘并定期保存快照，服务器重启后玩家重连时恢复对局
+journal = GameJournal(
+    directory=os.environ.get("CHESS_JOURNAL_DIR", "journal"),
+    flush_interval=float(os.environ.get("CHESS_JOURNAL_FLUSH", 0.05)),
+    snapshot_every=int(os.environ.get("CHESS_SNAPSHOT_EVERY", 32)),
+)
+
+# 消息总线：用 uvicorn --workers 运行多个进程时，同一对局的消息通过总线到达持有该对局连接的每个进程
+bus = create_bus(os.environ.get("CHESS_BUS", "local"))
+
+# 运行指标，通过 /metrics 以Prometheus文本格式输出
+MOVES = Counter("chess_moves_total", "处理的走法数，按结果分类", ["result"])
+MOVES_OK = MOVES.labels("ok")
+MOVES_INVALID = MOVES.labels("invalid")
+MOVE_APPLY_SECONDS = Histogram("chess_move_apply_seconds", "校验并执行一步棋的耗时（秒）")
+BROADCAST_SECONDS = Histogram("chess_broadcast_seconds", "把一条消息放入本进程该对局所有连接发送队列的耗时（秒）")
+MESSAGES = Counter("chess_messages_received_total", "收到的客户端消息数，按类型分类", ["type"])
+MESSAGE_TYPES = {"log", "move", "resync", "hint"}
+LOOP_LAG_SECONDS = Histogram("chess_event_loop_lag_seconds", "事件循环的调度延迟（秒）")
+lag_monitor = EventLoopLagMonitor(LOOP_LAG_SECONDS)
+# 设置 CHESS_PROFILER=1 时开放 /debug/profile 采样分析接口
+PROFILER_ENABLED = os.environ.get("CHESS_PROFILER") == "1"
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    analysis.start()
+    journal.start()
+    await bus.start()
+    lag_monitor.start()
+    clock_scheduler.start()
+    sweeper = asyncio.create_task(sweep_idle_games())
+    yield
+    sweeper.cancel()
+    await clock_scheduler.close()
+    lag_monitor.stop()
+    await bus.close()
+    await analysis.shutdown()
+    await journal.close()
+
+app = FastAPI(lifespan=lifespan)
 
 # 静态文件和模板配置
 app.mount("/static", StaticFiles(directory="static"), name="static")
 templates = Jinja2Templates(directory="templates")
 
-# 存储所有游戏会话
+# 存储所有游戏会话（本进程是主进程时为权威棋盘，否则为主进程同步来的副本）
 games: Dict[str, ChessBoard] = {}
+# 本进程作为主进程的对局：只有主进程执行走法、安排电脑走棋和写对局日志
+home_games: Set[str] = set()
+# 正在加入的对局（认领主进程或等待主进程同步局面），同一对局的多个连接共用一次加入
+joining: Dict[str, asyncio.Task] = {}
+# 等待主进程发来局面的对局
+pending_sync: Dict[str, asyncio.Future] = {}
+# 等待主进程同步局面的超时（秒），超时后重新尝试认领
+SYNC_TIMEOUT = 5.0
 # 存储WebSocket连接
-connections: Dict[str, Dict[str, WebSocket]] = {}
-
-# 配置日志
-logging.basicConfig(
-    filename='chess_game.log',
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    datefmt='%Y-%m-%d %H:%M:%S',
-    encoding='utf-8'  # 添加UTF-8编码设置
-)
-
-# 添加文件处理器和控制台处理器
-file_handler = logging.FileHandler('chess_game.log', encoding='utf-8')  # 添加UTF-8编码
-console_handler = logging.StreamHandler()
+connections: Dict[str, Dict[str, ClientConnection]] = {}
+# 观战连接：每个对局一个观战组，观战者不影响对局的生命周期
+spectators: Dict[str, SpectatorGroup] = {}
+# 正在为观战者同步的对局（本进程还没有该对局时），同一对局的多个观战者共用一次同步
+watching: Dict[str, asyncio.Task] = {}
+Gauge("chess_active_games", "本进程中的对局数", func=lambda: len(games))
+Gauge("chess_home_games", "本进程作为主进程的对局数", func=lambda: len(home_games))
+Gauge("chess_open_connections", "本进程中打开的WebSocket连接数",
+      func=lambda: sum(len(players) for players in connections.values()))
+Gauge("chess_spectators", "本进程中的观战连接数", func=lambda: sum(len(group) for group in spectators.values()))
+# 每个连接发送队列的最大长度和单条消息的发送超时（秒），超出的客户端会被断开
+SEND_QUEUE_SIZE = int(os.environ.get("CHESS_SEND_QUEUE_SIZE", 64))
+SEND_TIMEOUT = float(os.environ.get("CHESS_SEND_TIMEOUT", 5.0))
+# 与其他工作进程的消息总线断开，客户端稍后重连
+CLOSE_TRY_AGAIN_LATER = 1013
+# 观战连接发送队列的最大长度，跟不上的观战者会被断开
+SPECTATOR_QUEUE_SIZE = int(os.environ.get("CHESS_SPECTATOR_QUEUE_SIZE", 32))
+# WebSocket关闭码：观战的对局不存在
+CLOSE_GAME_NOT_FOUND = 4404
+# 存储坐在对局中的电脑玩家执子的颜色
+ai_players: Dict[str, str] = {}
+# 正在后台运行的任务，例如电脑走棋（保存引用，防止被回收）
+background_tasks: Set[asyncio.Task] = set()
+# 电脑每步的思考时间（秒）
+AI_TIME_LIMIT = float(os.environ.get("CHESS_AI_TIME", 1.0))
+# 超过这么长时间（秒）没有收到消息的对局被移出内存，连接被断开；对局日志保留，玩家重连后恢复
+GAME_IDLE_TIMEOUT = float(os.environ.get("CHESS_GAME_IDLE_TIMEOUT", 1800))
+# 本进程最多保存的对局数，达到上限时先移出最久没有活动的对局
+MAX_GAMES = int(os.environ.get("CHESS_MAX_GAMES", 100000))
+# 每个对局在内存中保留的撤销记录数（PGN导出从保留的最早一步开始）
+GAME_HISTORY = int(os.environ.get("CHESS_GAME_HISTORY", 256))
+# 检查空闲对局的间隔（秒）
+GAME_SWEEP_INTERVAL = 30.0
+# 对局最近一次活动的时间（time.monotonic()），按从早到晚的顺序排列
+game_activity: "OrderedDict[str, float]" = OrderedDict()
+# 新对局默认的时间控制，例如 "300+2"（每方300秒，每步加2秒），为空时不计时；
+# 连接时的 ?clock=300+2 参数可以为新对局单独指定
+DEFAULT_TIME_CONTROL = parse_time_control(os.environ.get("CHESS_TIME_CONTROL", ""))
+# 有时间控制的对局的棋钟，只在主进程中计时；所有棋钟的超时由一个调度任务处理
+clocks: Dict[str, GameClock] = {}
+clock_scheduler = TimerScheduler()
+Gauge("chess_running_clocks", "本进程中正在计时的棋钟数", func=lambda: len(clock_scheduler))
+TIMEOUTS = Counter("chess_clock_timeouts_total", "超时判负的对局数")
+GAMES_EVICTED = Counter("chess_games_evicted_total", "因空闲或数量上限被移出内存的对局数", ["reason"])
 
 # 设置控制台处理器的编码
 import sys
 sys.stdout.reconfigure(encoding='utf-8')  # 修改控制台输出编码
 
-# 创建格式化器
-formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-file_handler.setFormatter(formatter)
-console_handler.setFormatter(formatter)
-
-# 获取根记录器并添加处理器
+# 配置日志：记录放入队列，由后台线程写文件和控制台；每步棋的日志可以单独调整级别和采样率
+setup_logging(
+    filename=os.environ.get("CHESS_LOG_FILE", "chess_game.log"),
+    move_level=os.environ.get("CHESS_MOVE_LOG_LEVEL", "INFO").upper(),
+    move_sample_rate=float(os.environ.get("CHESS_MOVE_LOG_SAMPLE", 1.0)),
+    json_format=os.environ.get("CHESS_LOG_JSON") == "1",
+)
 logger = logging.getLogger()
-logger.addHandler(file_handler)
-logger.addHandler(console_handler)
+move_logger = logging.getLogger(MOVE_LOGGER_NAME)
 
 @app.get("/")
 async def root(request: Request):
     return templates.TemplateResponse("chess.html", {"request": request})
 
+@app.get("/metrics")
+async def metrics():
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/games/{game_id}.pgn")
+async def export_pgn(game_id: str):
+    """导出本进程中对局的PGN（从初始局面、恢复时的局面或保留的最早一步开始）"""
+    game = games.get(game_id)
+    if game is None:
+        return PlainTextResponse("Game not found", status_code=404)
+    start_fen, moves = board_history(game)
+    text = io.StringIO()
+    write_game(text, moves, {"Event": "Web Chess", "Site": game_id}, start_fen)
+    return PlainTextResponse(text.getvalue(), media_type="application/x-chess-pgn")
+
+@app.get("/debug/profile")
+async def profile(seconds: float = 10.0, interval: float = 0.005):
+    """采样一段时间内各线程的调用栈，返回折叠栈格式，可以直接生成火焰图"""
+    if not PROFILER_ENABLED:
+        return PlainTextResponse("Profiler disabled, set CHESS_PROFILER=1", status_code=404)
+    sampler = StackSampler(interval=max(interval, 0.001))
+    sampler.start()
+    try:
+        await asyncio.sleep(min(seconds, 300.0))
+    finally:
+        sampler.stop()
+    logger.info(f"Profile finished: {sampler.samples} samples")
+    return PlainTextResponse(sampler.render())
+
+def run_in_background(coro):
+    """创建后台任务并保存引用"""
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+
+def broadcast(game_id: str, data: dict):
+    """把消息发布到总线，每个持有该对局连接的进程都会把它发给本地的客户端"""
+    bus.publish(game_id, {"event": "client", "data": data})
+
+def deliver(game_id: str, data: dict):
+    """把消息放入本进程中该对局所有连接的发送队列，由各连接的写任务并发发送"""
+    with BROADCAST_SECONDS.time():
+        # JSON文本和二进制帧各只编码一次，所有玩家和观战者共用
+        message = EncodedMessage(data, encode_message)
+        for conn in list(connections.get(game_id, {}).values()):
+            conn.send(message.for_connection(conn))
+        # 观战者由观战组的任务分发，这里只是放入待发列表
+        group = spectators.get(game_id)
+        if group is not None:
+            group.publish(message)
+
+def send_to(conn: ClientConnection, data: dict):
+    """按连接使用的消息格式发送一条消息"""
+    conn.send(encode_message(data) if conn.binary else data)
+
+def snapshot_message(game: ChessBoard) -> dict:
+    """完整局面消息，客户端发现序号不连续时用来重新同步"""
+    placement, _, current_player = game.to_state()
+    return {"type": "snapshot", "seq": game.ply, "board": placement, "current_player": current_player,
+            "legal_moves": legal_move_list(game)}
+
+def publish_state(game_id: str):
+    """主进程把权威局面发布给持有副本的进程"""
+    game = games[game_id]
+    clock = clocks.get(game_id)
+    bus.publish(game_id, {"event": "state", "state": game.to_state(), "ply": game.ply,
+                          "ai": ai_players.get(game_id),
+                          "clock": clock.to_state() if clock is not None else None})
+
+def save_meta(game_id: str):
+    """把电脑执子颜色和棋钟写入对局日志的附加信息，随下一次快照保存"""
+    meta = {}
+    if game_id in ai_players:
+        meta["ai"] = ai_players[game_id]
+    if game_id in clocks:
+        meta["clock"] = clocks[game_id].to_state()
+    journal.set_meta(game_id, meta)
+
+def start_clock(game_id: str):
+    """按棋钟当前的行棋方安排超时检查"""
+    clock = clocks.get(game_id)
+    if clock is None or game_id not in home_games:
+        return
+    deadline = clock.deadline()
+    if deadline is None:
+        clock_scheduler.cancel(game_id)
+    else:
+        clock_scheduler.schedule(game_id, deadline, on_clock_expired)
+
+def on_clock_expired(game_id: str):
+    """调度器回调：行棋方的时间用完，判负并结束对局"""
+    clock = clocks.get(game_id)
+    if clock is None or game_id not in home_games:
+        return
+    loser = clock.flag()
+    if loser is None:
+        # 时间没有用完（例如刚刚走了棋），重新安排
+        start_clock(game_id)
+        return
+    winner = "white" if loser == "black" else "black"
+    TIMEOUTS.inc()
+    logger.info(f"Game {game_id} - {loser} ran out of time, winner: {winner}")
+    analysis.cancel(game_id)
+    publish_state(game_id)
+    broadcast(game_id, clock.to_message())
+    broadcast(game_id, {"type": "game_over", "winner": winner, "reason": "timeout"})
+    journal.discard(game_id)
+
+def on_bus_message(game_id: str, message: dict):
+    """处理订阅对局的总线消息"""
+    if message["event"] == "client":
+        deliver(game_id, message["data"])
+    elif message["event"] == "state" and game_id not in home_games:
+        # 更新棋盘副本，基于旧局面的提示搜索作废
+        games[game_id] = ChessBoard.from_state(tuple(message["state"]), ply=message["ply"])
+        if message.get("clock"):
+            clocks[game_id] = GameClock.from_state(message["clock"])
+        if game_id in game_activity:
+            touch_game(game_id)
+        if message["ai"]:
+            ai_players[game_id] = message["ai"]
+        analysis.cancel(game_id)
+        future = pending_sync.pop(game_id, None)
+        if future is not None and not future.done():
+            future.set_result(True)
+
+def on_home_message(game_id: str, message: dict):
+    """处理其他进程转发给主进程的请求"""
+    if game_id not in games:
+        return
+    if message["action"] == "move":
+        run_in_background(handle_move(game_id, message["player"],
+                                      tuple(message["from"]), tuple(message["to"])))
+    elif message["action"] == "sync":
+        publish_state(game_id)
+
+def on_orphan(game_id: str):
+    """对局的主进程已经退出：正在加入的连接重新认领，已有副本的进程尝试接管"""
+    future = pending_sync.pop(game_id, None)
+    if future is not None and not future.done():
+        future.set_result(False)
+    elif game_id in games and game_id not in home_games:
+        run_in_background(take_over(game_id))
+
+bus.on_message = on_bus_message
+bus.on_home_message = on_home_message
+bus.on_orphan = on_orphan
+
+async def become_home(game_id: str, ai: Optional[str], time_control: Optional[tuple] = None):
+    """本进程成为对局的主进程：已有副本时直接接管，否则从对局日志恢复或创建新对局"""
+    home_games.add(game_id)
+    if game_id in games:
+        logger.info(f"Game {game_id} - Took over as home process at ply {games[game_id].ply}")
+        save_meta(game_id)
+        journal.maybe_snapshot(game_id, games[game_id], force=True)
+    else:
+        restored = await journal.load(game_id)
+        if restored is not None:
+            games[game_id], meta = restored
+            if meta.get("ai"):
+                ai_players[game_id] = meta["ai"]
+            if meta.get("clock"):
+                # 停机期间不计时，等到下一步棋再继续
+                clocks[game_id] = GameClock.from_state(meta["clock"], running=False)
+            logger.info(f"Game {game_id} restored from journal at ply {games[game_id].ply}")
+        else:
+            games[game_id] = ChessBoard()
+            logger.info(f"New game created: {game_id}")
+            # 请求电脑对手时，由电脑执指定颜色
+            if ai in ("white", "black"):
+                ai_players[game_id] = ai
+                logger.info(f"Game {game_id} - AI seated as {ai}")
+            if time_control is not None:
+                clocks[game_id] = GameClock(*time_control)
+                logger.info(f"Game {game_id} - Time control {time_control[0]:g}+{time_control[1]:g}")
+            if game_id in ai_players or game_id in clocks:
+                # 立即保存一次快照，恢复时电脑仍然执同一颜色，时间控制不变
+                save_meta(game_id)
+                journal.maybe_snapshot(game_id, games[game_id], force=True)
+    start_clock(game_id)
+    publish_state(game_id)
+    schedule_ai_move(game_id)
+
+async def take_over(game_id: str):
+    """尝试接管失去主进程的对局"""
+    try:
+        if not await bus.claim(game_id):
+            return
+    except ConnectionError as e:
+        logger.error(f"Game {game_id} - Cannot take over: {e}")
+        return
+    if game_id not in connections:
+        # 认领期间本进程的玩家已经全部离开
+        bus.release(game_id)
+        return
+    await become_home(game_id, None)
+
+async def join_game(game_id: str, ai: Optional[str], time_control: Optional[tuple]):
+    """订阅对局，认领成为主进程，或者等待主进程同步当前局面"""
+    make_room(game_id)
+    bus.subscribe(game_id)
+    while game_id not in games:
+        if await bus.claim(game_id):
+            await become_home(game_id, ai, time_control)
+            break
+        future = asyncio.get_running_loop().create_future()
+        pending_sync[game_id] = future
+        bus.send_home(game_id, {"action": "sync"})
+        try:
+            await asyncio.wait_for(future, SYNC_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning(f"Game {game_id} - No state from home process, retrying")
+        finally:
+            if pending_sync.get(game_id) is future:
+                del pending_sync[game_id]
+    connections[game_id] = {}
+    touch_game(game_id)
+
+def log_invalid_move(game_id: str, player: str, from_pos: tuple, to_pos: tuple):
+    MOVES_INVALID.inc()
+    log_event(move_logger, logging.WARNING, "move_invalid", "Game %s - Player %s - Invalid move: %s -> %s",
+              game_id, player, from_pos, to_pos,
+              game_id=game_id, player=player, from_pos=from_pos, to_pos=to_pos)
+
+def touch_game(game_id: str):
+    """记录对局的活动时间"""
+    game_activity[game_id] = time.monotonic()
+    game_activity.move_to_end(game_id)
+
+def drop_game(game_id: str):
+    """把对局移出内存（对局日志保留在磁盘上），观战者收完已经广播的消息后断开"""
+    group = spectators.pop(game_id, None)
+    if group is not None:
+        group.close("game closed")
+    games.pop(game_id, None)
+    connections.pop(game_id, None)
+    ai_players.pop(game_id, None)
+    clocks.pop(game_id, None)
+    clock_scheduler.cancel(game_id)
+    game_activity.pop(game_id, None)
+    analysis.cancel(game_id)
+    bus.unsubscribe(game_id)
+    if game_id in home_games:
+        home_games.discard(game_id)
+        bus.release(game_id)
+        journal.release(game_id)
+
+def evict_game(game_id: str, reason: str):
+    """移出对局并断开它的所有连接，玩家重连时从对局日志恢复"""
+    logger.info(f"Game {game_id} - Evicted: {reason}")
+    GAMES_EVICTED.labels(reason).inc()
+    players = connections.get(game_id, {})
+    drop_game(game_id)
+    for conn in players.values():
+        conn.disconnect(f"game {reason}")
+
+def make_room(game_id: str):
+    """新对局加入前，对局数已达上限时移出最久没有活动的对局"""
+    excess = len(games) - MAX_GAMES + 1
+    if excess <= 0:
+        return
+    oldest = list(itertools.islice((other for other in game_activity if other != game_id), excess))
+    for other in oldest:
+        evict_game(other, "capacity")
+
+async def sweep_idle_games():
+    """定期移出空闲的对局"""
+    while True:
+        await asyncio.sleep(GAME_SWEEP_INTERVAL)
+        deadline = time.monotonic() - GAME_IDLE_TIMEOUT
+        while game_activity:
+            game_id, last_active = next(iter(game_activity.items()))
+            if last_active > deadline:
+                break
+            evict_game(game_id, "idle")
+
+def remove_connection(game_id: str, player: str, conn: ClientConnection):
+    """移除连接，没有玩家时同时移除对局"""
+    players = connections.get(game_id)
+    if players is None or players.get(player) is not conn:
+        return
+    players.pop(player)
+    if not players:
+        logger.info(f"Game {game_id} - No players left, removing game")
+        drop_game(game_id)
+
+async def watch_game(game_id: str) -> bool:
+    """
+    观战者所在的进程还没有该对局时，订阅对局并等待主进程同步局面（不创建新对局）
+    返回: 布尔值，对局是否存在
+    """
+    bus.subscribe(game_id)
+    future = asyncio.get_running_loop().create_future()
+    pending_sync[game_id] = future
+    bus.send_home(game_id, {"action": "sync"})
+    try:
+        await asyncio.wait_for(future, SYNC_TIMEOUT)
+    except asyncio.TimeoutError:
+        pass
+    finally:
+        if pending_sync.get(game_id) is future:
+            del pending_sync[game_id]
+    if game_id not in games:
+        if game_id not in connections:
+            bus.unsubscribe(game_id)
+        return False
+    connections.setdefault(game_id, {})
+    touch_game(game_id)
+    return True
+
+def spectator_snapshot(game_id: str) -> EncodedMessage:
+    """当前局面的快照消息，同一局面下所有新加入的观战者共用"""
+    game = games[game_id]
+    return spectators[game_id].snapshot(
+        (game.ply, game.zobrist_key),
+        lambda: EncodedMessage(snapshot_message(game), lambda _: encode_snapshot(game)))
+
+def remove_spectator(game_id: str, conn: ClientConnection):
+    """移除观战连接；本进程只为观战者保存的对局在最后一个观战者离开时移除"""
+    group = spectators.get(game_id)
+    if group is None:
+        return
+    group.discard(conn)
+    if len(group):
+        return
+    group.close("no spectators")
+    del spectators[game_id]
+    if connections.get(game_id) == {} and game_id not in joining:
+        logger.info(f"Game {game_id} - No players or spectators left, removing game")
+        drop_game(game_id)
+
+async def apply_move(game_id: str, player: str, from_pos: tuple, to_pos: tuple) -> bool:
+    """
+    执行一步棋并广播结果
+    返回: 布尔值，表示移动是否成功
+    """
+    game = games[game_id]
+    # 合法走法表每个局面只计算一次，校验只是一次查表；对局结束后（对局日志已经删除）走法表为空
+    # 只统计校验和执行的耗时，被拒绝的走法的日志和超时的广播不计入
+    clock = clocks.get(game_id)
+    with MOVE_APPLY_SECONDS.time():
+        legal = game.is_legal_move(from_pos, to_pos)
+        # 时间已经用完但调度器还没来得及处理时，press返回False
+        in_time = not legal or clock is None or clock.press(game.current_player)
+        if legal and in_time:
+            game.make_move(from_pos, to_pos)
+            game.trim_history(GAME_HISTORY)
+    if not legal:
+        log_invalid_move(game_id, player, from_pos, to_pos)
+        return False
+    if not in_time:
+        on_clock_expired(game_id)
+        return False
+    MOVES_OK.inc()
+    touch_game(game_id)
+
+    # 写入对局日志
+    journal.append(game_id, game.ply, from_pos, to_pos)
+    if clock is not None:
+        save_meta(game_id)
+    journal.maybe_snapshot(game_id, game)
+    publish_state(game_id)
+
+    # 记录成功的移动
+    log_event(move_logger, logging.INFO, "move_ok", "Game %s - Player %s - Move successful: %s -> %s",
+              game_id, player, from_pos, to_pos,
+              game_id=game_id, player=player, from_pos=from_pos, to_pos=to_pos)
+
+    # 广播移动信息
+    move_data = {
+        "type": "move",
+        "seq": game.ply,
+        "from": from_pos,
+        "to": to_pos,
+        "current_player": game.current_player,
+        # 新的行棋方的全部合法走法，客户端据此高亮和预先校验
+        "legal_moves": legal_move_list(game)
+    }
+    broadcast(game_id, move_data)
+
+    # 检查游戏是否结束
+    finished = game.is_king_captured(game.current_player)
+    if clock is not None:
+        if finished:
+            clock.stop()
+        start_clock(game_id)
+        broadcast(game_id, clock.to_message())
+    if finished:
+        winner = "white" if game.current_player == "black" else "black"
+        logger.info(f"Game {game_id} - Game over, winner: {winner}")
+        end_data = {
+            "type": "game_over",
+            "winner": winner,
+            "reason": "king_captured"
+        }
+        broadcast(game_id, end_data)
+        journal.discard(game_id)
+    return True
+
+async def play_ai_move(game_id: str):
+    """轮到电脑时把搜索交给进程池，然后走棋"""
+    ai_color = ai_players.get(game_id)
+    game = games.get(game_id)
+    if not ai_color or not game or game.current_player != ai_color or game.is_king_captured(ai_color):
+        return
+    time_limit = AI_TIME_LIMIT
+    clock = clocks.get(game_id)
+    if clock is not None:
+        if clock.flagged:
+            return
+        # 有时间控制时每步最多用剩余时间的1/20
+        time_limit = min(time_limit, clock.time_left(ai_color) / 20 + clock.increment / 2)
+    move = await analysis.search(game_id, game, ai_color, time_limit)
+    # 搜索期间对局可能已经被移除或局面已经改变
+    if move and games.get(game_id) is game and game.current_player == ai_color:
+        await apply_move(game_id, "ai", *move)
+
+def schedule_ai_move(game_id: str):
+    """在后台安排电脑走棋，不阻塞玩家的消息接收循环（只在主进程中进行）"""
+    if game_id not in ai_players or game_id not in home_games:
+        return
+    run_in_background(play_ai_move(game_id))
+
+async def handle_move(game_id: str, player: str, from_pos: tuple, to_pos: tuple):
+    """主进程处理玩家的走法（来自本进程的连接或其他进程转发）"""
+    game = games.get(game_id)
+    if game is None:
+        return
+    # 轮到电脑时不接受玩家替电脑走棋，超时结束的对局不再接受走棋
+    clock = clocks.get(game_id)
+    if game.current_player == ai_players.get(game_id) or (clock is not None and clock.flagged):
+        log_invalid_move(game_id, player, from_pos, to_pos)
+        return
+    if await apply_move(game_id, player, from_pos, to_pos):
+        # 局面已经改变，之前的分析作废
+        analysis.cancel(game_id)
+        schedule_ai_move(game_id)
+
+async def send_hint(game_id: str, player: str, conn: ClientConnection):
+    """在进程池中为当前行棋方搜索一步建议，局面在搜索期间没有变化时才发给客户端"""
+    game = games.get(game_id)
+    if game is None or game.current_player == ai_players.get(game_id):
+        return
+    key = game.zobrist_key
+    try:
+        # 每个玩家的提示单独占一个用途，不会取消电脑走棋或对方的提示
+        move = await analysis.search(game_id, game, game.current_player, AI_TIME_LIMIT,
+                                     purpose=f"hint:{player}")
+    except Exception as e:
+        logger.error(f"Game {game_id} - Hint search failed: {e}", exc_info=True)
+        return
+    if move and games.get(game_id) is game and game.zobrist_key == key:
+        send_to(conn, {"type": "hint", "from": move[0], "to": move[1]})
+
 @app.websocket("/ws/{game_id}/{player}")
-async def websocket_endpoint(websocket: WebSocket, game_id: str, player: str):
+async def websocket_endpoint(websocket: WebSocket, game_id: str, player: str, ai: Optional[str] = None,
+                             proto: Optional[str] = None, clock: Optional[str] = None):
     await websocket.accept()
     logger.info(f"Game {game_id} - Player {player} connected")
+    try:
+        time_control = parse_time_control(clock) if clock else DEFAULT_TIME_CONTROL
+    except ValueError:
+        logger.warning(f"Game {game_id} - Ignoring invalid time control: {clock}")
+        time_control = DEFAULT_TIME_CONTROL
 
-    # 初始化游戏
-    if game_id not in games:
-        games[game_id] = ChessBoard()
-        connections[game_id] = {}
-        logger.info(f"New game created: {game_id}")
+    # 初始化游戏：本进程还没有该对局的连接时加入对局
+    if game_id not in connections:
+        join_task = joining.get(game_id)
+        if join_task is None:
+            join_task = joining[game_id] = asyncio.create_task(join_game(game_id, ai, time_control))
+            join_task.add_done_callback(lambda _: joining.pop(game_id, None))
+        try:
+            await asyncio.shield(join_task)
+        except ConnectionError as e:
+            logger.error(f"Game {game_id} - Player {player} rejected: {e}")
+            await websocket.close(code=CLOSE_TRY_AGAIN_LATER)
+            return
 
-    connections[game_id][player] = websocket
+    # 连接因发送太慢被断开时，结束本连接的接收循环
+    endpoint_task = asyncio.current_task()
+    conn = ClientConnection(websocket, max_queue=SEND_QUEUE_SIZE, send_timeout=SEND_TIMEOUT,
+                            on_evict=lambda reason: endpoint_task.cancel(), binary=proto == "bin")
+    conn.start()
+    connections[game_id][player] = conn
+    touch_game(game_id)
+    # 使用二进制格式的客户端连接（包括重新连接）时先收到完整局面
+    if conn.binary:
+        conn.send(encode_snapshot(games[game_id]))
+    game_clock = clocks.get(game_id)
+    if game_clock is not None:
+        send_to(conn, game_clock.to_message())
+    schedule_ai_move(game_id)
+    # 本连接正在进行的提示搜索，在后台运行，不阻塞接收循环
+    hint_task = None
 
     try:
         while True:
-            message = await websocket.receive_text()
-            data = json.loads(message)
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
+            if message.get("bytes") is not None:
+                data = decode_client_frame(message["bytes"])
+                if data is None:
+                    continue
+            else:
+                data = json.loads(message["text"])
+            MESSAGES.labels(data["type"] if data["type"] in MESSAGE_TYPES else "other").inc()
+            touch_game(game_id)
 
             # 处理日志消息
             if data["type"] == "log":
@@ -75,49 +668,115 @@ async def websocket_endpoint(websocket: WebSocket, game_id: str, player: str):
 
             # 处理移动消息
             if data["type"] == "move":
-                game = games[game_id]
                 from_pos = tuple(data["from"])
                 to_pos = tuple(data["to"])
 
-                logger.info(f"Game {game_id} - Player {player} - Move attempt: from {from_pos} to {to_pos}")
-
-                if game.move_piece(from_pos, to_pos):
-                    # 记录成功的移动
-                    logger.info(f"Game {game_id} - Player {player} - Move successful: {from_pos} -> {to_pos}")
-
-                    # 广播移动信息
-                    move_data = {
-                        "type": "move",
-                        "from": from_pos,
-                        "to": to_pos,
-                        "current_player": game.current_player
-                    }
-
-                    for ws in connections[game_id].values():
-                        await ws.send_json(move_data)
-
-                    # 检查游戏是否结束
-                    if game.is_king_captured(game.current_player):
-                        winner = "white" if game.current_player == "black" else "black"
-                        logger.info(f"Game {game_id} - Game over, winner: {winner}")
-                        end_data = {
-                            "type": "game_over",
-                            "winner": winner
-                        }
-                        for ws in connections[game_id].values():
-                            await ws.send_json(end_data)
+                log_event(move_logger, logging.INFO, "move_attempt",
+                          "Game %s - Player %s - Move attempt: from %s to %s",
+                          game_id, player, from_pos, to_pos,
+                          game_id=game_id, player=player, from_pos=from_pos, to_pos=to_pos)
+
+                if game_id in home_games:
+                    await handle_move(game_id, player, from_pos, to_pos)
                 else:
-                    logger.warning(f"Game {game_id} - Player {player} - Invalid move: {from_pos} -> {to_pos}")
+                    # 对局的主进程是其他工作进程，把走法转发给它
+                    bus.send_home(game_id, {"action": "move", "player": player,
+                                            "from": from_pos, "to": to_pos})
+                continue
+
+            # 处理重新同步请求：客户端发现序号不连续，发送完整局面
+            if data["type"] == "resync":
+                game = games[game_id]
+                conn.send(encode_snapshot(game) if conn.binary else snapshot_message(game))
+                game_clock = clocks.get(game_id)
+                if game_clock is not None:
+                    send_to(conn, game_clock.to_message())
+                continue
+
+            # 处理提示请求：在后台任务中搜索，上一个提示还没算完时忽略
+            if data["type"] == "hint":
+                if hint_task is None or hint_task.done():
+                    hint_task = asyncio.create_task(send_hint(game_id, player, conn))
 
     except WebSocketDisconnect:
         logger.info(f"Game {game_id} - Player {player} disconnected")
-        connections[game_id].pop(player, None)
-        if not connections[game_id]:
-            logger.info(f"Game {game_id} - No players left, removing game")
-            games.pop(game_id, None)
-            connections.pop(game_id, None)
+    except ConnectionError as e:
+        logger.error(f"Game {game_id} - Player {player} closed: {e}")
+        try:
+            await websocket.close(code=CLOSE_TRY_AGAIN_LATER)
+        except Exception:
+            pass
+    except asyncio.CancelledError:
+        if not conn.evicted:
+            raise
+        asyncio.current_task().uncancel()
+        logger.warning(f"Game {game_id} - Player {player} evicted: {conn.evict_reason}")
     except Exception as e:
         logger.error(f"Game {game_id} - Error: {str(e)}", exc_info=True)
+    finally:
+        if hint_task is not None:
+            hint_task.cancel()
+        await conn.close()
+        remove_connection(game_id, player, conn)
+
+@app.websocket("/watch/{game_id}")
+async def spectator_endpoint(websocket: WebSocket, game_id: str, proto: Optional[str] = None):
+    """观战：只接收广播，不能走棋；加入时先收到当前局面的完整快照"""
+    await websocket.accept()
+    if game_id not in connections:
+        task = joining.get(game_id)
+        if task is None:
+            task = watching.get(game_id)
+            if task is None:
+                task = watching[game_id] = asyncio.create_task(watch_game(game_id))
+                task.add_done_callback(lambda _: watching.pop(game_id, None))
+        try:
+            await asyncio.shield(task)
+        except ConnectionError as e:
+            logger.error(f"Game {game_id} - Spectator rejected: {e}")
+            await websocket.close(code=CLOSE_TRY_AGAIN_LATER)
+            return
+    if game_id not in games or game_id not in connections:
+        await websocket.close(code=CLOSE_GAME_NOT_FOUND)
+        return
+
+    endpoint_task = asyncio.current_task()
+    conn = ClientConnection(websocket, max_queue=SPECTATOR_QUEUE_SIZE, send_timeout=SEND_TIMEOUT,
+                            on_evict=lambda reason: endpoint_task.cancel(), binary=proto == "bin")
+    conn.start()
+    group = spectators.get(game_id)
+    if group is None:
+        group = spectators[game_id] = SpectatorGroup()
+    group.add(conn)
+
+    def send_position():
+        conn.send(spectator_snapshot(game_id).for_connection(conn))
+        game_clock = clocks.get(game_id)
+        if game_clock is not None:
+            send_to(conn, game_clock.to_message())
+
+    send_position()
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+            if message.get("bytes") is not None:
+                data = decode_client_frame(message["bytes"])
+            else:
+                data = json.loads(message["text"])
+            # 观战者只能请求重新同步，其他消息忽略
+            if data and data.get("type") == "resync" and game_id in games:
+                send_position()
+    except asyncio.CancelledError:
+        if not conn.evicted:
+            raise
+        asyncio.current_task().uncancel()
+    except Exception as e:
+        logger.debug(f"Game {game_id} - Spectator error: {e}")
+    finally:
+        await conn.close()
+        remove_spectator(game_id, conn)
 
 if __name__ == "__main__":
     import uvicorn
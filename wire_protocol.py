@@ -0,0 +1,159 @@
+"""二进制消息格式：客户端用 /ws/{game_id}/{player}?proto=bin 连接时使用
+
+每帧的第一个字节是帧类型，整数均为小端序，格子编号为 row * 8 + col。
+
+服务器 -> 客户端
+- FRAME_MOVE      类型(1) 序号(4) 起点(1) 终点(1) 行棋方(1)        共8字节，后接合法走法表
+- FRAME_SNAPSHOT  类型(1) 序号(4) 行棋方(1) 64个格子的棋子编码(64)  共70字节，后接合法走法表
+- FRAME_GAME_OVER 类型(1) 胜方(1) 原因(1)
+- FRAME_HINT      类型(1) 起点(1) 终点(1)
+- FRAME_CLOCK     类型(1) 白方剩余毫秒(4) 黑方剩余毫秒(4) 正在计时的一方(1)，有时间控制的对局在每步棋之后发送
+客户端 -> 服务器
+- FRAME_MOVE      类型(1) 起点(1) 终点(1)
+- FRAME_RESYNC    类型(1) 客户端最后收到的序号(4)，请求完整局面
+- FRAME_HINT      类型(1)
+
+序号是对局已走的步数（ChessBoard.ply），每步加一。客户端发现序号不连续或重新连接时
+发送FRAME_RESYNC，服务器回复FRAME_SNAPSHOT。
+合法走法表是新的行棋方的全部合法走法：棋子数(1)，然后每个棋子为 起点(1) 目标数n(1) 目标(n)。
+棋子编码：0为空格，1-6依次为 king、queen、rook、bishop、knight、pawn，黑方再加8。
+行棋方和胜方：0为白方，1为黑方；正在计时的一方为2表示棋钟没有在走。
+结束原因：0为吃掉了王，1为超时。
+"""
+import struct
+
+from chess_bitboard import COLORS, PIECE_TYPES, iter_squares, position_of, square_of
+from chess_board import PIECE_LETTERS
+
+FRAME_MOVE = 1
+FRAME_SNAPSHOT = 2
+FRAME_GAME_OVER = 3
+FRAME_HINT = 4
+FRAME_RESYNC = 5
+FRAME_CLOCK = 6
+
+MOVE_FRAME = struct.Struct('<BIBBB')
+SNAPSHOT_HEADER = struct.Struct('<BIB')
+GAME_OVER_FRAME = struct.Struct('<BBB')
+CLOCK_FRAME = struct.Struct('<BIIB')
+HINT_FRAME = struct.Struct('<BBB')
+CLIENT_MOVE_FRAME = struct.Struct('<BBB')
+RESYNC_FRAME = struct.Struct('<BI')
+
+BLACK_FLAG = 8
+GAME_OVER_REASONS = ('king_captured', 'timeout')
+# 棋子字母（ChessBoard.to_state的布局）到编码的映射
+_LETTER_CODES = {'.': 0}
+for _index, _piece_type in enumerate(PIECE_TYPES):
+    _LETTER_CODES[PIECE_LETTERS[_piece_type].upper()] = _index + 1
+    _LETTER_CODES[PIECE_LETTERS[_piece_type]] = (_index + 1) | BLACK_FLAG
+_PLACEMENT_TABLE = bytes.maketrans(
+    ''.join(_LETTER_CODES).encode(), bytes(_LETTER_CODES.values()))
+_CODE_TABLE = bytes.maketrans(
+    bytes(_LETTER_CODES.values()), ''.join(_LETTER_CODES).encode())
+
+
+def legal_move_list(board):
+    """
+    行棋方的合法走法表，用于放入广播消息
+    返回: [[起点格子, [目标格子, ...]], ...]
+    """
+    return [[from_square, list(iter_squares(targets))]
+            for from_square, targets in board.legal_move_map().items()]
+
+
+def encode_legal_moves(legal_moves):
+    parts = [bytes([len(legal_moves)])]
+    for from_square, targets in legal_moves:
+        parts.append(bytes([from_square, len(targets), *targets]))
+    return b''.join(parts)
+
+
+def encode_move(seq, from_pos, to_pos, current_player, legal_moves=()):
+    return MOVE_FRAME.pack(FRAME_MOVE, seq, square_of(*from_pos), square_of(*to_pos),
+                           COLORS.index(current_player)) + encode_legal_moves(legal_moves)
+
+
+def encode_snapshot(board):
+    """把棋盘编码为完整局面帧"""
+    placement, _, current_player = board.to_state()
+    return (SNAPSHOT_HEADER.pack(FRAME_SNAPSHOT, board.ply, COLORS.index(current_player))
+            + placement.encode().translate(_PLACEMENT_TABLE)
+            + encode_legal_moves(legal_move_list(board)))
+
+
+def encode_message(data):
+    """
+    把广播用的JSON消息转为二进制帧
+    返回: bytes，没有对应帧类型的消息返回None
+    """
+    message_type = data["type"]
+    if message_type == "move":
+        return encode_move(data["seq"], data["from"], data["to"], data["current_player"],
+                           data.get("legal_moves", ()))
+    if message_type == "game_over":
+        return GAME_OVER_FRAME.pack(FRAME_GAME_OVER, COLORS.index(data["winner"]),
+                                    GAME_OVER_REASONS.index(data.get("reason", "king_captured")))
+    if message_type == "clock":
+        running = COLORS.index(data["running"]) if data["running"] else 2
+        return CLOCK_FRAME.pack(FRAME_CLOCK, data["white"], data["black"], running)
+    if message_type == "hint":
+        return HINT_FRAME.pack(FRAME_HINT, square_of(*data["from"]), square_of(*data["to"]))
+    return None
+
+
+def decode_client_frame(frame):
+    """
+    解析客户端发来的二进制帧
+    返回: 与JSON消息相同结构的字典，无法识别的帧返回None
+    """
+    if not frame:
+        return None
+    frame_type = frame[0]
+    if frame_type == FRAME_MOVE and len(frame) == CLIENT_MOVE_FRAME.size:
+        _, from_square, to_square = CLIENT_MOVE_FRAME.unpack(frame)
+        if from_square < 64 and to_square < 64:
+            return {"type": "move", "from": position_of(from_square), "to": position_of(to_square)}
+    elif frame_type == FRAME_RESYNC and len(frame) == RESYNC_FRAME.size:
+        return {"type": "resync", "seq": RESYNC_FRAME.unpack(frame)[1]}
+    elif frame_type == FRAME_HINT:
+        return {"type": "hint"}
+    return None
+
+
+def _decode_legal_moves(frame, offset):
+    legal_moves = []
+    count = frame[offset]
+    offset += 1
+    for _ in range(count):
+        from_square, n = frame[offset], frame[offset + 1]
+        legal_moves.append([from_square, list(frame[offset + 2:offset + 2 + n])])
+        offset += 2 + n
+    return legal_moves
+
+
+def decode_server_frame(frame):
+    """
+    解析服务器发来的二进制帧（供负载测试等Python客户端使用）
+    返回: 与JSON消息相同结构的字典，无法识别的帧返回None
+    """
+    frame_type = frame[0]
+    if frame_type == FRAME_MOVE:
+        _, seq, from_square, to_square, player = MOVE_FRAME.unpack_from(frame)
+        return {"type": "move", "seq": seq, "from": position_of(from_square), "to": position_of(to_square),
+                "current_player": COLORS[player], "legal_moves": _decode_legal_moves(frame, MOVE_FRAME.size)}
+    if frame_type == FRAME_SNAPSHOT:
+        _, seq, player = SNAPSHOT_HEADER.unpack_from(frame)
+        board_end = SNAPSHOT_HEADER.size + 64
+        placement = frame[SNAPSHOT_HEADER.size:board_end].translate(_CODE_TABLE).decode()
+        return {"type": "snapshot", "seq": seq, "board": placement, "current_player": COLORS[player],
+                "legal_moves": _decode_legal_moves(frame, board_end)}
+    if frame_type == FRAME_GAME_OVER:
+        return {"type": "game_over", "winner": COLORS[frame[1]], "reason": GAME_OVER_REASONS[frame[2]]}
+    if frame_type == FRAME_CLOCK:
+        _, white, black, running = CLOCK_FRAME.unpack(frame)
+        return {"type": "clock", "white": white, "black": black,
+                "running": COLORS[running] if running < 2 else None}
+    if frame_type == FRAME_HINT:
+        return {"type": "hint", "from": position_of(frame[1]), "to": position_of(frame[2])}
+    return None